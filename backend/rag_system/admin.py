@@ -7,6 +7,7 @@ from .models import (
     Question,
     Answer,
     UserFeedback,
+    IngestionJob,
 )
 
 
@@ -24,6 +25,7 @@ class DocumentChunkAdmin(admin.ModelAdmin):
     list_filter = ["document", "created_at"]
     search_fields = ["content"]
     readonly_fields = ["id", "created_at"]
+    raw_id_fields = ["canonical"]
 
 
 @admin.register(Conversation)
@@ -90,3 +92,19 @@ class UserFeedbackAdmin(admin.ModelAdmin):
         )
 
     answer_preview.short_description = "回答"
+
+
+@admin.register(IngestionJob)
+class IngestionJobAdmin(admin.ModelAdmin):
+    list_display = [
+        "document",
+        "status",
+        "processed_chunks",
+        "total_chunks",
+        "attempts",
+        "created_at",
+        "finished_at",
+    ]
+    list_filter = ["status", "created_at"]
+    search_fields = ["document__title", "error"]
+    readonly_fields = ["id", "created_at", "started_at", "finished_at"]
@@ -0,0 +1,164 @@
+# backend/rag_system/answer_cache.py
+import copy
+import hashlib
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from .embedding_store import normalize
+
+CACHE_KEY_PREFIX = "rag:answer"
+_TRAILING_PUNCTUATION = "?？!！。.、,， "
+
+
+def normalize_question(text: str) -> str:
+    """表記ゆれ（全角半角・大小文字・空白・末尾の記号）を吸収したキー用の質問文"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip(_TRAILING_PUNCTUATION)
+
+
+class AnswerCache:
+    """正規化した質問文とコーパスのバージョンをキーにした回答キャッシュ
+
+    プロセス内の LRU を一次キャッシュとし、shared_backend（Django のキャッシュ）を
+    指定した場合は完全一致のエントリをプロセス間でも共有する。
+    similarity_threshold を指定すると、完全一致しない場合に同じバージョンの
+    エントリから質問の埋め込みのコサイン類似度が閾値以上のものを探す。
+    ドキュメントの追加・削除でバージョンが変わると、古いエントリには当たらない。
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        similarity_threshold: Optional[float] = None,
+        shared_backend=None,
+        timeout: Optional[int] = None,
+    ):
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.shared_backend = shared_backend
+        self.timeout = timeout
+        self._entries: "OrderedDict[Tuple[int, str], Dict[str, Any]]" = OrderedDict()
+        self._embeddings: Dict[Tuple[int, str], np.ndarray] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def uses_embeddings(self) -> bool:
+        return self.similarity_threshold is not None
+
+    def _shared_key(self, key: Tuple[int, str]) -> str:
+        digest = hashlib.sha256(key[1].encode("utf-8")).hexdigest()
+        return f"{CACHE_KEY_PREFIX}:{key[0]}:{digest}"
+
+    def get(
+        self,
+        question: str,
+        version: int,
+        embedding: Optional[Sequence[float]] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """キャッシュ済みの回答を返す（なければ None）"""
+        key = (version, normalize_question(question))
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+
+        if result is None and self.shared_backend is not None:
+            result = self.shared_backend.get(self._shared_key(key))
+            if result is not None:
+                self._remember(key, result, None)
+
+        if result is None and embedding is not None and self.uses_embeddings:
+            result = self._get_similar(version, normalize(embedding))
+
+        with self._lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return copy.deepcopy(result)
+
+    def _get_similar(self, version: int, query: np.ndarray) -> Optional[Dict]:
+        """同じバージョンで質問の埋め込みが最も近いエントリ（閾値以上のみ）"""
+        with self._lock:
+            keys = [key for key in self._embeddings if key[0] == version]
+            if not keys:
+                return None
+            scores = np.stack([self._embeddings[key] for key in keys]) @ query
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity_threshold:
+                return None
+            self._entries.move_to_end(keys[best])
+            return self._entries[keys[best]]
+
+    def set(
+        self,
+        question: str,
+        version: int,
+        result: Dict[str, Any],
+        embedding: Optional[Sequence[float]] = None,
+    ):
+        """回答をキャッシュに登録"""
+        key = (version, normalize_question(question))
+        result = copy.deepcopy(result)
+        self._remember(key, result, embedding)
+        if self.shared_backend is not None:
+            self.shared_backend.set(self._shared_key(key), result, self.timeout)
+
+    def _remember(self, key, result, embedding):
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            if embedding is not None and self.uses_embeddings:
+                self._embeddings[key] = normalize(embedding)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._embeddings.pop(evicted, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._embeddings.clear()
+
+
+_cache: Optional[AnswerCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> Optional[AnswerCache]:
+    """設定に従ったプロセス共有の回答キャッシュ（無効なら None）"""
+    global _cache
+    if settings.RAG_ANSWER_CACHE_SIZE <= 0:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            shared_backend = None
+            if settings.RAG_ANSWER_CACHE_BACKEND:
+                from django.core.cache import caches
+
+                shared_backend = caches[settings.RAG_ANSWER_CACHE_BACKEND]
+            _cache = AnswerCache(
+                max_entries=settings.RAG_ANSWER_CACHE_SIZE,
+                similarity_threshold=settings.RAG_ANSWER_CACHE_SIMILARITY,
+                shared_backend=shared_backend,
+                timeout=settings.RAG_ANSWER_CACHE_TIMEOUT,
+            )
+    return _cache
+
+
+def reset_answer_cache():
+    """キャッシュを破棄（次回アクセス時に作り直す）"""
+    global _cache
+    with _cache_lock:
+        _cache = None
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class RagSystemConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rag_system'
+
+    def ready(self):
+        from . import signals  # noqa: F401
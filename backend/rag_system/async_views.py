@@ -0,0 +1,111 @@
+# backend/rag_system/async_views.py
+import json
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.http import Http404, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from .models import Answer, Conversation, Question
+from .serializers import QuestionCreateSerializer, QuestionSerializer
+from .services import RAGService
+
+# ASGI サーバーで動かすと、LLM の応答待ちの間もイベントループが他の
+# リクエストを処理できるため、1ワーカーで多数の質問を同時に扱える。
+# DRF のビューは同期のみのため、素の Django 非同期ビューとして実装する。
+
+
+def _parse_question(request):
+    """リクエストボディを QuestionCreateSerializer で検証"""
+    try:
+        data = json.loads(request.body or b"{}")
+    except ValueError:
+        return None, {"detail": "JSONの形式が正しくありません。"}
+    serializer = QuestionCreateSerializer(data=data)
+    if not serializer.is_valid():
+        return None, serializer.errors
+    return serializer.validated_data, None
+
+
+async def _get_default_user():
+    # デフォルトユーザーを取得または作成（開発用）
+    user, created = await User.objects.aget_or_create(
+        username="testuser", defaults={"email": "test@example.com"}
+    )
+    return user
+
+
+async def _answer(question: Question, user) -> dict:
+    """回答を生成して保存し、シリアライズした質問を返す"""
+    result = await RAGService().aanswer_question(question.text, user)
+    await Answer.objects.acreate(
+        question=question,
+        text=result["answer"],
+        sources=result["sources"],
+        model_used=result["model_used"],
+        processing_time=result["processing_time"],
+    )
+    return await sync_to_async(lambda: QuestionSerializer(question).data)()
+
+
+@csrf_exempt
+@require_POST
+async def ask(request):
+    """質問を送信して回答を取得（/api/ask/ask/ の非同期版）"""
+    data, errors = _parse_question(request)
+    if errors:
+        return JsonResponse(errors, status=400)
+
+    question_text = data["text"]
+    user = await _get_default_user()
+
+    # 会話を取得または作成
+    if data.get("conversation_id"):
+        try:
+            conversation = await Conversation.objects.aget(id=data["conversation_id"])
+        except Conversation.DoesNotExist:
+            raise Http404
+    else:
+        conversation = await Conversation.objects.acreate(
+            user=user,
+            title=question_text[:50] + ("..." if len(question_text) > 50 else ""),
+        )
+
+    question = await Question.objects.acreate(
+        conversation=conversation, text=question_text, user=user
+    )
+    response_data = {
+        "question": await _answer(question, user),
+        "conversation_id": str(conversation.id),
+    }
+    return JsonResponse(response_data, status=201)
+
+
+@csrf_exempt
+@require_POST
+async def ask_question(request, pk):
+    """会話に質問を追加（/api/conversations/<id>/ask_question/ の非同期版）"""
+    try:
+        conversation = await Conversation.objects.aget(id=pk)
+    except Conversation.DoesNotExist:
+        raise Http404
+
+    data, errors = _parse_question(request)
+    if errors:
+        return JsonResponse(errors, status=400)
+
+    question_text = data["text"]
+    user = await _get_default_user()
+    question = await Question.objects.acreate(
+        conversation=conversation, text=question_text, user=user
+    )
+
+    # 会話のタイトルを自動生成（最初の質問の場合）
+    if not conversation.title and await conversation.questions.acount() == 1:
+        conversation.title = question_text[:50] + (
+            "..." if len(question_text) > 50 else ""
+        )
+        await conversation.asave()
+
+    return JsonResponse(await _answer(question, user), status=201)
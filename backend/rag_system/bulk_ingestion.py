@@ -0,0 +1,301 @@
+# backend/rag_system/bulk_ingestion.py
+import json
+import signal
+import threading
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    as_completed,
+    wait,
+)
+from pathlib import Path
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
+
+import numpy as np
+from django.conf import settings
+from django.db import connections, transaction
+
+from . import pg_search
+from .chunking import chunk_hash, iter_text_chunks
+from .dedup import get_duplicate_detector, minhash, save_buckets
+from .embedding_cache import get_embedding_cache
+from .embedding_store import get_embedding_store
+from .ingestion import _capture_prefix, iter_extracted_text
+from .models import CorpusChange, Document, DocumentChunk
+from .services import MockAIService
+from .tokenizer import join_tokens, tokenize
+
+SUPPORTED_SUFFIXES = (".txt", ".md", ".pdf")
+
+
+class SourceItem(NamedTuple):
+    """取り込み元の1件（ファイルのパス、または JSONL の1行の本文）"""
+
+    source: str
+    title: str
+    path: Optional[str] = None
+    content: Optional[str] = None
+
+
+class PreparedDocument(NamedTuple):
+    """ワーカーで抽出・チャンク分割・埋め込み生成まで済ませたドキュメント"""
+
+    source: str
+    title: str
+    content: str  # Document.content に保存する先頭部分
+    file_type: str
+    chunks: List[str]
+    tokens: List[str]  # チャンクごとの検索用トークン（空白区切り）
+    embeddings: np.ndarray
+    signatures: List[np.ndarray]  # チャンクごとの MinHash シグネチャ
+
+
+def iter_source_items(path: Path) -> Iterator[SourceItem]:
+    """ディレクトリ配下のファイル、または JSONL の各行を取り込み元として列挙
+
+    JSONL の各行は {"title": ..., "content": ...}（"id" があれば取り込み元の
+    識別に使う）。
+    """
+    path = path.resolve()
+    if path.is_dir():
+        for file_path in sorted(path.rglob("*")):
+            if file_path.is_file() and file_path.suffix in SUPPORTED_SUFFIXES:
+                yield SourceItem(str(file_path), file_path.name, path=str(file_path))
+        return
+
+    with path.open(encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            source = f"{path}#{record.get('id', line_number)}"
+            yield SourceItem(
+                source,
+                record.get("title") or f"{path.stem} {line_number}",
+                content=record.get("content", ""),
+            )
+
+
+def prepare_document(item: SourceItem) -> PreparedDocument:
+    """テキスト抽出・チャンク分割・トークン分割・埋め込み生成（ワーカーで実行）
+
+    DBには触れない（書き込みは呼び出し元の1プロセスだけが行う）。
+    """
+    if item.path is not None:
+        blocks = iter_extracted_text(Path(item.path))
+        file_type = Path(item.path).suffix.lstrip(".") or "text"
+    else:
+        blocks = [item.content or ""]
+        file_type = "text"
+    prefix: List[str] = []
+    blocks = _capture_prefix(blocks, prefix, settings.RAG_DOCUMENT_CONTENT_LIMIT)
+    chunks = list(iter_text_chunks(blocks))
+
+    # 埋め込みキャッシュはDBを使うため、ワーカーでは直接生成する
+    # （キャッシュへの登録は保存するプロセスが write_documents で行う）
+    embeddings = MockAIService()._generate_embeddings(chunks)
+    return PreparedDocument(
+        item.source,
+        item.title,
+        "".join(prefix),
+        file_type,
+        chunks,
+        [join_tokens(tokenize(chunk)) for chunk in chunks],
+        np.asarray(embeddings, dtype=np.float32).reshape(len(chunks), -1),
+        [minhash(chunk) for chunk in chunks],
+    )
+
+
+def ingested_sources() -> Set[str]:
+    """取り込み済みの取り込み元（再実行時に飛ばす）"""
+    return set(
+        Document.objects.exclude(source="").values_list("source", flat=True).iterator()
+    )
+
+
+def write_documents(prepared: List[PreparedDocument], user) -> int:
+    """ドキュメントとチャンクをまとめて保存し、保存したチャンク数を返す
+
+    1バッチを1トランザクションで保存するため、中断してもドキュメントが
+    チャンクの途中までしか保存されないことはない。近似重複のチャンクは
+    代表チャンクを参照させ、埋め込みストアには追記しない。ワーカーで生成した
+    埋め込みは埋め込みキャッシュにも登録する（更新時の再取り込みなどで使う）。
+    """
+    documents = [
+        Document(
+            title=document.title[:255],
+            content=document.content,
+            file_type=document.file_type,
+            uploaded_by=user,
+            is_processed=True,
+            source=document.source,
+        )
+        for document in prepared
+    ]
+    chunks, signatures, vectors = [], [], {}
+    for document, prepared_document in zip(documents, prepared):
+        for i, (content, tokens, signature, vector) in enumerate(
+            zip(
+                prepared_document.chunks,
+                prepared_document.tokens,
+                prepared_document.signatures,
+                prepared_document.embeddings,
+            )
+        ):
+            chunk = DocumentChunk(
+                document=document,
+                content=content,
+                chunk_index=i,
+                search_tokens=tokens,
+                content_hash=chunk_hash(content),
+            )
+            chunks.append(chunk)
+            signatures.append(signature)
+            vectors[chunk.id] = vector
+
+    detector = get_duplicate_detector()
+    originals = detector.assign(chunks, signatures) if detector else chunks
+    # ストアへの追記はトランザクション外（ロールバック時は参照されない行が残るだけ）
+    if originals:
+        rows = get_embedding_store().append(
+            np.stack([vectors[chunk.id] for chunk in originals])
+        )
+        for chunk, row in zip(originals, rows):
+            chunk.embedding_row = row
+    for chunk in chunks:
+        if chunk.canonical is not None:
+            chunk.embedding_row = chunk.canonical.embedding_row
+
+    with transaction.atomic():
+        Document.objects.bulk_create(documents)
+        DocumentChunk.objects.bulk_create(chunks, batch_size=500)
+        if detector:
+            save_buckets(originals)
+        pg_search.store_vectors((chunk.id, vectors[chunk.id]) for chunk in originals)
+        cache = get_embedding_cache(MockAIService.embedding_model)
+        if cache is not None:
+            cache.add(
+                [chunk.content for chunk in chunks],
+                [vectors[chunk.id] for chunk in chunks],
+            )
+        # 検索インデックスへはコミット後の変更ログで公開する
+        CorpusChange.record_many([document.id for document in documents], "add")
+    return len(chunks)
+
+
+def _init_worker():
+    # Ctrl+C は親プロセスが受けて、投入済みの分を保存してから止める
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # spawn 方式で起動された場合はDjangoを初期化し直す
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+
+
+def _result(future, source: str):
+    try:
+        return source, future.result(), None
+    except Exception as exc:
+        return source, None, exc
+
+
+def _prepare_all(
+    items: Iterable[SourceItem], workers: int
+) -> Iterator[Tuple[str, Optional[PreparedDocument], Optional[Exception]]]:
+    """前処理した結果を (取り込み元, 結果, 例外) で完了順に返す
+
+    ワーカーへの投入は workers の数倍までに抑え、入力全体を抱え込まない。
+    workers が0ならこのプロセスで順に処理する。
+    """
+    if workers <= 0:
+        for item in items:
+            try:
+                yield item.source, prepare_document(item), None
+            except Exception as exc:
+                yield item.source, None, exc
+        return
+
+    # 子プロセスへDB接続を引き継がないよう閉じてから起動する
+    connections.close_all()
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+    in_flight: Dict[Future, str] = {}
+    try:
+        for item in items:
+            in_flight[executor.submit(prepare_document, item)] = item.source
+            if len(in_flight) >= workers * 4:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield _result(future, in_flight.pop(future))
+        for future in as_completed(list(in_flight)):
+            yield _result(future, in_flight.pop(future))
+    finally:
+        # 中断時は処理待ちを捨てる（保存済みのバッチは再実行時に飛ばされる）
+        executor.shutdown(cancel_futures=True)
+
+
+def ingest(
+    items: Iterable[SourceItem],
+    user,
+    workers: int = 4,
+    batch_chunks: int = 1000,
+    on_write: Optional[Callable[[int, int], None]] = None,
+    on_error: Optional[Callable[[str, Exception], None]] = None,
+    stop: Optional[threading.Event] = None,
+) -> Tuple[int, int]:
+    """取り込み元をプロセスプールで並列に前処理し、このプロセスでまとめて保存
+
+    batch_chunks 件以上のチャンクが溜まるたびに保存し、on_write を
+    （累計ドキュメント数, 累計チャンク数）で呼ぶ。前処理に失敗した取り込み元は
+    on_error に渡して飛ばす（保存されないので再実行時にやり直す）。
+    取り込み済みの取り込み元は飛ばすため、中断しても再実行で続きから取り込める。
+    stop がセットされたら新たな投入をやめ、処理中の分を保存して戻る。
+    """
+    skip = ingested_sources()
+
+    def new_items():
+        for item in items:
+            if stop is not None and stop.is_set():
+                return
+            if item.source not in skip:
+                skip.add(item.source)
+                yield item
+
+    pending: List[PreparedDocument] = []
+    pending_chunks = 0
+    written_documents = written_chunks = 0
+
+    def flush():
+        nonlocal pending, pending_chunks, written_documents, written_chunks
+        if not pending:
+            return
+        written_chunks += write_documents(pending, user)
+        written_documents += len(pending)
+        pending, pending_chunks = [], 0
+        if on_write:
+            on_write(written_documents, written_chunks)
+
+    for source, prepared, error in _prepare_all(new_items(), workers):
+        if error is not None:
+            if on_error is None:
+                raise error
+            on_error(source, error)
+            continue
+        pending.append(prepared)
+        pending_chunks += len(prepared.chunks)
+        if pending_chunks >= batch_chunks:
+            flush()
+    flush()
+    return written_documents, written_chunks
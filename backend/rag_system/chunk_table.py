@@ -0,0 +1,165 @@
+# backend/rag_system/chunk_table.py
+import threading
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from uuid import UUID
+
+SNIPPET_LENGTH = 200  # 検索結果に載せるチャンク本文の文字数
+
+
+class ChunkRecord(NamedTuple):
+    """検索結果の整形に使うチャンクの軽量な情報"""
+
+    id: UUID
+    document_id: UUID
+    document_title: str
+    snippet: str
+
+
+def make_snippet(content: str) -> str:
+    """チャンク本文の先頭を検索結果用の抜粋にする"""
+    return (
+        content[:SNIPPET_LENGTH] + "..." if len(content) > SNIPPET_LENGTH else content
+    )
+
+
+class ChunkTable:
+    """チャンクID → (ドキュメントID, 抜粋) とドキュメントのタイトルの表（プロセス内常駐）
+
+    検索結果の上位チャンクから参照元や抜粋を作るたびにORMで本文・埋め込みを
+    含む行全体を読み込まないよう、必要な項目だけを保持する。
+    検索インデックスと同じく CorpusChange で同期する。
+    """
+
+    def __init__(self):
+        self._chunks: Dict[UUID, Tuple[UUID, str]] = {}
+        self._titles: Dict[UUID, str] = {}
+        self._document_chunks: Dict[UUID, set] = {}
+        self._lock = threading.RLock()
+        self.synced_version = 0  # 反映済みの CorpusChange ID
+
+    def __len__(self):
+        return len(self._chunks)
+
+    def __contains__(self, chunk_id: UUID) -> bool:
+        return chunk_id in self._chunks
+
+    def chunk_ids_for_document(self, document_id: UUID) -> set:
+        """ドキュメントに属する登録済みチャンクID"""
+        with self._lock:
+            return set(self._document_chunks.get(document_id, ()))
+
+    def add_chunk(self, chunk_id: UUID, document_id: UUID, content: str):
+        """チャンクを登録（content は先頭 SNIPPET_LENGTH+1 文字あれば足りる）"""
+        with self._lock:
+            if chunk_id in self._chunks:
+                self.remove_chunk(chunk_id)
+            self._chunks[chunk_id] = (document_id, make_snippet(content))
+            self._document_chunks.setdefault(document_id, set()).add(chunk_id)
+
+    def remove_chunk(self, chunk_id: UUID):
+        """チャンクを表から削除"""
+        with self._lock:
+            entry = self._chunks.pop(chunk_id, None)
+            if entry is None:
+                return
+            document_id = entry[0]
+            siblings = self._document_chunks.get(document_id)
+            if siblings is not None:
+                siblings.discard(chunk_id)
+                if not siblings:
+                    del self._document_chunks[document_id]
+
+    def remove_document(self, document_id: UUID):
+        """ドキュメントに属する全チャンクを削除"""
+        with self._lock:
+            for chunk_id in list(self._document_chunks.get(document_id, ())):
+                self.remove_chunk(chunk_id)
+
+    def set_titles(self, titles: Iterable[Tuple[UUID, str]]):
+        """ドキュメントのタイトルを登録・更新"""
+        with self._lock:
+            self._titles.update(titles)
+
+    def remove_titles(self, document_ids: Iterable[UUID]):
+        """削除されたドキュメントのタイトルを破棄"""
+        with self._lock:
+            for document_id in document_ids:
+                self._titles.pop(document_id, None)
+
+    def get_many(self, chunk_ids: Iterable[UUID]) -> Dict[UUID, ChunkRecord]:
+        """登録済みのチャンクの情報をまとめて取得"""
+        records = {}
+        with self._lock:
+            for chunk_id in chunk_ids:
+                entry = self._chunks.get(chunk_id)
+                if entry is not None:
+                    document_id, snippet = entry
+                    records[chunk_id] = ChunkRecord(
+                        chunk_id,
+                        document_id,
+                        self._titles.get(document_id, ""),
+                        snippet,
+                    )
+        return records
+
+
+def snippet_rows(queryset):
+    """(チャンクID, ドキュメントID, 抜粋に必要な先頭部分) を返すクエリ"""
+    from django.db.models.functions import Substr
+
+    return queryset.values_list(
+        "id", "document_id", Substr("content", 1, SNIPPET_LENGTH + 1)
+    )
+
+
+_table: Optional[ChunkTable] = None
+_table_lock = threading.Lock()
+
+
+def get_chunk_table(build: bool = True) -> Optional[ChunkTable]:
+    """プロセス共有のチャンク表を取得（初回のみDBから構築）"""
+    global _table
+    if _table is not None or not build:
+        return _table
+
+    with _table_lock:
+        if _table is None:
+            from .models import CorpusChange, Document, DocumentChunk
+
+            table = ChunkTable()
+            table.synced_version = CorpusChange.current_version()
+            for chunk_id, document_id, content in snippet_rows(
+                DocumentChunk.objects.searchable()
+            ).iterator():
+                table.add_chunk(chunk_id, document_id, content)
+            table.set_titles(Document.objects.values_list("id", "title").iterator())
+            _table = table
+    return _table
+
+
+def get_chunk_records(chunk_ids: List[UUID]) -> Dict[UUID, ChunkRecord]:
+    """チャンクの情報を表から取得（表に未反映のものだけDBから読む）"""
+    table = get_chunk_table()
+    records = table.get_many(chunk_ids)
+    missing = [chunk_id for chunk_id in chunk_ids if chunk_id not in records]
+    if missing:
+        # 同期前に構築されたインデックスが返したチャンクなど
+        from .models import Document, DocumentChunk
+
+        rows = list(snippet_rows(DocumentChunk.objects.filter(id__in=missing)))
+        for chunk_id, document_id, content in rows:
+            table.add_chunk(chunk_id, document_id, content)
+        table.set_titles(
+            Document.objects.filter(
+                id__in={document_id for _, document_id, _ in rows}
+            ).values_list("id", "title")
+        )
+        records.update(table.get_many(missing))
+    return records
+
+
+def reset_chunk_table():
+    """表を破棄（次回アクセス時に再構築）"""
+    global _table
+    with _table_lock:
+        _table = None
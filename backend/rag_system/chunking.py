@@ -0,0 +1,114 @@
+# backend/rag_system/chunking.py
+import codecs
+import hashlib
+from typing import Iterable, Iterator, List, TypeVar
+
+T = TypeVar("T")
+
+READ_BLOCK_SIZE = 64 * 1024
+
+
+def iter_file_text(file, encoding: str = "utf-8") -> Iterator[str]:
+    """ファイルを少しずつ読み込み、インクリメンタルにデコードして返す"""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    with file.open("rb") as f:
+        while True:
+            data = f.read(READ_BLOCK_SIZE)
+            if not data:
+                break
+            text = decoder.decode(data)
+            if text:
+                yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def chunk_hash(text: str) -> str:
+    """チャンク本文のハッシュ（再取り込み時に同じ本文のチャンクを見分ける）"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def iter_text_chunks(
+    blocks: Iterable[str], chunk_size: int = 500, overlap: int = 50
+) -> Iterator[str]:
+    """テキスト片のストリームをチャンクに分割
+
+    境界（句点・改行・空白で切る）と重なりのルールはテキスト全体を一度に
+    分割する場合と同じで、保持するのは次のチャンクの先読み分だけ。
+    """
+    blocks = iter(blocks)
+    buffer = ""  # テキスト全体の base 文字目以降
+    base = 0
+    exhausted = False
+
+    def fill(limit: int):
+        # buffer がテキスト全体の limit 文字目に届くまで（または終端まで）読む
+        nonlocal buffer, exhausted
+        parts = [buffer]
+        size = len(buffer)
+        while not exhausted and base + size < limit:
+            try:
+                block = next(blocks)
+            except StopIteration:
+                exhausted = True
+                break
+            parts.append(block)
+            size += len(block)
+        buffer = "".join(parts)
+
+    fill(chunk_size + 1)
+    if exhausted and len(buffer) <= chunk_size:
+        yield buffer
+        return
+
+    start = 0
+    while True:
+        fill(start + chunk_size + 1)
+        text_end = base + len(buffer)  # 終端に達するまでは end より先まで読めている
+        if start >= text_end:
+            break
+
+        end = start + chunk_size
+
+        # 単語の境界で分割
+        if end < text_end:
+            # 最後の完全な文または単語で終わるように調整
+            last_period = buffer.rfind("。", start - base, end - base)
+            last_newline = buffer.rfind("\n", start - base, end - base)
+            last_space = buffer.rfind(" ", start - base, end - base)
+
+            cut_point = max(last_period, last_newline, last_space)
+            if cut_point >= 0 and cut_point + base > start:
+                end = cut_point + base + 1
+
+        chunk = buffer[start - base : end - base].strip()
+        if chunk:
+            yield chunk
+
+        # 区切りが先頭付近しかない場合でも必ず前に進める
+        start = max(end - overlap, start + 1)
+        buffer = buffer[start - base :]
+        base = start
+
+
+def estimate_chunk_count(length: int, chunk_size: int = 500, overlap: int = 50) -> int:
+    """length 文字のテキストを iter_text_chunks で分割したときのおおよそのチャンク数
+
+    境界で手前に切るぶん実際はやや多くなることがあるので、進捗の目安にだけ使う。
+    """
+    if length <= chunk_size:
+        return 1
+    return -(-(length - overlap) // (chunk_size - overlap))
+
+
+def batched(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    """イテラブルを size 件ずつのリストに区切る"""
+    batch: List[T] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
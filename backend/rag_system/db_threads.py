@@ -0,0 +1,36 @@
+# backend/rag_system/db_threads.py
+import functools
+from typing import Awaitable, Callable, TypeVar
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+T = TypeVar("T")
+
+
+def closing_connections(func: Callable[..., T]) -> Callable[..., T]:
+    """スレッドプールで実行する関数を、前後で古いDB接続を閉じるよう包む
+
+    Django がリクエストの開始・終了時に行う close_old_connections を、
+    リクエストを処理しないスレッドでも行う（CONN_MAX_AGE を過ぎた接続や
+    エラーになった接続を使い続けず、閉じずに残しもしない）。
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return wrapper
+
+
+def db_sync_to_async(func: Callable[..., T]) -> Callable[..., Awaitable[T]]:
+    """DBアクセスを伴う同期関数を、イベントループを塞がないようスレッドプールで実行
+
+    thread_sensitive=False なので複数のリクエストの処理が並行して進む。
+    実行スレッドのDB接続は closing_connections で管理する。
+    """
+    return sync_to_async(closing_connections(func), thread_sensitive=False)
@@ -0,0 +1,201 @@
+# backend/rag_system/dedup.py
+import hashlib
+import zlib
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Q
+
+from . import pg_search
+from .embedding_store import get_embedding_store
+from .models import CorpusChange, DocumentChunk, MinHashBucket
+from .tokenizer import normalize
+
+SHINGLE_SIZE = 5  # 文字 5-gram の集合で Jaccard 類似度を測る
+MINHASH_PERMUTATIONS = 64
+# 16バンド×4行: Jaccard 0.7 でも約99%の確率で候補に上がる
+LSH_BANDS = 16
+QUERY_BATCH_SIZE = 500
+
+# 全プロセスで同じシグネチャになるよう、ハッシュ関数の係数は固定の乱数で作る
+_rng = np.random.default_rng(0x5EED)
+_MULTIPLIERS = _rng.integers(1, 2**63, size=MINHASH_PERMUTATIONS, dtype=np.uint64) | 1
+_OFFSETS = _rng.integers(0, 2**63, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+
+def minhash(text: str) -> np.ndarray:
+    """本文の文字 5-gram 集合の MinHash シグネチャ（uint32 の配列）
+
+    空白の違い・全角半角・大文字小文字は正規化してから比べる。
+    """
+    text = " ".join(normalize(text).split())
+    shingles = {
+        text[i : i + SHINGLE_SIZE] for i in range(max(1, len(text) - SHINGLE_SIZE + 1))
+    }
+    hashes = np.fromiter(
+        (zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+        dtype=np.uint64,
+        count=len(shingles),
+    )
+    # multiply-shift 方式のハッシュ（2**64 での桁あふれは意図どおり）
+    with np.errstate(over="ignore"):
+        values = (hashes[:, None] * _MULTIPLIERS + _OFFSETS) >> np.uint64(32)
+    return values.min(axis=0).astype(np.uint32)
+
+
+def band_keys(signature: np.ndarray) -> List[int]:
+    """シグネチャをバンドに分け、バンドごとのバケットのキー（符号付き64bit）にする"""
+    rows = MINHASH_PERMUTATIONS // LSH_BANDS
+    keys = []
+    for band in range(LSH_BANDS):
+        digest = hashlib.blake2b(
+            signature[band * rows : (band + 1) * rows].tobytes(),
+            digest_size=8,
+            salt=band.to_bytes(16, "big"),
+        ).digest()
+        keys.append(int.from_bytes(digest, "big", signed=True))
+    return keys
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """シグネチャの一致率（Jaccard 類似度の推定値）"""
+    return float(np.mean(a == b))
+
+
+def _signature(chunk: DocumentChunk) -> np.ndarray:
+    return np.frombuffer(bytes(chunk.minhash), dtype=np.uint32)
+
+
+class DuplicateDetector:
+    """取り込むチャンクについて、近似重複の代表チャンクを探す
+
+    既存の代表はDBのバケット（MinHashBucket）から、同じバッチで先に
+    代表になったチャンクはメモリ上のバケットから引く。呼び出し元はバッチごとに
+    代表のバケットを保存する（save_buckets）。
+    exclude に一致するチャンクは代表にしない（再取り込みで消える旧チャンクなど）。
+    """
+
+    def __init__(self, threshold: float, exclude: Optional[Q] = None):
+        self.threshold = threshold
+        self.exclude = exclude
+
+    def assign(
+        self,
+        chunks: Sequence[DocumentChunk],
+        signatures: Optional[Sequence[np.ndarray]] = None,
+    ) -> List[DocumentChunk]:
+        """近似重複のチャンクに代表（canonical）を設定し、代表になるチャンクを返す
+
+        signatures を省略すると本文から計算する。重複チャンクの embedding_row は
+        呼び出し元が代表の行を入れる（代表の埋め込みがまだ無いことがあるため）。
+        """
+        if signatures is None:
+            signatures = [minhash(chunk.content) for chunk in chunks]
+        keys = [band_keys(signature) for signature in signatures]
+        stored = self._stored_candidates(
+            {key for chunk_keys in keys for key in chunk_keys}
+        )
+
+        buckets: Dict[int, List[DocumentChunk]] = {}
+        originals = []
+        for chunk, signature, chunk_keys in zip(chunks, signatures, keys):
+            chunk.minhash = signature.tobytes()
+            candidates = {}
+            for key in chunk_keys:
+                for candidate in stored.get(key, []) + buckets.get(key, []):
+                    candidates[candidate.id] = candidate
+            best = max(
+                candidates.values(),
+                key=lambda candidate: similarity(signature, _signature(candidate)),
+                default=None,
+            )
+            if best is not None and (
+                similarity(signature, _signature(best)) >= self.threshold
+            ):
+                chunk.canonical = best
+                continue
+            chunk.canonical = None
+            originals.append(chunk)
+            for key in chunk_keys:
+                buckets.setdefault(key, []).append(chunk)
+        return originals
+
+    def _stored_candidates(self, keys) -> Dict[int, List[DocumentChunk]]:
+        """バケットのキーごとに、DBにある代表チャンクを引く"""
+        keys = list(keys)
+        chunk_keys: Dict[object, List[int]] = {}
+        for start in range(0, len(keys), QUERY_BATCH_SIZE):
+            rows = MinHashBucket.objects.filter(
+                key__in=keys[start : start + QUERY_BATCH_SIZE]
+            ).values_list("chunk_id", "key")
+            for chunk_id, key in rows:
+                chunk_keys.setdefault(chunk_id, []).append(key)
+        if not chunk_keys:
+            return {}
+
+        chunks = DocumentChunk.objects.searchable().filter(id__in=list(chunk_keys))
+        if self.exclude is not None:
+            chunks = chunks.exclude(self.exclude)
+        candidates: Dict[int, List[DocumentChunk]] = {}
+        for chunk in chunks.only("id", "minhash", "embedding_row"):
+            for key in chunk_keys[chunk.id]:
+                candidates.setdefault(key, []).append(chunk)
+        return candidates
+
+
+def get_duplicate_detector(exclude: Optional[Q] = None) -> Optional[DuplicateDetector]:
+    """設定（RAG_DEDUP_THRESHOLD）の検出器を作る（0以下なら None で検出しない）"""
+    threshold = settings.RAG_DEDUP_THRESHOLD
+    if threshold <= 0:
+        return None
+    return DuplicateDetector(threshold, exclude)
+
+
+def save_buckets(chunks: Sequence[DocumentChunk]):
+    """代表チャンクのバケットを保存（シグネチャ計算済みのもの）"""
+    MinHashBucket.objects.bulk_create(
+        [
+            MinHashBucket(chunk=chunk, key=key)
+            for chunk in chunks
+            if chunk.minhash is not None
+            for key in band_keys(_signature(chunk))
+        ],
+        batch_size=QUERY_BATCH_SIZE,
+    )
+
+
+def promote_duplicates(duplicates) -> int:
+    """代表が消える重複チャンクを、代表ごとに1つ選んで新しい代表にする
+
+    duplicates には消えずに残る重複チャンクの QuerySet を渡す。新しい代表は
+    バケットを登録し、検索インデックスに載るようドキュメントの変更を記録する。
+    新しい代表にしたチャンク数を返す。
+    """
+    groups: Dict[object, List[DocumentChunk]] = {}
+    for chunk in duplicates.order_by("canonical_id", "created_at", "id").only(
+        "id", "canonical_id", "document_id", "minhash", "embedding_row"
+    ):
+        groups.setdefault(chunk.canonical_id, []).append(chunk)
+    if not groups:
+        return 0
+
+    promoted = [chunks[0] for chunks in groups.values()]
+    DocumentChunk.objects.filter(id__in=[chunk.id for chunk in promoted]).update(
+        canonical=None
+    )
+    for new_canonical, *others in groups.values():
+        if others:
+            DocumentChunk.objects.filter(id__in=[chunk.id for chunk in others]).update(
+                canonical=new_canonical
+            )
+    save_buckets(promoted)
+    # 取り込み時の重複チャンクには PostgreSQL の埋め込み列を書いていないので書き込む
+    store = get_embedding_store()
+    pg_search.store_vectors(
+        (chunk.id, store.get(chunk.embedding_row))
+        for chunk in promoted
+        if chunk.embedding_row is not None
+    )
+    CorpusChange.record_many({chunk.document_id for chunk in promoted}, "update")
+    return len(promoted)
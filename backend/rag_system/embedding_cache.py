@@ -0,0 +1,219 @@
+# backend/rag_system/embedding_cache.py
+import hashlib
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+from django.conf import settings
+
+from .db_threads import db_sync_to_async
+
+QUERY_BATCH_SIZE = 500
+PRUNE_INTERVAL = 1000  # この件数を登録するごとにテーブルの行数を確かめる
+
+
+def normalize_text(text: str) -> str:
+    """埋め込みが変わらない範囲で表記ゆれ（全角半角・空白）を吸収"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def content_hash(text: str, model: str) -> str:
+    """正規化したテキストと埋め込みモデル名の SHA-256"""
+    data = f"{model}\0{normalize_text(text)}".encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+class EmbeddingCache:
+    """テキスト内容のハッシュ → 埋め込みのキャッシュ
+
+    プロセス内の LRU を一次キャッシュとし、persist=True のときは
+    EmbeddingCacheEntry テーブルにも保存して再起動後・他プロセスでも使う。
+    キーに埋め込みモデル名を含めるため、モデルを変えると別エントリになる。
+    テーブルの行数が max_rows を超えたら、登録の古いものから削除する。
+    """
+
+    def __init__(
+        self,
+        model: str,
+        max_entries: int = 10000,
+        persist: bool = True,
+        max_rows: Optional[int] = None,
+    ):
+        self.model = model
+        self.max_entries = max_entries
+        self.persist = persist
+        self.max_rows = max_rows
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._inserted = 0  # 前回の行数確認から登録した件数
+        self.hits = 0
+        self.misses = 0
+
+    def embed(
+        self,
+        texts: Sequence[str],
+        compute: Callable[[List[str]], List[Sequence[float]]],
+    ) -> List[List[float]]:
+        """キャッシュにないテキストだけ compute で埋め込みを生成して返す"""
+        keys = [content_hash(text, self.model) for text in texts]
+        found = self._get_many(set(keys))
+        missing = self._missing(keys, texts, found)
+        if missing:
+            self._add_computed(missing, compute(list(missing.values())), found)
+        return [found[key].tolist() for key in keys]
+
+    async def aembed(
+        self,
+        texts: Sequence[str],
+        compute: Callable[[List[str]], Awaitable[List[Sequence[float]]]],
+    ) -> List[List[float]]:
+        """embed の非同期版（compute はコルーチン関数）
+
+        生成は await し、テーブルの参照・登録だけをスレッドプールで実行する。
+        """
+        keys = [content_hash(text, self.model) for text in texts]
+        found = await db_sync_to_async(self._get_many)(set(keys))
+        missing = self._missing(keys, texts, found)
+        if missing:
+            vectors = await compute(list(missing.values()))
+            await db_sync_to_async(self._add_computed)(missing, vectors, found)
+        return [found[key].tolist() for key in keys]
+
+    def add(self, texts: Sequence[str], vectors: Sequence[Sequence[float]]):
+        """別の場所（取り込みのワーカープロセスなど）で生成した埋め込みを登録"""
+        self._set_many(
+            {
+                content_hash(text, self.model): np.asarray(vector, dtype=np.float32)
+                for text, vector in zip(texts, vectors)
+            }
+        )
+
+    def _missing(
+        self, keys: List[str], texts: Sequence[str], found: Dict[str, np.ndarray]
+    ) -> Dict[str, str]:
+        """キャッシュにないキーとテキスト（同じ内容のテキストは1回だけ生成する）"""
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        with self._lock:
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+        return missing
+
+    def _add_computed(
+        self,
+        missing: Dict[str, str],
+        vectors: List[Sequence[float]],
+        found: Dict[str, np.ndarray],
+    ):
+        computed = {
+            key: np.asarray(vector, dtype=np.float32)
+            for key, vector in zip(missing, vectors)
+        }
+        self._set_many(computed)
+        found.update(computed)
+
+    def _get_many(self, keys: set) -> Dict[str, np.ndarray]:
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            for key in keys:
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                    found[key] = vector
+
+        missing = [key for key in keys if key not in found]
+        if missing and self.persist:
+            from .models import EmbeddingCacheEntry
+
+            stored: Dict[str, np.ndarray] = {}
+            for start in range(0, len(missing), QUERY_BATCH_SIZE):
+                rows = EmbeddingCacheEntry.objects.filter(
+                    content_hash__in=missing[start : start + QUERY_BATCH_SIZE]
+                ).values_list("content_hash", "embedding")
+                for key, data in rows:
+                    stored[key] = np.frombuffer(bytes(data), dtype=np.float32)
+            self._remember(stored)
+            found.update(stored)
+        return found
+
+    def _set_many(self, vectors: Dict[str, np.ndarray]):
+        self._remember(vectors)
+        if self.persist:
+            from .models import EmbeddingCacheEntry
+
+            EmbeddingCacheEntry.objects.bulk_create(
+                [
+                    EmbeddingCacheEntry(content_hash=key, embedding=vector.tobytes())
+                    for key, vector in vectors.items()
+                ],
+                batch_size=QUERY_BATCH_SIZE,
+                ignore_conflicts=True,  # 他プロセスが同時に登録した場合
+            )
+            with self._lock:
+                self._inserted += len(vectors)
+                due = self._inserted >= PRUNE_INTERVAL
+                if due:
+                    self._inserted = 0
+            if due:
+                self.prune()
+
+    def prune(self) -> int:
+        """テーブルの行数を max_rows 以下に減らし、削除した行数を返す"""
+        if not self.max_rows:
+            return 0
+        from .models import EmbeddingCacheEntry
+
+        excess = EmbeddingCacheEntry.objects.count() - self.max_rows
+        if excess <= 0:
+            return 0
+        # 古いものから excess 件目の登録時刻までを消す（同時刻の行はまとめて消える）
+        cutoff = (
+            EmbeddingCacheEntry.objects.order_by("created_at")
+            .values_list("created_at", flat=True)[excess - 1 : excess]
+            .first()
+        )
+        deleted, _ = EmbeddingCacheEntry.objects.filter(created_at__lte=cutoff).delete()
+        return deleted
+
+    def _remember(self, vectors: Dict[str, np.ndarray]):
+        with self._lock:
+            for key, vector in vectors.items():
+                self._entries[key] = vector
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_caches: Dict[str, EmbeddingCache] = {}
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache(model: str) -> Optional[EmbeddingCache]:
+    """埋め込みモデルごとのプロセス共有キャッシュ（無効なら None）"""
+    if not settings.RAG_EMBEDDING_CACHE:
+        return None
+    with _cache_lock:
+        cache = _caches.get(model)
+        if cache is None:
+            cache = _caches[model] = EmbeddingCache(
+                model,
+                max_entries=settings.RAG_EMBEDDING_CACHE_SIZE,
+                persist=settings.RAG_EMBEDDING_CACHE_PERSIST,
+                max_rows=settings.RAG_EMBEDDING_CACHE_MAX_ROWS,
+            )
+    return cache
+
+
+def reset_embedding_cache():
+    """キャッシュを破棄（次回アクセス時に作り直す）"""
+    with _cache_lock:
+        _caches.clear()
@@ -0,0 +1,149 @@
+# backend/rag_system/embedding_store.py
+import fcntl
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+import numpy as np
+from django.conf import settings
+
+EMBEDDING_DIMENSION = 128
+COMPACT_BLOCK_ROWS = 65536  # 詰め直しで一度に読む行数
+
+
+def normalize(vector: Sequence[float]) -> np.ndarray:
+    """ベクトルを float32 の単位ベクトルに変換"""
+    array = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(array)
+    return array / norm if norm > 0 else array
+
+
+class EmbeddingStore:
+    """正規化済み埋め込みを固定長 float32 行で追記していくバイナリファイル
+
+    各チャンクの行番号は DocumentChunk.embedding_row に記録する。
+    読み出しは読み取り専用の mmap で行うため、同じファイルを開いた
+    ワーカープロセス同士はページキャッシュを共有し、個別にコピーを持たない。
+    削除されたチャンクの行は残り続けるので、compact で詰め直す。詰め直すたびに
+    generation が進み、行番号を持つインデックスはそれを見て作り直す。
+    """
+
+    def __init__(self, directory: Path, dimension: int = EMBEDDING_DIMENSION):
+        self.dimension = dimension
+        self.row_bytes = dimension * 4
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.path = self.directory / "embeddings.f32"
+        self.path.touch(exist_ok=True)
+        self._lock_path = self.directory / "embeddings.lock"
+        self._generation_path = self.directory / "embeddings.generation"
+        self._matrix: Optional[np.ndarray] = None
+        self._mapped_rows = 0
+        self._mapped_generation = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return os.path.getsize(self.path) // self.row_bytes
+
+    def append(self, vectors: Sequence[Sequence[float]]) -> List[int]:
+        """埋め込みを正規化して末尾に追記し、割り当てた行番号を返す"""
+        if not len(vectors):
+            return []
+        data = np.asarray(vectors, dtype=np.float32)
+        if data.ndim != 2 or data.shape[1] != self.dimension:
+            raise ValueError(
+                f"埋め込みの次元数が一致しません: {data.shape} != (N, {self.dimension})"
+            )
+        norms = np.linalg.norm(data, axis=1, keepdims=True)
+        data = data / np.where(norms > 0, norms, 1)
+
+        # 複数プロセスからの同時追記に備えてファイルロックを取る
+        with self.exclusive():
+            with open(self.path, "ab") as f:
+                start = f.tell() // self.row_bytes
+                f.write(data.tobytes())
+        return list(range(start, start + len(data)))
+
+    @contextmanager
+    def exclusive(self):
+        """他プロセスの追記・詰め直しを止めるファイルロック"""
+        with open(self._lock_path, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @property
+    def generation(self) -> int:
+        """ファイルを詰め直した回数（行番号が振り直されるたびに増える）"""
+        try:
+            return int(self._generation_path.read_text() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def compact(self, rows: Sequence[int]):
+        """rows（昇順・重複なし）の行だけをこの順に残したファイルに置き換える
+
+        旧行番号 rows[i] は新しい行番号 i になる。呼び出し元は exclusive() の
+        中で呼び、DocumentChunk.embedding_row を同じ対応で付け替える。
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        matrix = self.matrix
+        temporary = self.path.with_name(self.path.name + ".compact")
+        with open(temporary, "wb") as f:
+            for start in range(0, len(rows), COMPACT_BLOCK_ROWS):
+                block = rows[start : start + COMPACT_BLOCK_ROWS]
+                f.write(np.ascontiguousarray(matrix[block]).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+
+        generation = self._generation_path.with_name(
+            self._generation_path.name + ".tmp"
+        )
+        generation.write_text(str(self.generation + 1))
+        os.replace(generation, self._generation_path)
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """全行の読み取り専用ビュー（他プロセスの追記分も含めて再マップ）"""
+        with self._lock:
+            n_rows = len(self)
+            generation = self.generation
+            if n_rows != self._mapped_rows or generation != self._mapped_generation:
+                self._matrix = (
+                    np.memmap(
+                        self.path,
+                        dtype=np.float32,
+                        mode="r",
+                        shape=(n_rows, self.dimension),
+                    )
+                    if n_rows
+                    else None
+                )
+                self._mapped_rows = n_rows
+                self._mapped_generation = generation
+            if self._matrix is None:
+                return np.zeros((0, self.dimension), dtype=np.float32)
+            return self._matrix
+
+    def get(self, row: int) -> np.ndarray:
+        """指定行の埋め込みを取得"""
+        return np.array(self.matrix[row])
+
+
+_store: Optional[EmbeddingStore] = None
+_store_lock = threading.Lock()
+
+
+def get_embedding_store() -> EmbeddingStore:
+    """設定されたディレクトリの埋め込みストアを取得"""
+    global _store
+    with _store_lock:
+        directory = Path(settings.RAG_VECTOR_STORE_DIR)
+        if _store is None or _store.directory != directory:
+            _store = EmbeddingStore(directory)
+    return _store
@@ -0,0 +1,112 @@
+# backend/rag_system/fts_search.py
+from typing import List, Tuple
+from uuid import UUID
+
+from django.db import DatabaseError, connection
+
+from .tokenizer import split_runs
+
+CHUNK_TABLE = "rag_system_documentchunk"
+FTS_TABLE = "rag_system_documentchunk_fts"
+# trigram は空白で区切られない日本語も部分一致で引ける（3文字未満の語は引けない）
+FTS_TOKENIZER = "trigram"
+MIN_TERM_LENGTH = 3
+
+# チャンクの追加・削除・更新に合わせて FTS5 テーブルを更新するトリガー
+_TRIGGERS = {
+    f"{FTS_TABLE}_ai": f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {CHUNK_TABLE}
+        BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.rowid, new.content);
+        END
+    """,
+    f"{FTS_TABLE}_ad": f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {CHUNK_TABLE}
+        BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content)
+            VALUES ('delete', old.rowid, old.content);
+        END
+    """,
+    f"{FTS_TABLE}_au": f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF content
+        ON {CHUNK_TABLE}
+        BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content)
+            VALUES ('delete', old.rowid, old.content);
+            INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.rowid, new.content);
+        END
+    """,
+}
+
+
+def ensure_fts_index(using_connection=None) -> bool:
+    """FTS5 テーブルとトリガーを用意し、作り直した場合は索引を再構築する
+
+    migrate のたびに呼ばれる（post_migrate）。SQLite がチャンクのテーブルを
+    作り直すとトリガーが消え rowid も変わるため、トリガーが欠けていれば
+    既存チャンクから索引を作り直す。FTS5 が使えなければ False を返す。
+
+    索引はチャンクの暗黙の rowid で本文を引く（主キーが UUID のため）。
+    INTEGER PRIMARY KEY でない rowid は VACUUM で振り直されることがあるので、
+    VACUUM の後は rebuild_fts_index を呼ぶ（vacuum_database コマンドは両方行う）。
+    """
+    conn = using_connection or connection
+    if conn.vendor != "sqlite":
+        return False
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name IN (%s)"
+            % ", ".join("%s" for _ in _TRIGGERS),
+            list(_TRIGGERS),
+        )
+        if len(cursor.fetchall()) == len(_TRIGGERS):
+            return True
+        try:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                f"content, content='{CHUNK_TABLE}', content_rowid='rowid',"
+                f" tokenize='{FTS_TOKENIZER}')"
+            )
+        except DatabaseError:
+            return False  # FTS5 なしでビルドされた SQLite
+        for sql in _TRIGGERS.values():
+            cursor.execute(sql)
+    return rebuild_fts_index(conn)
+
+
+def rebuild_fts_index(using_connection=None) -> bool:
+    """チャンクの現在の rowid と本文から FTS5 索引を作り直す（SQLite 以外は False）"""
+    conn = using_connection or connection
+    if conn.vendor != "sqlite":
+        return False
+    with conn.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    return True
+
+
+def _match_expression(query: str) -> str:
+    """クエリ語のいずれかを含むチャンクに一致する FTS5 の検索式
+
+    trigram は部分文字列で一致するため、日本語の文も n-gram に分けずに渡す。
+    """
+    terms = [term for term in split_runs(query) if len(term) >= MIN_TERM_LENGTH]
+    return " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def fts_search(query: str, top_k: int = 3) -> List[Tuple[UUID, float]]:
+    """FTS5 の bm25() でランキングして上位を返す（スコアは大きいほど関連が高い）"""
+    expression = _match_expression(query)
+    if not expression:
+        return []
+    # bm25() は関連が高いほど小さい（負の）値を返すので符号を反転する
+    sql = f"""
+        SELECT chunk.id, -bm25({FTS_TABLE}) AS score
+        FROM {FTS_TABLE}
+        JOIN {CHUNK_TABLE} AS chunk ON chunk.rowid = {FTS_TABLE}.rowid
+        WHERE {FTS_TABLE} MATCH %s AND chunk.canonical_id IS NULL
+        ORDER BY bm25({FTS_TABLE})
+        LIMIT %s
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [expression, top_k])
+        return [(UUID(str(chunk_id)), float(score)) for chunk_id, score in cursor]
@@ -0,0 +1,72 @@
+# backend/rag_system/hybrid_search.py
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from django.conf import settings
+
+from .ann_index import get_ann_index
+from .db_threads import closing_connections
+from .search_index import InvertedIndex, get_search_index
+from .vector_index import DenseVectorIndex, get_vector_index
+
+RRF_K = 60
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="hybrid-search")
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[List[Tuple[UUID, float]]],
+    top_k: int = 3,
+    k: int = RRF_K,
+    weights: Optional[Sequence[float]] = None,
+) -> List[Tuple[UUID, float]]:
+    """複数の順位リストを Reciprocal Rank Fusion で統合
+
+    各リストでの順位 r に対して weight / (k + r) を足し合わせる。
+    スコアの尺度が異なる検索結果でも順位だけで統合できる。
+    """
+    weights = weights or [1.0] * len(rankings)
+    fused: Dict[UUID, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, (chunk_id, _) in enumerate(ranking, 1):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + weight / (k + rank)
+
+    ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)
+    return ranked[:top_k]
+
+
+def hybrid_search(
+    query: str,
+    embed: Callable[[str], Sequence[float]],
+    top_k: int = 3,
+    candidates: Optional[int] = None,
+    lexical_index: Optional[InvertedIndex] = None,
+    vector_index: Optional[DenseVectorIndex] = None,
+) -> List[Tuple[UUID, float]]:
+    """語彙検索とベクトル検索を並行実行して RRF で統合
+
+    各検索からは上位 candidates 件だけを受け取るため、統合コストは
+    コーパスサイズに依存しない。インデックスを省略するとプロセス共有のものを使う。
+    """
+    candidates = max(candidates or settings.RAG_HYBRID_CANDIDATES, top_k)
+
+    # インデックス構築はDBアクセスを伴うので呼び出し元スレッドで済ませておく
+    if lexical_index is None:
+        lexical_index = get_search_index()
+    if vector_index is None:
+        if settings.RAG_HYBRID_VECTOR_INDEX == "ann":
+            vector_index = get_ann_index()
+        else:
+            vector_index = get_vector_index()
+
+    lexical = _executor.submit(lexical_index.search, query, candidates)
+    # クエリの埋め込みは埋め込みキャッシュ（DB）を引くので、接続の後始末をする
+    dense = _executor.submit(
+        closing_connections(lambda: vector_index.search(embed(query), top_k=candidates))
+    )
+    return reciprocal_rank_fusion(
+        [lexical.result(), dense.result()],
+        top_k=top_k,
+        weights=settings.RAG_HYBRID_WEIGHTS,
+    )
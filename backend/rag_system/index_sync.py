@@ -0,0 +1,134 @@
+# backend/rag_system/index_sync.py
+import threading
+from typing import Dict, Iterable, Set, Tuple
+from uuid import UUID
+
+from .ann_index import get_ann_index
+from .chunk_table import ChunkTable, get_chunk_table, snippet_rows
+from .models import CorpusChange, Document, DocumentChunk
+from .retrieval_cache import RetrievalCache, get_retrieval_cache
+from .search_index import InvertedIndex, get_search_index, token_rows
+from .vector_index import get_vector_index
+
+QUERY_BATCH_SIZE = 500
+
+_sync_lock = threading.Lock()
+
+
+def built_indexes() -> list:
+    """このプロセスで構築済みの検索インデックス"""
+    indexes = (
+        get_search_index(build=False),
+        get_vector_index(build=False),
+        get_ann_index(build=False),
+        get_chunk_table(build=False),
+    )
+    return [index for index in indexes if index is not None]
+
+
+def sync_indexes():
+    """CorpusChange ログを読み、構築済みインデックスに未反映の変更を適用
+
+    取り込みワーカーなど別プロセスでの追加・削除もこれで反映される。
+    検索結果キャッシュからは、変更の影響を受けるエントリを破棄する。
+    変更がなければ主キーの範囲検索1回だけで終わる。
+    """
+    indexes = built_indexes()
+    cache = get_retrieval_cache(build=False)
+    participants = indexes + ([cache] if cache is not None else [])
+    if not participants:
+        return
+
+    with _sync_lock:
+        since = min(participant.synced_version for participant in participants)
+        changes = list(
+            CorpusChange.objects.filter(id__gt=since)
+            .order_by("id")
+            .values_list("id", "document_id", "action")
+        )
+        if not changes:
+            return
+
+        latest = changes[-1][0]
+        for index in indexes:
+            document_ids = {
+                document_id
+                for change_id, document_id, action in changes
+                if change_id > index.synced_version
+            }
+            if document_ids:
+                _reconcile_documents(index, document_ids)
+            index.synced_version = latest
+
+        if cache is not None:
+            pending = [change for change in changes if change[0] > cache.synced_version]
+            # 先にバージョンを進め、反映前の状態で検索した結果は登録させない
+            cache.synced_version = latest
+            _invalidate_cache(cache, pending)
+
+
+def _invalidate_cache(cache: RetrievalCache, changes: list):
+    """変更されたドキュメントに関係する検索結果キャッシュを破棄"""
+    document_ids = {document_id for _, document_id, _ in changes}
+    added_ids = {
+        document_id for _, document_id, action in changes if action != "remove"
+    }
+    added_terms: Set[str] = set()
+    if added_ids and cache.has_term_entries:
+        for batch in _batched(list(added_ids)):
+            for _, _, tokens in token_rows(
+                DocumentChunk.objects.searchable().filter(document_id__in=batch)
+            ):
+                added_terms.update(tokens)
+    cache.invalidate(document_ids, added=bool(added_ids), added_terms=added_terms)
+
+
+def _batched(values: list, size: int = QUERY_BATCH_SIZE) -> Iterable[list]:
+    for start in range(0, len(values), size):
+        yield values[start : start + size]
+
+
+def _reconcile_documents(index, document_ids: Set[UUID]):
+    """指定ドキュメントのチャンクについて、インデックスをDBの現状に合わせる"""
+    current: Dict[UUID, Tuple[UUID, int]] = {}
+    for batch in _batched(list(document_ids)):
+        # 近似重複として代表を参照するチャンクはインデックスに載せない
+        rows = (
+            DocumentChunk.objects.searchable()
+            .filter(document_id__in=batch)
+            .values_list("id", "document_id", "embedding_row")
+        )
+        for chunk_id, document_id, row in rows:
+            current[chunk_id] = (document_id, row)
+
+    for document_id in document_ids:
+        for chunk_id in index.chunk_ids_for_document(document_id):
+            if chunk_id not in current:
+                index.remove_chunk(chunk_id)
+
+    added = [chunk_id for chunk_id in current if chunk_id not in index]
+    if isinstance(index, ChunkTable):
+        for batch in _batched(added):
+            for chunk_id, document_id, content in snippet_rows(
+                DocumentChunk.objects.filter(id__in=batch)
+            ):
+                index.add_chunk(chunk_id, document_id, content)
+        # タイトルの変更（"update"）と削除もここで反映する
+        titles = {}
+        for batch in _batched(list(document_ids)):
+            titles.update(
+                Document.objects.filter(id__in=batch).values_list("id", "title")
+            )
+        index.set_titles(titles.items())
+        index.remove_titles(document_ids - titles.keys())
+    elif isinstance(index, InvertedIndex):
+        for batch in _batched(added):
+            for chunk_id, document_id, tokens in token_rows(
+                DocumentChunk.objects.filter(id__in=batch)
+            ):
+                index.add_chunk(chunk_id, document_id, tokens)
+    else:
+        for chunk_id in added:
+            document_id, row = current[chunk_id]
+            if row is not None:
+                index.add_chunk(chunk_id, document_id, row)
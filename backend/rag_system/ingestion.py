@@ -0,0 +1,225 @@
+# backend/rag_system/ingestion.py
+import logging
+import time
+import traceback
+from datetime import timedelta
+from typing import Iterable, Iterator, List, Optional
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .chunking import estimate_chunk_count, iter_file_text
+from .models import Document, IngestionJob
+from .services import RAGService
+
+logger = logging.getLogger(__name__)
+
+
+class ExtractionError(Exception):
+    """ファイルからテキストを読み取れなかった（デコードできない等）"""
+
+
+def iter_extracted_text(file) -> Iterator[str]:
+    """ファイルからテキストを逐次抽出（簡単な実装）"""
+    if file.name.endswith((".txt", ".md")):
+        try:
+            yield from iter_file_text(file)
+        except (OSError, ValueError) as e:  # UnicodeDecodeError は ValueError
+            raise ExtractionError(str(e)) from e
+    elif file.name.endswith(".pdf"):
+        # 実際のPDF処理は後で実装
+        yield "PDFファイルが正常にアップロードされました。（PDF処理機能は開発中）"
+    else:
+        yield "サポートされていないファイル形式です。"
+
+
+def _capture_prefix(blocks: Iterable[str], sink: List[str], limit: int):
+    """テキスト片をそのまま流しつつ、先頭 limit 文字だけ sink に控える"""
+    captured = 0
+    for block in blocks:
+        if captured < limit:
+            sink.append(block[: limit - captured])
+            captured += len(sink[-1])
+        yield block
+
+
+def estimate_total_chunks(document: Document) -> int:
+    """取り込み前に見積もるドキュメントのチャンク数（進捗表示用）
+
+    ファイルはバイト数を文字数とみなす（マルチバイト文字が多いと多めになる）。
+    """
+    if document.file:
+        try:
+            length = document.file.size
+        except OSError:
+            return 0
+    else:
+        length = len(document.content)
+    return estimate_chunk_count(length)
+
+
+def enqueue_document(document: Document) -> IngestionJob:
+    """ドキュメントの取り込みジョブを登録
+
+    待機中のジョブが既にあればそれを返す（ジョブは実行時点の本文・ファイルを
+    取り込むので、待機中のものが1件あれば足りる）。
+    """
+    job = document.ingestion_jobs.filter(status=IngestionJob.STATUS_PENDING).first()
+    if job is not None:
+        return job
+    return IngestionJob.objects.create(document=document)
+
+
+def enqueue_unprocessed_documents() -> int:
+    """未処理でジョブも無いドキュメントのジョブを登録"""
+    documents = Document.objects.filter(is_processed=False).exclude(
+        ingestion_jobs__status__in=[
+            IngestionJob.STATUS_PENDING,
+            IngestionJob.STATUS_RUNNING,
+        ]
+    )
+    jobs = [IngestionJob(document=document) for document in documents]
+    IngestionJob.objects.bulk_create(jobs)
+    return len(jobs)
+
+
+def requeue_stale_jobs(timeout_seconds: int) -> int:
+    """進捗の報告が一定時間途絶えた処理中のジョブ（ワーカー異常終了など）を待機中に戻す
+
+    同じドキュメントに待機中のジョブが既にあれば、戻さずにそちらへ統合する。
+    """
+    threshold = timezone.now() - timedelta(seconds=timeout_seconds)
+    stale = IngestionJob.objects.filter(status=IngestionJob.STATUS_RUNNING).filter(
+        Q(heartbeat_at__lt=threshold)
+        | Q(heartbeat_at__isnull=True, started_at__lt=threshold)
+    )
+    pending = IngestionJob.objects.filter(
+        document=OuterRef("document"), status=IngestionJob.STATUS_PENDING
+    )
+    stale.filter(Exists(pending)).update(
+        status=IngestionJob.STATUS_FAILED,
+        error="同じドキュメントの待機中のジョブに統合しました",
+        finished_at=timezone.now(),
+    )
+    return stale.update(status=IngestionJob.STATUS_PENDING)
+
+
+def claim_next_job() -> Optional[IngestionJob]:
+    """待機中のジョブを1件確保する
+
+    状態を条件にした UPDATE で確保するため、複数ワーカーが同時に
+    同じジョブを取り合っても処理するのは1つだけになる。処理中のジョブが
+    あるドキュメントのジョブは、それが終わるまで確保しない（同じ
+    ドキュメントのチャンクを2つのワーカーが同時に書き換えないように）。
+    """
+    running = IngestionJob.objects.filter(
+        document=OuterRef("document"), status=IngestionJob.STATUS_RUNNING
+    )
+    candidates = (
+        IngestionJob.objects.filter(status=IngestionJob.STATUS_PENDING)
+        .exclude(Exists(running))
+        .values_list("id", "document_id")
+    )
+    for job_id, document_id in candidates[:10]:
+        with transaction.atomic():
+            # ドキュメントの行をロックし、処理中のジョブが無いことを確かめてから確保する
+            # （SQLite では UPDATE 文そのものが書き込みロックの中で評価される）
+            list(
+                Document.objects.select_for_update()
+                .filter(id=document_id)
+                .values_list("id", flat=True)
+            )
+            now = timezone.now()
+            claimed = (
+                IngestionJob.objects.filter(
+                    id=job_id, status=IngestionJob.STATUS_PENDING
+                )
+                .exclude(Exists(running))
+                .update(
+                    status=IngestionJob.STATUS_RUNNING,
+                    started_at=now,
+                    heartbeat_at=now,
+                    attempts=F("attempts") + 1,
+                )
+            )
+        if claimed:
+            return IngestionJob.objects.select_related("document").get(id=job_id)
+    return None
+
+
+def run_job(job: IngestionJob, rag_service: Optional[RAGService] = None):
+    """ジョブを実行（テキスト抽出 → チャンク分割・埋め込み生成・保存）"""
+    rag_service = rag_service or RAGService()
+    document = job.document
+
+    def report_progress(processed: int):
+        # 見積もりを超えたら処理済み数に合わせる（確定値は完了時に書き込む）
+        IngestionJob.objects.filter(id=job.id).update(
+            processed_chunks=processed,
+            total_chunks=Greatest(F("total_chunks"), processed),
+            heartbeat_at=timezone.now(),
+        )
+
+    try:
+        IngestionJob.objects.filter(id=job.id).update(
+            processed_chunks=0, total_chunks=estimate_total_chunks(document)
+        )
+        text_blocks = None
+        content_prefix: List[str] = []
+        if document.file:
+            # ファイルは丸ごと読み込まず、チャンク化しながら逐次処理する
+            text_blocks = _capture_prefix(
+                iter_extracted_text(document.file),
+                content_prefix,
+                settings.RAG_DOCUMENT_CONTENT_LIMIT,
+            )
+
+        total = rag_service.process_document(
+            document, progress=report_progress, text_blocks=text_blocks
+        )
+
+        if text_blocks is not None:
+            # 抽出テキストは上限文字数までを Document.content に保存
+            document.content = "".join(content_prefix)
+            document.save(update_fields=["content", "updated_at"])
+    except Exception as e:
+        if isinstance(e, ExtractionError):
+            # 読み取れなかったことが分かるよう、エラー内容を本文として残す
+            document.content = f"ファイル読み取りエラー: {e}"
+            document.save(update_fields=["content", "updated_at"])
+        IngestionJob.objects.filter(id=job.id).update(
+            status=IngestionJob.STATUS_FAILED,
+            error=traceback.format_exc(),
+            finished_at=timezone.now(),
+        )
+        raise
+
+    IngestionJob.objects.filter(id=job.id).update(
+        status=IngestionJob.STATUS_COMPLETED,
+        processed_chunks=total,
+        total_chunks=total,
+        error="",
+        finished_at=timezone.now(),
+    )
+
+
+def worker_loop(poll_interval: float = 1.0, once: bool = False):
+    """ジョブを取り出して処理し続けるワーカーのメインループ"""
+    rag_service = RAGService()
+    while True:
+        close_old_connections()
+        job = claim_next_job()
+        if job is None:
+            if once:
+                return
+            time.sleep(poll_interval)
+            continue
+
+        try:
+            run_job(job, rag_service)
+        except Exception:
+            # 失敗内容はジョブに記録済み。ワーカーは次のジョブへ進む
+            logger.exception("取り込みジョブ %s が失敗しました", job.id)
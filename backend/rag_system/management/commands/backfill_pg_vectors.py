@@ -0,0 +1,52 @@
+# backend/rag_system/management/commands/backfill_pg_vectors.py
+from django.core.management.base import BaseCommand, CommandError
+
+from rag_system import pg_search
+from rag_system.embedding_store import get_embedding_store
+from rag_system.models import DocumentChunk
+
+
+class Command(BaseCommand):
+    help = "埋め込みストアの埋め込みを PostgreSQL の埋め込み列へ書き込む"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="1回の書き込みで処理するチャンク数",
+        )
+
+    def handle(self, *args, **options):
+        if pg_search.vector_column_type() is None:
+            raise CommandError(
+                "PostgreSQL の埋め込み列がありません（migrate を実行してください）"
+            )
+
+        store = get_embedding_store()
+        batch_size = options["batch_size"]
+        chunks = (
+            DocumentChunk.objects.filter(embedding_row__isnull=False)
+            .order_by("embedding_row")
+            .values_list("id", "embedding_row")
+        )
+        total = chunks.count()
+        written = 0
+        batch = []
+        for chunk_id, row in chunks.iterator(chunk_size=batch_size):
+            batch.append((chunk_id, row))
+            if len(batch) == batch_size:
+                written += self._write(store, batch)
+                batch = []
+                self.stdout.write(f"{written}/{total} チャンクを書き込みました")
+        if batch:
+            written += self._write(store, batch)
+
+        self.stdout.write(self.style.SUCCESS(f"書き込み完了: {written} チャンク"))
+
+    def _write(self, store, batch) -> int:
+        matrix = store.matrix
+        pg_search.store_vectors(
+            (chunk_id, matrix[row].tolist()) for chunk_id, row in batch
+        )
+        return len(batch)
@@ -0,0 +1,120 @@
+# backend/rag_system/management/commands/benchmark_ann.py
+import tempfile
+import time
+import uuid
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from rag_system.ann_index import IVFIndex, default_nprobe
+from rag_system.embedding_store import EmbeddingStore, get_embedding_store
+from rag_system.models import DocumentChunk
+from rag_system.vector_index import DenseVectorIndex
+
+
+class Command(BaseCommand):
+    help = "IVF近似最近傍検索の recall@k とレイテンシを総当たり検索と比較する"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--synthetic",
+            type=int,
+            default=0,
+            help="指定件数の合成ベクトルで計測する（0ならDB上のチャンクを使う）",
+        )
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--k", type=int, default=10)
+        parser.add_argument("--nlist", type=int, default=None)
+        parser.add_argument(
+            "--nprobe",
+            default="1,2,4,8,16,32",
+            help="カンマ区切りで比較する nprobe の値",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options["seed"])
+
+        if options["synthetic"]:
+            store = EmbeddingStore(tempfile.mkdtemp(prefix="ann_bench_"))
+            entries = self._synthetic_entries(store, options["synthetic"], rng)
+        else:
+            store = get_embedding_store()
+            entries = list(
+                DocumentChunk.objects.filter(embedding_row__isnull=False).values_list(
+                    "id", "document_id", "embedding_row"
+                )
+            )
+        if not entries:
+            self.stdout.write(self.style.WARNING("埋め込みがありません"))
+            return
+
+        exact = DenseVectorIndex(store)
+        ivf = IVFIndex(store, nlist=options["nlist"])
+        for chunk_id, document_id, row in entries:
+            exact.add_chunk(chunk_id, document_id, row)
+            DenseVectorIndex.add_chunk(ivf, chunk_id, document_id, row)
+
+        started = time.perf_counter()
+        ivf.train(seed=options["seed"])
+        self.stdout.write(
+            f"ベクトル数: {len(entries)}, nlist: {len(ivf.centroids)}, "
+            f"既定の nprobe: {default_nprobe(len(ivf.centroids))}, "
+            f"学習時間: {time.perf_counter() - started:.2f}s"
+        )
+
+        # クエリは保存済みベクトルにノイズを加えたもの
+        matrix = store.matrix
+        rows = rng.choice([row for _, _, row in entries], options["queries"])
+        queries = np.asarray(matrix[rows]) + rng.normal(
+            0, 0.05, (len(rows), store.dimension)
+        ).astype(np.float32)
+
+        k = options["k"]
+        truth, exact_latency = self._run(exact.search, queries, k)
+        self.stdout.write(
+            f"総当たり: p50 {np.percentile(exact_latency, 50):.2f}ms "
+            f"p95 {np.percentile(exact_latency, 95):.2f}ms"
+        )
+
+        self.stdout.write(
+            f"{'nprobe':>8} {'recall@' + str(k):>10} {'p50':>9} {'p95':>9}"
+        )
+        for nprobe in [int(value) for value in options["nprobe"].split(",")]:
+            results, latency = self._run(
+                lambda query, top_k: ivf.search(query, top_k=top_k, nprobe=nprobe),
+                queries,
+                k,
+            )
+            recall = np.mean(
+                [
+                    len(found & expected) / len(expected)
+                    for found, expected in zip(results, truth)
+                ]
+            )
+            self.stdout.write(
+                f"{nprobe:>8} {recall:>10.3f} "
+                f"{np.percentile(latency, 50):>7.2f}ms {np.percentile(latency, 95):>7.2f}ms"
+            )
+
+    def _run(self, search, queries, k):
+        results, latency = [], []
+        for query in queries:
+            started = time.perf_counter()
+            ranked = search(query, top_k=k)
+            latency.append((time.perf_counter() - started) * 1000)
+            results.append({chunk_id for chunk_id, _ in ranked})
+        return results, np.array(latency)
+
+    def _synthetic_entries(self, store, n_vectors, rng, batch_size=100000):
+        """クラスタ構造を持つ合成ベクトルをストアに書き込む"""
+        centers = rng.normal(size=(max(1, n_vectors // 1000), store.dimension))
+        entries = []
+        for start in range(0, n_vectors, batch_size):
+            size = min(batch_size, n_vectors - start)
+            vectors = centers[rng.integers(len(centers), size=size)] + rng.normal(
+                0, 0.5, (size, store.dimension)
+            )
+            rows = store.append(vectors)
+            entries.extend((uuid.uuid4(), uuid.uuid4(), row) for row in rows)
+        return entries
@@ -0,0 +1,92 @@
+# backend/rag_system/management/commands/benchmark_ask.py
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client, override_settings
+
+from rag_system.models import Conversation
+
+
+class Command(BaseCommand):
+    help = "同時質問数ごとに、同期(WSGI)版と非同期(ASGI)版の質問APIのスループットを比較する"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            default="1,10,50,100",
+            help="カンマ区切りで比較する同時リクエスト数",
+        )
+        parser.add_argument(
+            "--threads",
+            type=int,
+            default=4,
+            help="WSGI版のワーカースレッド数（gunicorn の --threads 相当）",
+        )
+        parser.add_argument("--question", default="このシステムについて教えてください")
+        parser.add_argument(
+            "--with-cache",
+            action="store_true",
+            help="回答・検索結果のキャッシュを有効にしたまま計測する"
+            "（既定では無効にし、毎回検索と回答生成を行わせる）",
+        )
+
+    def handle(self, *args, **options):
+        user, created = User.objects.get_or_create(
+            username="testuser", defaults={"email": "test@example.com"}
+        )
+        # 計測用の会話にだけ質問を作り、終了後にまとめて削除する
+        conversation = Conversation.objects.create(user=user, title="benchmark")
+        body = {"text": options["question"]}
+
+        self.stdout.write(f"{'同時数':>6} {'方式':>6} {'合計(秒)':>9} {'質問/秒':>8}")
+        # テストクライアントのホスト名（testserver）を許可して計測する。
+        # 同じ質問を繰り返すので、キャッシュが有効だとヒットの速さを測ってしまう
+        overrides = {"ALLOWED_HOSTS": [*settings.ALLOWED_HOSTS, "testserver"]}
+        if not options["with_cache"]:
+            overrides.update(RAG_ANSWER_CACHE_SIZE=0, RAG_RETRIEVAL_CACHE_SIZE=0)
+        benchmark_settings = override_settings(**overrides)
+        try:
+            benchmark_settings.enable()
+            for concurrency in [int(c) for c in options["concurrency"].split(",")]:
+                elapsed = self._run_wsgi(
+                    conversation, body, concurrency, options["threads"]
+                )
+                self._report(concurrency, "wsgi", elapsed)
+                elapsed = asyncio.run(self._run_asgi(conversation, body, concurrency))
+                self._report(concurrency, "asgi", elapsed)
+        finally:
+            benchmark_settings.disable()
+            conversation.delete()
+
+    def _report(self, concurrency: int, mode: str, elapsed: float):
+        self.stdout.write(
+            f"{concurrency:>8} {mode:>8} {elapsed:>11.2f} {concurrency / elapsed:>10.1f}"
+        )
+
+    def _run_wsgi(self, conversation, body, concurrency: int, threads: int) -> float:
+        url = f"/api/conversations/{conversation.id}/ask_question/"
+
+        def post(_):
+            response = Client().post(url, body, content_type="application/json")
+            assert response.status_code == 201, response.content
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(post, range(concurrency)))
+        return time.perf_counter() - started
+
+    async def _run_asgi(self, conversation, body, concurrency: int) -> float:
+        url = f"/api/async/conversations/{conversation.id}/ask_question/"
+        client = AsyncClient()
+
+        async def post():
+            response = await client.post(url, body, content_type="application/json")
+            assert response.status_code == 201, response.content
+
+        started = time.perf_counter()
+        await asyncio.gather(*(post() for _ in range(concurrency)))
+        return time.perf_counter() - started
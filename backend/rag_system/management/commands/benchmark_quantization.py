@@ -0,0 +1,153 @@
+# backend/rag_system/management/commands/benchmark_quantization.py
+import tempfile
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from rag_system.embedding_store import EmbeddingStore
+from rag_system.management.commands.benchmark_retrievers import SyntheticCorpus
+from rag_system.quantization import QuantizedVectorIndex, make_quantizer
+from rag_system.vector_index import DenseVectorIndex
+
+
+class Command(BaseCommand):
+    help = (
+        "合成コーパスの埋め込みで、量子化（int8・直積量子化）したベクトル検索の"
+        "メモリ・検索レイテンシ・float32 の総当たりに対する recall@k と、クエリの元の"
+        "チャンクを上位 k 件に含められた割合（hit@k）を比較する"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            default="100000",
+            help="カンマ区切りのベクトル数（例: 100000,1000000）",
+        )
+        parser.add_argument(
+            "--dimension",
+            type=int,
+            default=128,
+            help="埋め込みの次元数（例: 1536）",
+        )
+        parser.add_argument(
+            "--subspaces",
+            default="8,16,32",
+            help="カンマ区切りの直積量子化の部分空間数",
+        )
+        parser.add_argument(
+            "--rerank",
+            type=int,
+            default=10,
+            help="float32 で並べ直す候補数の top_k に対する倍率",
+        )
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--k", type=int, default=10)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        for size in [int(value) for value in options["sizes"].split(",")]:
+            with tempfile.TemporaryDirectory(prefix="quantization_bench_") as directory:
+                store = EmbeddingStore(directory, dimension=options["dimension"])
+                self._benchmark_size(size, store, options)
+
+    def _benchmark_size(self, size, store, options):
+        k = options["k"]
+        rng = np.random.default_rng(options["seed"])
+        corpus = SyntheticCorpus(size, store, rng)
+        queries = corpus.queries(options["queries"])
+
+        exact = DenseVectorIndex(store)
+        for chunk in corpus.chunks:
+            exact.add_chunk(chunk.id, chunk.document_id, chunk.embedding_row)
+        float_bytes = size * store.row_bytes
+        self.stdout.write(
+            f"\nベクトル数: {size} / 次元数: {store.dimension}"
+            f"（float32 の埋め込み {float_bytes / 2**20:.1f}MB）"
+        )
+        self.stdout.write(
+            f"{'method':>14} {'bytes/vec':>9} {'memory':>9} {'ratio':>7} "
+            f"{'train':>8} {'p50':>9} {'p95':>9} {'recall@' + str(k):>10} "
+            f"{'hit@' + str(k):>7}"
+        )
+        truth, latency = self._run(exact, queries, k)
+        self._report(
+            "float32",
+            store.row_bytes,
+            float_bytes,
+            0.0,
+            latency,
+            1.0,
+            self._hit_rate(truth, queries),
+        )
+
+        methods = [("int8", None)] + [
+            ("pq", int(subspaces)) for subspaces in options["subspaces"].split(",")
+        ]
+        for name, subspaces in methods:
+            quantizer = make_quantizer(name, store.dimension, subspaces)
+            index = QuantizedVectorIndex(store, quantizer)
+            for chunk in corpus.chunks:
+                DenseVectorIndex.add_chunk(
+                    index, chunk.id, chunk.document_id, chunk.embedding_row
+                )
+            started = time.perf_counter()
+            index.train(seed=options["seed"])
+            train_time = time.perf_counter() - started
+
+            label = name if subspaces is None else f"{name}{subspaces}"
+            # 並べ直しなし（符号の近似スコアのみ）と、float32 での並べ直しあり
+            for rerank in (0, options["rerank"]):
+                index.rerank = rerank
+                ranked, latency = self._run(index, queries, k)
+                recall = np.mean(
+                    [
+                        len(set(result) & set(expected)) / len(expected)
+                        for result, expected in zip(ranked, truth)
+                    ]
+                )
+                self._report(
+                    label if not rerank else f"{label}+rerank{rerank}",
+                    quantizer.code_size,
+                    index.code_bytes,
+                    train_time,
+                    latency,
+                    recall,
+                    self._hit_rate(ranked, queries),
+                    float_bytes,
+                )
+
+    def _run(self, index, queries, k):
+        """各クエリの上位 k 件のチャンクIDと検索時間（ミリ秒）"""
+        results, latency = [], []
+        for _, embedding, _ in queries:
+            started = time.perf_counter()
+            ranked = index.search(embedding, top_k=k)
+            latency.append((time.perf_counter() - started) * 1000)
+            results.append([chunk_id for chunk_id, _ in ranked])
+        return results, latency
+
+    def _hit_rate(self, ranked, queries):
+        """クエリの元にしたチャンクを上位 k 件に含められた割合"""
+        return np.mean(
+            [expected in result for result, (_, _, expected) in zip(ranked, queries)]
+        )
+
+    def _report(
+        self,
+        name,
+        bytes_per_vector,
+        memory,
+        train_time,
+        latency,
+        recall,
+        hit_rate,
+        base=None,
+    ):
+        p50, p95 = np.percentile(latency, [50, 95])
+        ratio = f"{memory / base:.3f}" if base else "1.000"
+        self.stdout.write(
+            f"{name:>14} {bytes_per_vector:>9} {memory / 2**20:>7.1f}MB {ratio:>7} "
+            f"{train_time:>7.2f}s {p50:>7.2f}ms {p95:>7.2f}ms {recall:>10.3f} "
+            f"{hit_rate:>7.3f}"
+        )
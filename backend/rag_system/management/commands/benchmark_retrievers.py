@@ -0,0 +1,150 @@
+# backend/rag_system/management/commands/benchmark_retrievers.py
+import gc
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from rag_system.embedding_store import EmbeddingStore
+from rag_system.retrievers import IndexedChunk, get_retriever
+
+VOCABULARY_SIZE = 50000
+TOPIC_WORDS = 50
+CHUNK_SIZE = 1000  # 1トピックあたりのチャンク数の目安
+
+
+class SyntheticCorpus:
+    """トピック構造を持つ合成コーパス（本文と埋め込み）
+
+    各チャンクは Zipf 分布の共通語・トピック語・まれな語からなり、埋め込みは
+    トピックの中心にノイズを加えたもの。クエリは1つのチャンクから作り、
+    そのチャンクを上位 k 件に含められたかで recall@k を測る。
+    """
+
+    def __init__(self, n_chunks: int, store: EmbeddingStore, rng, batch_size=100000):
+        self.rng = rng
+        n_topics = max(1, n_chunks // CHUNK_SIZE)
+        self.topic_words = rng.integers(VOCABULARY_SIZE, size=(n_topics, TOPIC_WORDS))
+        centers = rng.normal(size=(n_topics, store.dimension))
+
+        self.chunks = []
+        self.topics = np.empty(n_chunks, dtype=np.int64)
+        self.rare_words = np.empty((n_chunks, 3), dtype=np.int64)
+        self.store = store
+        for start in range(0, n_chunks, batch_size):
+            size = min(batch_size, n_chunks - start)
+            topics = rng.integers(n_topics, size=size)
+            common = rng.zipf(1.3, size=(size, 30)) % VOCABULARY_SIZE
+            topical = self.topic_words[
+                topics[:, None], rng.integers(TOPIC_WORDS, size=(size, 20))
+            ]
+            rare = rng.integers(VOCABULARY_SIZE, size=(size, 3))
+            words = np.concatenate([common, topical, rare], axis=1)
+            rows = store.append(
+                centers[topics] + rng.normal(0, 0.5, (size, store.dimension))
+            )
+            for i, row in enumerate(rows):
+                content = " ".join(f"w{word}" for word in words[i])
+                self.chunks.append(
+                    IndexedChunk(uuid.uuid4(), uuid.uuid4(), content, row)
+                )
+            self.topics[start : start + size] = topics
+            self.rare_words[start : start + size] = rare
+
+    def queries(self, n_queries: int):
+        """(クエリ文, クエリの埋め込み, 正解のチャンクID) を作る"""
+        targets = self.rng.choice(len(self.chunks), n_queries)
+        matrix = self.store.matrix
+        queries = []
+        for target in targets:
+            chunk = self.chunks[target]
+            words = list(self.rare_words[target][:2]) + list(
+                self.rng.choice(self.topic_words[self.topics[target]], 2)
+            )
+            embedding = np.asarray(matrix[chunk.embedding_row]) + self.rng.normal(
+                0, 0.05, self.store.dimension
+            )
+            text = " ".join(f"w{word}" for word in words)
+            queries.append((text, embedding, chunk.id))
+        return queries
+
+
+class Command(BaseCommand):
+    help = (
+        "合成コーパスで検索バックエンドの構築時間・メモリ・検索レイテンシ・"
+        "recall@k を比較する"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            default="10000,100000",
+            help="カンマ区切りのチャンク数（例: 10000,100000,1000000）",
+        )
+        parser.add_argument(
+            "--backends",
+            default="lexical,dense,ann,hybrid",
+            help="カンマ区切りの検索モード名またはクラスのドットパス",
+        )
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--k", type=int, default=10)
+        parser.add_argument(
+            "--no-memory",
+            action="store_true",
+            help="メモリを計測しない（tracemalloc の分だけ構築時間が短くなる）",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        backends = options["backends"].split(",")
+        for size in [int(value) for value in options["sizes"].split(",")]:
+            with tempfile.TemporaryDirectory(prefix="retriever_bench_") as directory:
+                self._benchmark_size(size, backends, EmbeddingStore(directory), options)
+
+    def _benchmark_size(self, size, backends, store, options):
+        k = options["k"]
+        rng = np.random.default_rng(options["seed"])
+        started = time.perf_counter()
+        corpus = SyntheticCorpus(size, store, rng)
+        queries = corpus.queries(options["queries"])
+        embeddings = {text: embedding for text, embedding, _ in queries}
+        self.stdout.write(
+            f"\nチャンク数: {size}（生成 {time.perf_counter() - started:.1f}s）"
+        )
+        self.stdout.write(
+            f"{'backend':>10} {'build':>9} {'memory':>10} {'p50':>9} "
+            f"{'p95':>9} {'p99':>9} {'recall@' + str(k):>10}"
+        )
+        for name in backends:
+            retriever = get_retriever(name, embeddings.__getitem__, store)
+            self._report(name, retriever, corpus, queries, k, options)
+
+    def _report(self, name, retriever, corpus, queries, k, options):
+        measure_memory = not options["no_memory"]
+        gc.collect()
+        if measure_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        retriever.index(corpus.chunks)
+        build_time = time.perf_counter() - started
+        memory = "-"
+        if measure_memory:
+            # 埋め込みは mmap のストアを共有するため含まない
+            memory = f"{tracemalloc.get_traced_memory()[0] / 2**20:.1f}MB"
+            tracemalloc.stop()
+
+        latency, hits = [], 0
+        for text, _, expected in queries:
+            started = time.perf_counter()
+            ranked = retriever.search(text, top_k=k)
+            latency.append((time.perf_counter() - started) * 1000)
+            hits += any(chunk_id == expected for chunk_id, _ in ranked)
+
+        p50, p95, p99 = np.percentile(latency, [50, 95, 99])
+        self.stdout.write(
+            f"{name:>10} {build_time:>8.2f}s {memory:>10} {p50:>7.2f}ms "
+            f"{p95:>7.2f}ms {p99:>7.2f}ms {hits / len(queries):>10.3f}"
+        )
@@ -0,0 +1,89 @@
+# backend/rag_system/management/commands/compact_embeddings.py
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from rag_system.ann_index import ann_index_path, reset_ann_index
+from rag_system.embedding_store import get_embedding_store
+from rag_system.models import DocumentChunk
+from rag_system.vector_index import reset_vector_index
+
+
+class Command(BaseCommand):
+    help = (
+        "削除されたチャンクの行を除いて埋め込みストアを詰め直し、"
+        "DocumentChunk.embedding_row を新しい行番号に付け替える"
+        "（取り込みワーカーを止めてから実行する）"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--min-dead-ratio",
+            type=float,
+            default=0.2,
+            help="使われていない行の割合がこれ未満なら何もしない",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="1回の更新で付け替えるチャンク数",
+        )
+
+    def handle(self, *args, **options):
+        store = get_embedding_store()
+        batch_size = options["batch_size"]
+
+        # 詰め直しの間は他プロセスの追記を止める
+        with store.exclusive():
+            total = len(store)
+            # 近似重複のチャンクは代表と同じ行を共有するので重複を除く
+            rows = np.unique(
+                np.fromiter(
+                    DocumentChunk.objects.filter(embedding_row__isnull=False)
+                    .values_list("embedding_row", flat=True)
+                    .iterator(),
+                    dtype=np.int64,
+                )
+            )
+            dead = total - len(rows)
+            if not total or dead / total < options["min_dead_ratio"]:
+                self.stdout.write(
+                    f"使われていない行は {dead}/{total} 行のため詰め直しません"
+                )
+                return
+
+            chunks = DocumentChunk.objects.filter(embedding_row__isnull=False)
+            with transaction.atomic():
+                last_id = None
+                while True:
+                    batch_query = (
+                        chunks if last_id is None else chunks.filter(id__gt=last_id)
+                    )
+                    batch = list(
+                        batch_query.order_by("id").only("id", "embedding_row")[
+                            :batch_size
+                        ]
+                    )
+                    if not batch:
+                        break
+                    new_rows = np.searchsorted(
+                        rows, [chunk.embedding_row for chunk in batch]
+                    )
+                    for chunk, row in zip(batch, new_rows.tolist()):
+                        chunk.embedding_row = row
+                    DocumentChunk.objects.bulk_update(batch, ["embedding_row"])
+                    last_id = batch[-1].id
+                # ファイルの置き換えに失敗したら行番号の付け替えも取り消す
+                store.compact(rows)
+
+        # 保存済みのIVFインデックスは古い行番号を持つので消す（次回学習し直す）
+        ann_index_path().unlink(missing_ok=True)
+        reset_vector_index()
+        reset_ann_index()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"詰め直し完了: {total} 行 → {len(rows)} 行（{store.path}）。"
+                f"稼働中のプロセスはベクトルインデックスを作り直します"
+            )
+        )
@@ -0,0 +1,84 @@
+# backend/rag_system/management/commands/dedup_chunks.py
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from rag_system.dedup import DuplicateDetector, save_buckets
+from rag_system.models import CorpusChange, DocumentChunk
+
+
+class Command(BaseCommand):
+    help = (
+        "シグネチャ未計算の既存チャンクの近似重複を判定し、重複チャンクを"
+        "代表チャンクに寄せる"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="1回の更新で処理するチャンク数",
+        )
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=None,
+            help="重複とみなす Jaccard 類似度（省略時は RAG_DEDUP_THRESHOLD）",
+        )
+
+    def handle(self, *args, **options):
+        threshold = options["threshold"]
+        if threshold is None:
+            threshold = settings.RAG_DEDUP_THRESHOLD
+        if threshold <= 0:
+            raise CommandError("--threshold に0より大きい値を指定してください")
+        detector = DuplicateDetector(threshold)
+        batch_size = options["batch_size"]
+        pending = (
+            DocumentChunk.objects.searchable()
+            .filter(minhash__isnull=True)
+            .order_by("id")
+        )
+        total = pending.count()
+        processed = duplicates = 0
+        last_id = None
+
+        while True:
+            # 主キー順に読み進める（先に処理したチャンクが代表になる）
+            batch_query = pending if last_id is None else pending.filter(id__gt=last_id)
+            batch = list(
+                batch_query.only("id", "document_id", "content", "embedding_row")[
+                    :batch_size
+                ]
+            )
+            if not batch:
+                break
+
+            originals = detector.assign(batch)
+            found = [chunk for chunk in batch if chunk.canonical is not None]
+            for chunk in found:
+                chunk.embedding_row = chunk.canonical.embedding_row
+            with transaction.atomic():
+                DocumentChunk.objects.bulk_update(
+                    batch, ["minhash", "canonical", "embedding_row"]
+                )
+                save_buckets(originals)
+                # 重複になったチャンクを各プロセスの検索インデックスから外す
+                CorpusChange.record_many(
+                    {chunk.document_id for chunk in found}, "update"
+                )
+
+            last_id = batch[-1].id
+            processed += len(batch)
+            duplicates += len(found)
+            self.stdout.write(
+                f"{processed}/{total} チャンクを処理しました（重複 {duplicates}）"
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"完了: {processed} チャンク中 {duplicates} チャンクを重複として"
+                f"代表チャンクに寄せました"
+            )
+        )
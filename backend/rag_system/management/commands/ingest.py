@@ -0,0 +1,108 @@
+# backend/rag_system/management/commands/ingest.py
+import os
+import signal
+import threading
+import time
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from rag_system.bulk_ingestion import ingest, iter_source_items
+
+
+class Command(BaseCommand):
+    help = (
+        "ディレクトリ（.txt/.md/.pdf）または JSONL からドキュメントを一括取り込みする"
+        "（中断後に再実行すると取り込み済みを飛ばして続きから取り込む）"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="取り込むディレクトリまたは JSONL ファイル")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="抽出・チャンク分割・埋め込み生成を行うワーカープロセス数"
+            "（0ならこのプロセスで処理する）",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="1回の保存（1トランザクション）でまとめるチャンク数の目安",
+        )
+        parser.add_argument(
+            "--user",
+            help="ドキュメントの登録者のユーザー名（省略時は最初のスーパーユーザー）",
+        )
+
+    def handle(self, *args, **options):
+        path = Path(options["path"])
+        if not path.exists():
+            raise CommandError(f"{path} が見つかりません")
+        user = self._get_user(options["user"])
+
+        started = time.perf_counter()
+
+        def report(documents: int, chunks: int):
+            elapsed = max(time.perf_counter() - started, 1e-9)
+            self.stdout.write(
+                f"{documents} ドキュメント / {chunks} チャンク "
+                f"({documents / elapsed:.1f} docs/s, {chunks / elapsed:.1f} chunks/s)"
+            )
+
+        def report_error(source: str, error: Exception):
+            self.stderr.write(f"失敗: {source}: {error}")
+
+        # 1回目の Ctrl+C では処理中の分を保存してから止める（2回目で強制終了）
+        stop = threading.Event()
+
+        def request_stop(signum, frame):
+            if stop.is_set():
+                raise KeyboardInterrupt
+            stop.set()
+            self.stderr.write("中断します（処理中のドキュメントを保存しています）")
+
+        previous_handler = signal.signal(signal.SIGINT, request_stop)
+        try:
+            documents, chunks = ingest(
+                iter_source_items(path),
+                user,
+                workers=options["workers"],
+                batch_chunks=options["batch_size"],
+                on_write=report,
+                on_error=report_error,
+                stop=stop,
+            )
+        finally:
+            signal.signal(signal.SIGINT, previous_handler)
+        if stop.is_set():
+            self.stdout.write(
+                self.style.WARNING(
+                    f"中断: {documents} ドキュメント / {chunks} チャンクを保存しました"
+                    "（再実行すると続きから取り込みます）"
+                )
+            )
+            return
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"完了: {documents} ドキュメント / {chunks} チャンク "
+                f"{elapsed:.1f}s ({documents / elapsed:.1f} docs/s, "
+                f"{chunks / elapsed:.1f} chunks/s)"
+            )
+        )
+
+    def _get_user(self, username):
+        if username:
+            try:
+                return User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError(f"ユーザー {username} が見つかりません")
+        user = User.objects.filter(is_superuser=True).order_by("id").first()
+        if user is None:
+            raise CommandError(
+                "--user を指定してください（スーパーユーザーがいません）"
+            )
+        return user
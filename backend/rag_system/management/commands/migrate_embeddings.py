@@ -0,0 +1,55 @@
+# backend/rag_system/management/commands/migrate_embeddings.py
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from rag_system.embedding_store import get_embedding_store
+from rag_system.models import DocumentChunk
+
+
+class Command(BaseCommand):
+    help = "JSONFieldに保存された埋め込みをmmap埋め込みストアへ移行する"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="1回の追記・更新で処理するチャンク数",
+        )
+        parser.add_argument(
+            "--keep-json",
+            action="store_true",
+            help="移行後もJSONFieldの埋め込みを残す",
+        )
+
+    def handle(self, *args, **options):
+        store = get_embedding_store()
+        batch_size = options["batch_size"]
+        pending = DocumentChunk.objects.filter(
+            embedding__isnull=False, embedding_row__isnull=True
+        )
+        total = pending.count()
+        migrated = 0
+
+        while True:
+            # 処理済みの行はembedding_rowが埋まるので、常に先頭から取り直す
+            batch = list(pending.only("id", "embedding")[:batch_size])
+            if not batch:
+                break
+
+            rows = store.append([chunk.embedding for chunk in batch])
+            with transaction.atomic():
+                for chunk, row in zip(batch, rows):
+                    chunk.embedding_row = row
+                    if not options["keep_json"]:
+                        chunk.embedding = None
+                DocumentChunk.objects.bulk_update(batch, ["embedding_row", "embedding"])
+
+            migrated += len(batch)
+            self.stdout.write(f"{migrated}/{total} チャンクを移行しました")
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"移行完了: {migrated} チャンク（{store.path}, {len(store)} 行）"
+            )
+        )
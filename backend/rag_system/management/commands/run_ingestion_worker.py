@@ -0,0 +1,77 @@
+# backend/rag_system/management/commands/run_ingestion_worker.py
+import multiprocessing
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from rag_system.ingestion import (
+    enqueue_unprocessed_documents,
+    requeue_stale_jobs,
+    worker_loop,
+)
+
+
+def _worker_main(poll_interval: float, once: bool):
+    # spawn 方式で起動された場合はDjangoを初期化し直す
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+    worker_loop(poll_interval=poll_interval, once=once)
+
+
+class Command(BaseCommand):
+    help = "ドキュメント取り込みジョブを処理するワーカープロセス群を起動する"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=2, help="ワーカープロセス数")
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1.0,
+            help="ジョブが無いときの待機秒数",
+        )
+        parser.add_argument(
+            "--stale-after",
+            type=int,
+            default=600,
+            help="この秒数以上処理中のままのジョブを待機中に戻す",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="待機中のジョブを処理し終えたら終了する",
+        )
+
+    def handle(self, *args, **options):
+        requeued = requeue_stale_jobs(options["stale_after"])
+        enqueued = enqueue_unprocessed_documents()
+        self.stdout.write(
+            f"再投入: {requeued} 件, 未処理ドキュメントから登録: {enqueued} 件"
+        )
+
+        if options["workers"] <= 1:
+            worker_loop(poll_interval=options["poll_interval"], once=options["once"])
+            return
+
+        # 子プロセスへDB接続を引き継がないよう閉じてから起動する
+        connections.close_all()
+        processes = [
+            multiprocessing.Process(
+                target=_worker_main,
+                args=(options["poll_interval"], options["once"]),
+                name=f"ingestion-worker-{i}",
+            )
+            for i in range(options["workers"])
+        ]
+        for process in processes:
+            process.start()
+        self.stdout.write(f"{len(processes)} ワーカーを起動しました")
+
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
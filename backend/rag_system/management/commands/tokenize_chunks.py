@@ -0,0 +1,55 @@
+# backend/rag_system/management/commands/tokenize_chunks.py
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from rag_system.models import DocumentChunk
+from rag_system.tokenizer import join_tokens, tokenize
+
+
+class Command(BaseCommand):
+    help = "チャンクの検索用トークンを生成して保存する（未生成のもの、または全件）"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="1回の更新で処理するチャンク数",
+        )
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="生成済みのものも作り直す（RAG_TOKENIZER を変えたとき）",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        pending = DocumentChunk.objects.order_by("id")
+        if not options["all"]:
+            pending = pending.filter(search_tokens__isnull=True)
+        total = pending.count()
+        updated = 0
+        last_id = None
+
+        while True:
+            # 主キー順に読み進める（--all では更新後も条件から外れないため）
+            batch_query = pending if last_id is None else pending.filter(id__gt=last_id)
+            batch = list(batch_query.only("id", "content")[:batch_size])
+            if not batch:
+                break
+
+            for chunk in batch:
+                chunk.search_tokens = join_tokens(tokenize(chunk.content))
+            with transaction.atomic():
+                DocumentChunk.objects.bulk_update(batch, ["search_tokens"])
+
+            last_id = batch[-1].id
+            updated += len(batch)
+            self.stdout.write(f"{updated}/{total} チャンクを処理しました")
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"完了: {updated} チャンク（稼働中のプロセスの検索インデックスは"
+                f"再起動時に作り直されます）"
+            )
+        )
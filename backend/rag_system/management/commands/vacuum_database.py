@@ -0,0 +1,26 @@
+# backend/rag_system/management/commands/vacuum_database.py
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection
+
+from rag_system.fts_search import rebuild_fts_index
+
+
+class Command(BaseCommand):
+    help = (
+        "SQLite のデータベースを VACUUM し、振り直された rowid に合わせて"
+        "チャンクの FTS5 索引を作り直す"
+    )
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("SQLite のデータベースでのみ実行できます")
+        with connection.cursor() as cursor:
+            cursor.execute("VACUUM")
+        try:
+            rebuilt = rebuild_fts_index(connection)
+        except DatabaseError:
+            rebuilt = False  # FTS5 の索引が無い（FTS5 なしでビルドされた SQLite）
+        message = "VACUUM が完了しました"
+        if rebuilt:
+            message += "（FTS5 索引を作り直しました）"
+        self.stdout.write(self.style.SUCCESS(message))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rag_system", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="documentchunk",
+            name="embedding_row",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:34
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rag_system", "0004_embeddingcacheentry"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="document",
+            index=models.Index(
+                fields=["-uploaded_at", "-id"], name="document_uploaded_idx"
+            ),
+        ),
+    ]
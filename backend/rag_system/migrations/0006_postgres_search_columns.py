@@ -0,0 +1,53 @@
+from django.db import migrations, transaction
+
+# PostgreSQL 専用の全文検索インデックスと埋め込み列。SQLite では何もしない。
+# 埋め込み列は pgvector が使えれば vector(128)、なければ real[] で作る。
+
+TABLE = "rag_system_documentchunk"
+TSVECTOR_INDEX = "documentchunk_content_tsv_idx"
+VECTOR_INDEX = "documentchunk_embedding_vector_idx"
+EMBEDDING_DIMENSION = 128
+
+
+def create_search_columns(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {TSVECTOR_INDEX} ON {TABLE}"
+            f" USING GIN (to_tsvector('simple', content))"
+        )
+        try:
+            # 拡張の作成には権限が必要なので、失敗したら配列型にする
+            with transaction.atomic(using=schema_editor.connection.alias):
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS vector")
+                cursor.execute(
+                    f"ALTER TABLE {TABLE} ADD COLUMN embedding_vector"
+                    f" vector({EMBEDDING_DIMENSION})"
+                )
+                cursor.execute(
+                    f"CREATE INDEX {VECTOR_INDEX} ON {TABLE}"
+                    f" USING hnsw (embedding_vector vector_cosine_ops)"
+                )
+        except Exception:
+            cursor.execute(f"ALTER TABLE {TABLE} ADD COLUMN embedding_vector real[]")
+
+
+def drop_search_columns(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"DROP INDEX IF EXISTS {TSVECTOR_INDEX}")
+        cursor.execute(f"DROP INDEX IF EXISTS {VECTOR_INDEX}")
+        cursor.execute(f"ALTER TABLE {TABLE} DROP COLUMN IF EXISTS embedding_vector")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rag_system", "0005_document_uploaded_idx"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_columns, drop_search_columns),
+    ]
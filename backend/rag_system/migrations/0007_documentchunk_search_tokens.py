@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rag_system", "0006_postgres_search_columns"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="documentchunk",
+            name="search_tokens",
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.4 on 2026-10-18 07:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rag_system", "0007_documentchunk_search_tokens"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="document",
+            name="source",
+            field=models.CharField(
+                blank=True, db_index=True, default="", max_length=1024
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 08:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rag_system", "0010_chunk_near_duplicates"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="embeddingcacheentry",
+            name="created_at",
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
@@ -1,5 +1,5 @@
 # backend/rag_system/models.py
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 import uuid
 
@@ -16,14 +16,26 @@ class Document(models.Model):
     uploaded_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_processed = models.BooleanField(default=False)  # ベクトル化済みかどうか
+    # 一括取り込み（manage.py ingest）の取り込み元。再実行時に取り込み済みを飛ばす
+    source = models.CharField(max_length=1024, blank=True, default="", db_index=True)
 
     class Meta:
         ordering = ["-uploaded_at"]
+        indexes = [
+            # 一覧のキーセットページネーション用
+            models.Index(fields=["-uploaded_at", "-id"], name="document_uploaded_idx"),
+        ]
 
     def __str__(self):
         return self.title
 
 
+class DocumentChunkQuerySet(models.QuerySet):
+    def searchable(self):
+        """検索インデックスに載せるチャンク（近似重複として代表を参照するものを除く）"""
+        return self.filter(canonical__isnull=True)
+
+
 class DocumentChunk(models.Model):
     """ドキュメントのチャンク（分割されたテキスト片）"""
 
@@ -33,9 +45,27 @@ class DocumentChunk(models.Model):
     )
     content = models.TextField()
     chunk_index = models.IntegerField()  # ドキュメント内での順序
-    embedding = models.JSONField(null=True, blank=True)  # ベクトル埋め込み
+    embedding = models.JSONField(null=True, blank=True)  # 旧形式のベクトル埋め込み
+    embedding_row = models.IntegerField(null=True, blank=True)  # 埋め込みストアの行番号
+    # 検索用トークン（取り込み時に分割して空白区切りで保存。NULL は未生成）
+    search_tokens = models.TextField(null=True, blank=True)
+    # 本文のハッシュ（再取り込み時に変わっていないチャンクを見分ける。空は未計算）
+    content_hash = models.CharField(max_length=64, blank=True, default="")
+    # 本文の MinHash シグネチャ（近似重複の判定用。NULL は未計算）
+    minhash = models.BinaryField(null=True, blank=True)
+    # 近似重複の代表チャンク。設定されたチャンクは代表の埋め込みを共有し、
+    # 検索インデックスには載せない（検索結果は代表で返す）
+    canonical = models.ForeignKey(
+        "self",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="duplicates",
+    )
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = DocumentChunkQuerySet.as_manager()
+
     class Meta:
         ordering = ["document", "chunk_index"]
         unique_together = ["document", "chunk_index"]
@@ -44,6 +74,22 @@ class DocumentChunk(models.Model):
         return f"{self.document.title} - Chunk {self.chunk_index}"
 
 
+class MinHashBucket(models.Model):
+    """近似重複検出（MinHash LSH）のバケット
+
+    代表チャンクのシグネチャをバンドに分け、バンドごとのハッシュを1行ずつ持つ。
+    同じバケットに入ったチャンクだけをシグネチャで比べる。
+    """
+
+    key = models.BigIntegerField(db_index=True)
+    chunk = models.ForeignKey(
+        DocumentChunk, on_delete=models.CASCADE, related_name="minhash_buckets"
+    )
+
+    def __str__(self):
+        return f"{self.key} - {self.chunk_id}"
+
+
 class Conversation(models.Model):
     """会話セッション"""
 
@@ -116,3 +162,103 @@ class UserFeedback(models.Model):
 
     def __str__(self):
         return f"Feedback: {self.rating}/5"
+
+
+class IngestionJob(models.Model):
+    """ドキュメント取り込み（テキスト抽出・チャンク分割・埋め込み生成）の非同期ジョブ"""
+
+    STATUS_PENDING = "pending"
+    STATUS_RUNNING = "running"
+    STATUS_COMPLETED = "completed"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "待機中"),
+        (STATUS_RUNNING, "処理中"),
+        (STATUS_COMPLETED, "完了"),
+        (STATUS_FAILED, "失敗"),
+    ]
+    FINISHED_STATUSES = (STATUS_COMPLETED, STATUS_FAILED)
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    document = models.ForeignKey(
+        Document, on_delete=models.CASCADE, related_name="ingestion_jobs"
+    )
+    status = models.CharField(
+        max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True
+    )
+    total_chunks = models.IntegerField(default=0)
+    processed_chunks = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    attempts = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # 処理中のワーカーが最後に進捗を報告した時刻（止まったジョブの判定に使う）
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["created_at"]
+
+    @property
+    def progress(self) -> float:
+        """処理済みの割合（処理中の total_chunks は本文の長さからの見積もり）"""
+        if self.status == self.STATUS_COMPLETED:
+            return 1.0
+        if not self.total_chunks:
+            return 0.0
+        return min(self.processed_chunks / self.total_chunks, 1.0)
+
+    def __str__(self):
+        return f"{self.document.title} - {self.get_status_display()}"
+
+
+class CorpusChange(models.Model):
+    """コーパスの変更ログ（各プロセスの検索インデックス同期用）
+
+    IDは単調増加するので、最新のIDをコーパスのバージョンとして扱える。
+    """
+
+    ACTION_CHOICES = [
+        ("add", "追加"),
+        ("update", "更新"),
+        ("remove", "削除"),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    document_id = models.UUIDField()
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @classmethod
+    def current_version(cls) -> int:
+        latest = cls.objects.order_by("-id").values_list("id", flat=True).first()
+        return latest or 0
+
+    @classmethod
+    def record(cls, document_id, action: str):
+        """トランザクションのコミット後に変更を記録"""
+        transaction.on_commit(
+            lambda: cls.objects.create(document_id=document_id, action=action)
+        )
+
+    @classmethod
+    def record_many(cls, document_ids, action: str):
+        """複数ドキュメントの変更をコミット後にまとめて記録"""
+        changes = [
+            cls(document_id=document_id, action=action) for document_id in document_ids
+        ]
+        transaction.on_commit(lambda: cls.objects.bulk_create(changes))
+
+    def __str__(self):
+        return f"#{self.id} {self.action} {self.document_id}"
+
+
+class EmbeddingCacheEntry(models.Model):
+    """テキスト内容のハッシュをキーにした埋め込みキャッシュ"""
+
+    content_hash = models.CharField(max_length=64, primary_key=True)  # SHA-256
+    embedding = models.BinaryField()  # float32 のバイト列
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)  # 古い順に削除
+
+    def __str__(self):
+        return self.content_hash
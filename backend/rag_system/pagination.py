@@ -0,0 +1,24 @@
+# backend/rag_system/pagination.py
+from rest_framework.pagination import CursorPagination
+
+
+class DocumentCursorPagination(CursorPagination):
+    """ドキュメント一覧のキーセットページネーション（新しい順）
+
+    ページ番号方式と違い COUNT(*) や OFFSET を使わず、前ページ末尾の
+    uploaded_at を起点にインデックスを辿るため、件数によらず一定時間で返せる。
+    """
+
+    ordering = ("-uploaded_at", "-id")
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+
+
+class ChunkCursorPagination(CursorPagination):
+    """ドキュメント内チャンク一覧のキーセットページネーション（chunk_index 順）"""
+
+    ordering = ("chunk_index",)
+    page_size = 100
+    page_size_query_param = "page_size"
+    max_page_size = 500
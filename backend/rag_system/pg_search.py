@@ -0,0 +1,95 @@
+# backend/rag_system/pg_search.py
+from typing import Iterable, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from django.db import connection
+
+# 全文検索インデックスのテキスト検索設定（式インデックスと検索で同じものを使う）
+TS_CONFIG = "simple"
+CHUNK_TABLE = "rag_system_documentchunk"
+VECTOR_COLUMN = "embedding_vector"
+WRITE_BATCH_SIZE = 500
+
+_vector_column_type: Optional[str] = None
+
+
+def is_postgres() -> bool:
+    return connection.vendor == "postgresql"
+
+
+def vector_column_type() -> Optional[str]:
+    """埋め込み列の型（pgvector なら "vector"、配列なら "_float4"、なければ None）"""
+    global _vector_column_type
+    if _vector_column_type is None and is_postgres():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT udt_name FROM information_schema.columns"
+                " WHERE table_name = %s AND column_name = %s",
+                [CHUNK_TABLE, VECTOR_COLUMN],
+            )
+            row = cursor.fetchone()
+        _vector_column_type = row[0] if row else ""
+    return _vector_column_type or None
+
+
+def supports_vector_search() -> bool:
+    return vector_column_type() == "vector"
+
+
+def _vector_literal(vector: Sequence[float]) -> str:
+    return "[" + ",".join(f"{float(value):.7g}" for value in vector) + "]"
+
+
+def store_vectors(rows: Iterable[Tuple[UUID, Sequence[float]]]):
+    """チャンクの埋め込みを埋め込み列に書き込む（列がなければ何もしない）"""
+    column_type = vector_column_type()
+    if column_type is None:
+        return
+    if column_type == "vector":
+        sql = f"UPDATE {CHUNK_TABLE} SET {VECTOR_COLUMN} = %s::vector WHERE id = %s"
+        params = [(_vector_literal(vector), chunk_id) for chunk_id, vector in rows]
+    else:
+        sql = f"UPDATE {CHUNK_TABLE} SET {VECTOR_COLUMN} = %s WHERE id = %s"
+        params = [
+            ([float(value) for value in vector], chunk_id) for chunk_id, vector in rows
+        ]
+    with connection.cursor() as cursor:
+        for start in range(0, len(params), WRITE_BATCH_SIZE):
+            cursor.executemany(sql, params[start : start + WRITE_BATCH_SIZE])
+
+
+def lexical_search(query: str, top_k: int = 3) -> List[Tuple[UUID, float]]:
+    """tsvector の GIN インデックスを使い、DB側で全文検索してランキング"""
+    sql = f"""
+        SELECT id, ts_rank_cd(to_tsvector('{TS_CONFIG}', content), q) AS score
+        FROM {CHUNK_TABLE}, plainto_tsquery('{TS_CONFIG}', %s) AS q
+        WHERE to_tsvector('{TS_CONFIG}', content) @@ q AND canonical_id IS NULL
+        ORDER BY score DESC
+        LIMIT %s
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [query, top_k])
+        return [(_as_uuid(chunk_id), float(score)) for chunk_id, score in cursor]
+
+
+def vector_search(
+    query_embedding: Sequence[float], top_k: int = 3
+) -> List[Tuple[UUID, float]]:
+    """pgvector のコサイン距離演算子で、DB側で最近傍検索"""
+    if not supports_vector_search():
+        raise RuntimeError("pgvector の埋め込み列がありません")
+    sql = f"""
+        SELECT id, 1 - ({VECTOR_COLUMN} <=> %s::vector) AS score
+        FROM {CHUNK_TABLE}
+        WHERE {VECTOR_COLUMN} IS NOT NULL AND canonical_id IS NULL
+        ORDER BY {VECTOR_COLUMN} <=> %s::vector
+        LIMIT %s
+    """
+    literal = _vector_literal(query_embedding)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [literal, literal, top_k])
+        return [(_as_uuid(chunk_id), float(score)) for chunk_id, score in cursor]
+
+
+def _as_uuid(value) -> UUID:
+    return value if isinstance(value, UUID) else UUID(str(value))
@@ -0,0 +1,298 @@
+# backend/rag_system/quantization.py
+import copy
+from typing import List, Optional, Sequence, Tuple
+from uuid import UUID
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .embedding_store import EmbeddingStore, normalize
+from .vector_index import DenseVectorIndex
+
+TRAINING_SAMPLE_SIZE = 10000
+KMEANS_ITERATIONS = 15
+RETRAIN_GROWTH_FACTOR = 4
+MIN_TRAINING_SIZE = 1000  # これ未満のベクトル数では量子化せず総当たり検索する
+ENCODE_BLOCK_ROWS = 65536  # 符号化で一度に読む行数
+SCORE_BLOCK_ROWS = 2048  # int8 を float32 に展開する行数（キャッシュに収まる大きさ）
+
+
+def kmeans(
+    vectors: np.ndarray, n_clusters: int, iterations: int = KMEANS_ITERATIONS, seed=0
+) -> np.ndarray:
+    """ユークリッド距離の k-means（直積量子化の部分空間の代表ベクトル用）"""
+    rng = np.random.default_rng(seed)
+    n_clusters = min(n_clusters, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+
+    for _ in range(iterations):
+        # ||x - c||² の大小は ||c||² - 2x·c で決まる
+        distances = (centroids**2).sum(axis=1) - 2 * vectors @ centroids.T
+        assignment = np.argmin(distances, axis=1)
+        sums = np.stack(
+            [
+                np.bincount(assignment, weights=vectors[:, j], minlength=n_clusters)
+                for j in range(vectors.shape[1])
+            ],
+            axis=1,
+        )
+        counts = np.bincount(assignment, minlength=n_clusters)
+
+        # 空になったクラスタはランダムな点で埋め直す
+        empty = counts == 0
+        centroids = sums / np.maximum(counts, 1)[:, None]
+        if empty.any():
+            centroids[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+
+    return centroids.astype(np.float32)
+
+
+class ScalarQuantizer:
+    """次元ごとの最小値とスケールで各成分を int8（1バイト）に量子化
+
+    学習したベクトルの次元ごとの値の範囲を256段階に分ける。範囲外の値は
+    端に丸める。float32 の 1/4 の大きさになる。
+    """
+
+    name = "int8"
+
+    def __init__(self, dimension: int):
+        self.dimension = dimension
+        self.code_size = dimension
+        self.code_dtype = np.int8
+        self.offset: Optional[np.ndarray] = None
+        self.scale: Optional[np.ndarray] = None
+
+    def train(self, vectors: np.ndarray, seed: int = 0):
+        low = vectors.min(axis=0)
+        high = vectors.max(axis=0)
+        self.offset = low.astype(np.float32)
+        self.scale = np.maximum((high - low) / 255, 1e-12).astype(np.float32)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        levels = np.rint((vectors - self.offset) / self.scale)
+        return (np.clip(levels, 0, 255) - 128).astype(np.int8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return (codes.astype(np.float32) + 128) * self.scale + self.offset
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """復元したベクトルとクエリの内積（符号を展開せず重みとの積で求める）"""
+        weights = query * self.scale
+        bias = float(query @ (self.offset + 128 * self.scale))
+        scores = np.empty(len(codes), dtype=np.float32)
+        buffer = np.empty((SCORE_BLOCK_ROWS, self.dimension), dtype=np.float32)
+        for start in range(0, len(codes), SCORE_BLOCK_ROWS):
+            block = codes[start : start + SCORE_BLOCK_ROWS]
+            expanded = buffer[: len(block)]
+            expanded[:] = block
+            scores[start : start + len(block)] = expanded @ weights
+        return scores + bias
+
+
+class ProductQuantizer:
+    """直積量子化（ベクトルを m 個の部分空間に分け、部分空間ごとに
+    256個の代表ベクトルのどれに近いかの番号1バイトで表す）
+
+    検索時はクエリと各代表ベクトルの内積の表（m × 256）を一度だけ作り、
+    符号ごとに表を引いて足し合わせる（非対称距離計算, ADC）。
+    """
+
+    name = "pq"
+
+    def __init__(self, dimension: int, subspaces: int = 16, centroids: int = 256):
+        if dimension % subspaces:
+            raise ValueError(
+                f"次元数 {dimension} が部分空間の数 {subspaces} で割り切れません"
+            )
+        self.dimension = dimension
+        self.subspaces = subspaces
+        self.subdimension = dimension // subspaces
+        self.centroids = centroids
+        self.code_size = subspaces
+        self.code_dtype = np.uint8
+        self.codebooks: Optional[np.ndarray] = None  # (m, 256, d/m)
+
+    def _split(self, vectors: np.ndarray) -> np.ndarray:
+        return vectors.reshape(len(vectors), self.subspaces, self.subdimension)
+
+    def train(self, vectors: np.ndarray, seed: int = 0):
+        parts = self._split(vectors)
+        codebooks = np.zeros(
+            (self.subspaces, self.centroids, self.subdimension), dtype=np.float32
+        )
+        for i in range(self.subspaces):
+            trained = kmeans(parts[:, i], self.centroids, seed=seed + i)
+            codebooks[i, : len(trained)] = trained
+        self.codebooks = codebooks
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        parts = self._split(vectors)
+        codes = np.empty((len(vectors), self.subspaces), dtype=np.uint8)
+        for i, codebook in enumerate(self.codebooks):
+            distances = (codebook**2).sum(axis=1) - 2 * parts[:, i] @ codebook.T
+            codes[:, i] = np.argmin(distances, axis=1)
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        parts = self.codebooks[np.arange(self.subspaces), codes]
+        return parts.reshape(len(codes), self.dimension)
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """内積の表を引いて足し合わせた近似スコア"""
+        table = np.einsum("mkd,md->mk", self.codebooks, self._split(query[None])[0])
+        scores = np.zeros(len(codes), dtype=np.float32)
+        for i in range(self.subspaces):
+            scores += table[i].take(codes[:, i])
+        return scores
+
+
+class QuantizedVectorIndex(DenseVectorIndex):
+    """量子化した符号で総当たりし、上位候補だけ元の float32 で並べ直すインデックス
+
+    各行の符号（int8 なら次元数バイト、PQ なら部分空間数バイト）をプロセス内に
+    持ち、検索ではストアの float32 行列を走査しない。近似スコアの上位
+    top_k × rerank 件だけストアから読み直して正確なコサイン類似度で並べ直す
+    （rerank が0なら近似スコアのまま返す）。学習前（またはベクトル数が少ない
+    間）は総当たり検索になる。追加で学習し直す必要が出たらバックグラウンドで
+    学習し、終わるまでは前の量子化器の符号で検索する。
+    """
+
+    def __init__(self, store: EmbeddingStore, quantizer, rerank: int = 10):
+        super().__init__(store)
+        self.quantizer = quantizer
+        self.rerank = rerank
+        self._codes = np.zeros((0, quantizer.code_size), dtype=quantizer.code_dtype)
+        self._trained_size = 0
+
+    @property
+    def is_trained(self) -> bool:
+        return self._trained_size > 0
+
+    @property
+    def code_bytes(self) -> int:
+        """登録済みベクトルの符号の合計バイト数（符号は1要素1バイト）"""
+        return len(self._chunk_ids) * self.quantizer.code_size
+
+    def train(self, seed: int = 0):
+        """登録済みベクトルの標本で量子化器を学習し、全ベクトルを符号化し直す
+
+        学習・符号化はその時点の行の写しに対してロックを持たずに行い、検索・追加は
+        前の量子化器で続ける。学習中に追加された行は入れ替えの際に符号化する。
+        """
+        with self._lock:
+            rows = self._rows()
+        if len(rows) < MIN_TRAINING_SIZE:
+            return
+        rows.sort()
+        matrix = self._store.matrix
+        sample = rows
+        if len(rows) > TRAINING_SAMPLE_SIZE:
+            rng = np.random.default_rng(seed)
+            sample = np.sort(rng.choice(rows, TRAINING_SAMPLE_SIZE, replace=False))
+        quantizer = copy.copy(self.quantizer)
+        quantizer.train(np.asarray(matrix[sample]), seed=seed)
+        codes = np.zeros(
+            (int(rows[-1]) + 1, quantizer.code_size), dtype=quantizer.code_dtype
+        )
+        self._encode(quantizer, codes, rows)
+
+        with self._lock:
+            added = np.setdiff1d(self._rows(), rows)
+            if len(codes) < len(self._alive):
+                codes = np.concatenate(
+                    [
+                        codes,
+                        np.zeros(
+                            (len(self._alive) - len(codes), quantizer.code_size),
+                            dtype=quantizer.code_dtype,
+                        ),
+                    ]
+                )
+            self._encode(quantizer, codes, added)
+            self.quantizer = quantizer
+            self._codes = codes
+            self._trained_size = len(rows)
+
+    def _encode(self, quantizer, codes: np.ndarray, rows: np.ndarray):
+        """rows の行を符号化して codes に書き込む"""
+        matrix = self._store.matrix
+        for start in range(0, len(rows), ENCODE_BLOCK_ROWS):
+            block = rows[start : start + ENCODE_BLOCK_ROWS]
+            codes[block] = quantizer.encode(np.asarray(matrix[block]))
+
+    def add_chunk(self, chunk_id: UUID, document_id: UUID, row: int):
+        """チャンクを登録し、学習済みならその行を符号化する"""
+        with self._lock:
+            if not super().add_chunk(chunk_id, document_id, row):
+                return  # 近似重複のチャンクと共有する行は符号化済み
+            if not self.is_trained:
+                if len(self._row_of) >= MIN_TRAINING_SIZE:
+                    self.train_in_background()
+                return
+            if len(self._row_of) > self._trained_size * RETRAIN_GROWTH_FACTOR:
+                # 学習時から大きく増えたら値の分布を学習し直す（終わるまで今の符号を使う）
+                self.train_in_background()
+            if row >= len(self._codes):
+                codes = np.zeros(
+                    (len(self._alive), self.quantizer.code_size),
+                    dtype=self._codes.dtype,
+                )
+                codes[: len(self._codes)] = self._codes
+                self._codes = codes
+            self._codes[row] = self.quantizer.encode(self._store.get(row)[None])[0]
+
+    def search(
+        self, query_embedding: Sequence[float], top_k: int = 3
+    ) -> List[Tuple[UUID, float]]:
+        """符号の近似スコアで候補を絞り、候補だけ正確なスコアで並べ直す"""
+        if not self.is_trained:
+            return super().search(query_embedding, top_k=top_k)
+
+        query = normalize(query_embedding)
+        with self._lock:
+            if not self._row_of:
+                return []
+
+            n_rows = min(len(self._codes), len(self._alive))
+            scores = self.quantizer.scores(self._codes[:n_rows], query)
+            scores[~self._alive[:n_rows]] = -np.inf
+
+            k = min(top_k, len(self._chunk_ids))
+            n_candidates = min(max(k * self.rerank, k), len(self._chunk_ids))
+            candidates = np.argpartition(-scores, n_candidates - 1)[:n_candidates]
+            if self.rerank:
+                # 行番号順に読むと mmap のページアクセスが連続する
+                candidates = np.sort(candidates)
+                scores = np.asarray(self._store.matrix[candidates]) @ query
+            else:
+                scores = scores[candidates]
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind="stable")]
+            return [
+                (self._chunk_ids[int(candidates[i])], float(scores[i])) for i in top
+            ]
+
+
+def make_quantizer(name: str, dimension: int, subspaces: Optional[int] = None):
+    """名前（"int8" / "pq"）の量子化器を作る（空なら None）"""
+    if not name:
+        return None
+    if name == "int8":
+        return ScalarQuantizer(dimension)
+    if name == "pq":
+        return ProductQuantizer(dimension, subspaces or settings.RAG_PQ_SUBSPACES)
+    raise ImproperlyConfigured(
+        f"未知の量子化方式です: {name!r}（int8 または pq を指定してください）"
+    )
+
+
+def new_vector_index(store: EmbeddingStore) -> DenseVectorIndex:
+    """設定（RAG_VECTOR_QUANTIZATION）に応じたベクトルインデックスを作る"""
+    quantizer = make_quantizer(settings.RAG_VECTOR_QUANTIZATION, store.dimension)
+    if quantizer is None:
+        return DenseVectorIndex(store)
+    return QuantizedVectorIndex(
+        store, quantizer, rerank=settings.RAG_QUANTIZATION_RERANK
+    )
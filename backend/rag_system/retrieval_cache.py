@@ -0,0 +1,194 @@
+# backend/rag_system/retrieval_cache.py
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, List, Optional, Set, Tuple
+from uuid import UUID
+
+from django.conf import settings
+
+# エントリを無効化する範囲
+# terms: 結果の文書の変更、またはクエリ語を含む文書の追加で無効化（語彙検索）。
+#   クエリ語を含まない文書の追加・削除でも BM25 の IDF と平均チャンク長は
+#   変わるが、一致するチャンクの集合は変わらないので無効化しない。その間の
+#   スコアと僅差の順位は古いままになりうる（TTL で作り直される近似）
+# add: 結果の文書の変更、または何らかの文書の追加で無効化（ベクトル検索）
+# change: あらゆる文書の変更で無効化（ハイブリッド検索）
+INVALIDATE_BY_TERMS = "terms"
+INVALIDATE_ON_ADD = "add"
+INVALIDATE_ON_CHANGE = "change"
+
+Ranking = List[Tuple[UUID, float]]
+
+
+class _Entry:
+    __slots__ = ("ranked", "document_ids", "terms", "scope", "expires_at")
+
+    def __init__(self, ranked, document_ids, terms, scope, expires_at):
+        self.ranked = ranked
+        self.document_ids = document_ids
+        self.terms = terms
+        self.scope = scope
+        self.expires_at = expires_at
+
+
+class RetrievalCache:
+    """検索結果（チャンクIDとスコアの上位リスト）の LRU/TTL キャッシュ
+
+    エントリは結果に含まれるドキュメントでタグ付けし、sync_indexes() が
+    CorpusChange を反映する際に、変更されたドキュメントのタグを持つものだけを
+    破棄する。文書の追加で順位が変わり得るエントリは scope に応じて破棄する
+    （語彙検索はクエリ語を含む文書が追加された場合のみで、それ以外の変更による
+    スコアの小さな変化は TTL まで残る）。
+    """
+
+    def __init__(self, max_entries: int = 4096, ttl: Optional[float] = 300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._by_document: Dict[UUID, Set[Hashable]] = {}
+        self._by_term: Dict[str, Set[Hashable]] = {}
+        self._by_scope: Dict[str, Set[Hashable]] = {
+            INVALIDATE_ON_ADD: set(),
+            INVALIDATE_ON_CHANGE: set(),
+        }
+        self._lock = threading.Lock()
+        self.synced_version = 0  # 反映済みの CorpusChange ID
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def has_term_entries(self) -> bool:
+        return bool(self._by_term)
+
+    def get(self, key: Hashable) -> Optional[Ranking]:
+        """キャッシュ済みの検索結果を返す（なければ None）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at is not None:
+                if entry.expires_at < time.monotonic():
+                    self._discard(key)
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(entry.ranked)
+
+    def set(
+        self,
+        key: Hashable,
+        ranked: Ranking,
+        document_ids: Iterable[UUID],
+        version: int,
+        terms: Iterable[str] = (),
+        scope: str = INVALIDATE_BY_TERMS,
+    ):
+        """検索結果を登録（version は検索開始時点の synced_version）"""
+        with self._lock:
+            if version != self.synced_version:
+                # 検索中に変更が反映された場合、結果が古い可能性があるので登録しない
+                return
+            if key in self._entries:
+                self._discard(key)
+
+            expires_at = time.monotonic() + self.ttl if self.ttl else None
+            entry = _Entry(
+                tuple(ranked),
+                frozenset(document_ids),
+                frozenset(terms),
+                scope,
+                expires_at,
+            )
+            self._entries[key] = entry
+            for document_id in entry.document_ids:
+                self._by_document.setdefault(document_id, set()).add(key)
+            if scope == INVALIDATE_BY_TERMS:
+                for term in entry.terms:
+                    self._by_term.setdefault(term, set()).add(key)
+            else:
+                self._by_scope[scope].add(key)
+
+            while len(self._entries) > self.max_entries:
+                self._discard(next(iter(self._entries)))
+
+    def _discard(self, key: Hashable):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for document_id in entry.document_ids:
+            keys = self._by_document.get(document_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_document[document_id]
+        for term in entry.terms:
+            keys = self._by_term.get(term)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_term[term]
+        if entry.scope in self._by_scope:
+            self._by_scope[entry.scope].discard(key)
+
+    def invalidate(
+        self,
+        changed_document_ids: Set[UUID],
+        added: bool,
+        added_terms: Set[str] = frozenset(),
+    ) -> int:
+        """文書の変更に影響されるエントリを破棄し、破棄した件数を返す
+
+        added は追加・更新を含むか、added_terms は追加されたチャンクの語。
+        """
+        with self._lock:
+            stale = set(self._by_scope[INVALIDATE_ON_CHANGE])
+            for document_id in changed_document_ids:
+                stale |= self._by_document.get(document_id, set())
+            if added:
+                stale |= self._by_scope[INVALIDATE_ON_ADD]
+                for term in added_terms:
+                    stale |= self._by_term.get(term, set())
+            for key in stale:
+                self._discard(key)
+            return len(stale)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._discard(key)
+
+
+_cache: Optional[RetrievalCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_retrieval_cache(build: bool = True) -> Optional[RetrievalCache]:
+    """設定に従ったプロセス共有の検索結果キャッシュ（無効なら None）"""
+    global _cache
+    if settings.RAG_RETRIEVAL_CACHE_SIZE <= 0:
+        return None
+    if _cache is not None or not build:
+        return _cache
+    with _cache_lock:
+        if _cache is None:
+            from .models import CorpusChange
+
+            cache = RetrievalCache(
+                max_entries=settings.RAG_RETRIEVAL_CACHE_SIZE,
+                ttl=settings.RAG_RETRIEVAL_CACHE_TTL,
+            )
+            cache.synced_version = CorpusChange.current_version()
+            _cache = cache
+    return _cache
+
+
+def reset_retrieval_cache():
+    """キャッシュを破棄（次回アクセス時に作り直す）"""
+    global _cache
+    with _cache_lock:
+        _cache = None
@@ -0,0 +1,315 @@
+# backend/rag_system/retrievers.py
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Protocol,
+    Sequence,
+    Tuple,
+)
+from uuid import UUID
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+from . import pg_search
+from .ann_index import IVFIndex, get_ann_index
+from .embedding_store import EmbeddingStore, get_embedding_store
+from .fts_search import fts_search
+from .hybrid_search import hybrid_search
+from .quantization import QuantizedVectorIndex, new_vector_index
+from .retrieval_cache import (
+    INVALIDATE_BY_TERMS,
+    INVALIDATE_ON_ADD,
+    INVALIDATE_ON_CHANGE,
+)
+from .search_index import InvertedIndex, get_search_index
+from .tokenizer import tokenize
+from .vector_index import DenseVectorIndex, get_vector_index
+
+Ranking = List[Tuple[UUID, float]]
+EmbedFn = Callable[[str], Sequence[float]]
+
+DEFAULT_RETRIEVER = "lexical"
+
+
+class IndexedChunk(NamedTuple):
+    """検索バックエンドに登録するチャンク"""
+
+    id: UUID
+    document_id: UUID
+    content: str
+    embedding_row: Optional[int] = None  # 埋め込みストアの行番号
+    tokens: Optional[List[str]] = None  # 検索用トークン（None なら本文から分割）
+
+
+class Retriever(Protocol):
+    """検索バックエンドのインターフェース
+
+    index() は渡したチャンクだけで独自のインデックスを作り直す（ベンチマーク等）。
+    作り直す前はプロセス共有のインデックス（CorpusChange で同期される）を使う。
+    cache_scope は検索結果キャッシュの無効化範囲。uses_embedding はクエリの
+    埋め込みを使うか（非同期の検索では先に await で取得して渡す）。
+    """
+
+    name: str
+    cache_scope: str
+    uses_embedding: bool
+
+    def index(self, chunks: Iterable[IndexedChunk]) -> None: ...
+
+    def add(self, chunks: Iterable[IndexedChunk]) -> None: ...
+
+    def remove(self, chunk_ids: Iterable[UUID]) -> None: ...
+
+    def search(self, query: str, top_k: int = 3) -> Ranking: ...
+
+
+class LexicalRetriever:
+    """転置インデックスでクエリ語を含むチャンクだけをBM25で検索"""
+
+    name = "lexical"
+    # 一致するチャンクはクエリ語を含むものだけなので、クエリ語を含む文書の追加で
+    # 破棄する（無関係な文書による IDF・平均長の変化は TTL までの近似として許す）
+    cache_scope = INVALIDATE_BY_TERMS
+    uses_embedding = False
+
+    def __init__(self, index: Optional[InvertedIndex] = None):
+        self._index = index
+
+    @property
+    def search_index(self) -> InvertedIndex:
+        return self._index if self._index is not None else get_search_index()
+
+    def index(self, chunks: Iterable[IndexedChunk]):
+        self._index = InvertedIndex()
+        self.add(chunks)
+
+    def add(self, chunks: Iterable[IndexedChunk]):
+        index = self.search_index
+        for chunk in chunks:
+            tokens = chunk.tokens
+            if tokens is None:
+                tokens = tokenize(chunk.content)
+            index.add_chunk(chunk.id, chunk.document_id, tokens)
+
+    def remove(self, chunk_ids: Iterable[UUID]):
+        index = self.search_index
+        for chunk_id in chunk_ids:
+            index.remove_chunk(chunk_id)
+
+    def search(self, query: str, top_k: int = 3) -> Ranking:
+        return self.search_index.search(query, top_k=top_k)
+
+
+class DenseRetriever:
+    """埋め込みベクトルのコサイン類似度で総当たり検索
+
+    RAG_VECTOR_QUANTIZATION を設定すると量子化した符号で総当たりする。
+    """
+
+    name = "dense"
+    cache_scope = INVALIDATE_ON_ADD
+    uses_embedding = True
+
+    def __init__(
+        self,
+        embed: EmbedFn,
+        store: Optional[EmbeddingStore] = None,
+        index: Optional[DenseVectorIndex] = None,
+    ):
+        self.embed = embed
+        self._store = store
+        self._index = index
+
+    @property
+    def vector_index(self) -> DenseVectorIndex:
+        return self._index if self._index is not None else get_vector_index()
+
+    def _new_index(self) -> DenseVectorIndex:
+        return new_vector_index(self._store or get_embedding_store())
+
+    def index(self, chunks: Iterable[IndexedChunk]):
+        index = self._new_index()
+        for chunk in chunks:
+            if chunk.embedding_row is not None:
+                # IVF・量子化でも登録中は学習せず、最後に一度だけ学習する
+                DenseVectorIndex.add_chunk(
+                    index, chunk.id, chunk.document_id, chunk.embedding_row
+                )
+        if isinstance(index, (IVFIndex, QuantizedVectorIndex)):
+            index.train()
+        self._index = index
+
+    def add(self, chunks: Iterable[IndexedChunk]):
+        index = self.vector_index
+        for chunk in chunks:
+            if chunk.embedding_row is not None:
+                index.add_chunk(chunk.id, chunk.document_id, chunk.embedding_row)
+
+    def remove(self, chunk_ids: Iterable[UUID]):
+        index = self.vector_index
+        for chunk_id in chunk_ids:
+            index.remove_chunk(chunk_id)
+
+    def search(self, query: str, top_k: int = 3) -> Ranking:
+        return self.vector_index.search(self.embed(query), top_k=top_k)
+
+
+class AnnRetriever(DenseRetriever):
+    """IVF近似最近傍インデックスで検索"""
+
+    name = "ann"
+
+    @property
+    def vector_index(self) -> IVFIndex:
+        return self._index if self._index is not None else get_ann_index()
+
+    def _new_index(self) -> IVFIndex:
+        return IVFIndex(
+            self._store or get_embedding_store(),
+            nlist=settings.RAG_ANN_NLIST,
+            nprobe=settings.RAG_ANN_NPROBE,
+        )
+
+
+class HybridRetriever:
+    """語彙検索とベクトル検索の結果を順位で統合（RRF）"""
+
+    name = "hybrid"
+    # 候補リストの順位が変わると統合結果も変わるため、どの変更でも破棄
+    cache_scope = INVALIDATE_ON_CHANGE
+    uses_embedding = True
+
+    def __init__(self, lexical: LexicalRetriever, dense: DenseRetriever):
+        self.lexical = lexical
+        self.dense = dense
+
+    def index(self, chunks: Iterable[IndexedChunk]):
+        chunks = list(chunks)
+        self.lexical.index(chunks)
+        self.dense.index(chunks)
+
+    def add(self, chunks: Iterable[IndexedChunk]):
+        chunks = list(chunks)
+        self.lexical.add(chunks)
+        self.dense.add(chunks)
+
+    def remove(self, chunk_ids: Iterable[UUID]):
+        chunk_ids = list(chunk_ids)
+        self.lexical.remove(chunk_ids)
+        self.dense.remove(chunk_ids)
+
+    def search(self, query: str, top_k: int = 3) -> Ranking:
+        return hybrid_search(
+            query,
+            self.dense.embed,
+            top_k=top_k,
+            lexical_index=self.lexical.search_index,
+            vector_index=self.dense.vector_index,
+        )
+
+
+class _DatabaseRetriever:
+    """DB側で検索するバックエンド（索引はDBが保守するので登録・削除は不要）"""
+
+    # DB側の検索は語の切り出し方が異なるため、追加のたびに破棄
+    cache_scope = INVALIDATE_ON_ADD
+    uses_embedding = False
+
+    def index(self, chunks: Iterable[IndexedChunk]):
+        pass
+
+    def add(self, chunks: Iterable[IndexedChunk]):
+        pass
+
+    def remove(self, chunk_ids: Iterable[UUID]):
+        pass
+
+
+class FtsRetriever(_DatabaseRetriever):
+    """SQLite の FTS5 索引を bm25() でランキング"""
+
+    name = "fts"
+
+    def search(self, query: str, top_k: int = 3) -> Ranking:
+        return fts_search(query, top_k=top_k)
+
+
+class PgLexicalRetriever(_DatabaseRetriever):
+    """PostgreSQL の tsvector GIN インデックスで全文検索"""
+
+    name = "pg_lexical"
+
+    def search(self, query: str, top_k: int = 3) -> Ranking:
+        return pg_search.lexical_search(query, top_k=top_k)
+
+
+class PgVectorRetriever(_DatabaseRetriever):
+    """PostgreSQL の pgvector 列で最近傍検索"""
+
+    name = "pg_vector"
+    uses_embedding = True
+
+    def __init__(self, embed: EmbedFn):
+        self.embed = embed
+
+    def search(self, query: str, top_k: int = 3) -> Ranking:
+        return pg_search.vector_search(self.embed(query), top_k=top_k)
+
+
+def _hybrid(embed: EmbedFn, store: Optional[EmbeddingStore]) -> HybridRetriever:
+    vector_index = settings.RAG_HYBRID_VECTOR_INDEX
+    if vector_index == "ann":
+        return HybridRetriever(LexicalRetriever(), AnnRetriever(embed, store))
+    if vector_index == "dense":
+        return HybridRetriever(LexicalRetriever(), DenseRetriever(embed, store))
+    raise ImproperlyConfigured(
+        f"RAG_HYBRID_VECTOR_INDEX は dense か ann です: {vector_index!r}"
+    )
+
+
+# 検索モード名 → (埋め込み関数, 埋め込みストア) からバックエンドを作る関数
+RETRIEVERS: Dict[
+    str, Callable[[Optional[EmbedFn], Optional[EmbeddingStore]], Retriever]
+] = {
+    "lexical": lambda embed, store: LexicalRetriever(),
+    "dense": DenseRetriever,
+    "ann": AnnRetriever,
+    "hybrid": _hybrid,
+    "fts": lambda embed, store: FtsRetriever(),
+    "pg_lexical": lambda embed, store: PgLexicalRetriever(),
+    "pg_vector": lambda embed, store: PgVectorRetriever(embed),
+}
+
+
+def get_retriever(
+    name: Optional[str] = None,
+    embed: Optional[EmbedFn] = None,
+    store: Optional[EmbeddingStore] = None,
+) -> Retriever:
+    """設定（RAG_RETRIEVAL_MODE）の検索バックエンドを作る
+
+    名前のほか、埋め込み関数と埋め込みストア（None ならプロセス共有のもの）を
+    受け取るクラスのドットパスも指定できる。未知の名前は ImproperlyConfigured
+    （設定の打ち間違いで別の検索方式に黙って切り替わらないように）。
+    """
+    name = name or settings.RAG_RETRIEVAL_MODE or DEFAULT_RETRIEVER
+    if name in RETRIEVERS:
+        return RETRIEVERS[name](embed, store)
+    if "." in name:
+        try:
+            factory = import_string(name)
+        except ImportError as e:
+            raise ImproperlyConfigured(
+                f"RAG_RETRIEVAL_MODE のクラスを読み込めません: {name!r}"
+            ) from e
+        return factory(embed, store)
+    raise ImproperlyConfigured(
+        f"未知の検索モードです: {name!r}（{', '.join(RETRIEVERS)} または"
+        "クラスのドットパスを指定してください）"
+    )
@@ -0,0 +1,274 @@
+# backend/rag_system/search_index.py
+import math
+import threading
+from array import array
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID
+
+import numpy as np
+
+from .tokenizer import split_tokens, tokenize
+
+MIN_COMPACT_ROWS = 1024  # 削除済みの行がこれ以下なら詰めない
+
+
+def _grow(array: np.ndarray, capacity: int) -> np.ndarray:
+    """配列を0埋めで拡張"""
+    grown = np.zeros(capacity, dtype=array.dtype)
+    grown[: len(array)] = array
+    return grown
+
+
+class _Posting:
+    """1タームのポスティングリスト（行番号と出現回数）
+
+    追加は array.array で受け、検索時に NumPy 配列へ変換したものを
+    次の更新までキャッシュする。
+    """
+
+    __slots__ = ("rows", "freqs", "dead", "_arrays")
+
+    def __init__(self):
+        self.rows = array("i")
+        self.freqs = array("f")
+        self.dead = 0  # 削除済みチャンクを指すエントリ数
+        self._arrays: Optional[Tuple[np.ndarray, np.ndarray]] = None
+
+    @property
+    def df(self) -> int:
+        return len(self.rows) - self.dead
+
+    def append(self, row: int, freq: int):
+        self.rows.append(row)
+        self.freqs.append(freq)
+        self._arrays = None
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        if self._arrays is None:
+            self._arrays = (
+                np.array(self.rows, dtype=np.int32),
+                np.array(self.freqs, dtype=np.float32),
+            )
+        return self._arrays
+
+    def compact(self, alive: np.ndarray, renumber: Optional[np.ndarray] = None):
+        """削除済みエントリを取り除く（renumber を渡すと行番号も付け替える）"""
+        rows, freqs = self.arrays()
+        keep = alive[rows]
+        rows = rows[keep]
+        if renumber is not None:
+            rows = renumber[rows].astype(np.int32)
+        self._arrays = (rows, freqs[keep])
+        self.rows = array("i", self._arrays[0].tobytes())
+        self.freqs = array("f", self._arrays[1].tobytes())
+        self.dead = 0
+
+
+class InvertedIndex:
+    """BM25でランキングする転置インデックス（プロセス内常駐）
+
+    チャンクには追加順に行番号を割り当て、チャンク長・生存フラグを行番号で
+    引ける配列として保持する。DF・平均チャンク長は追加／削除のたびに差分更新
+    するため、検索時はクエリタームのポスティングだけをベクトル演算で処理する。
+    削除済みの行が生存している行より多くなったら、行を詰めて番号を振り直す。
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, _Posting] = {}
+        self._row_of: Dict[UUID, int] = {}
+        self._chunk_ids: List[Optional[UUID]] = []
+        self._row_terms: Dict[int, Tuple[str, ...]] = {}
+        self._chunk_document: Dict[UUID, UUID] = {}
+        self._document_chunks: Dict[UUID, set] = {}
+        self._lengths = np.zeros(16, dtype=np.float32)
+        self._alive = np.zeros(16, dtype=bool)
+        self._total_length = 0.0
+        self._lock = threading.RLock()
+        self.synced_version = 0  # 反映済みの CorpusChange ID
+
+    def __len__(self):
+        return len(self._row_of)
+
+    def __contains__(self, chunk_id: UUID) -> bool:
+        return chunk_id in self._row_of
+
+    def chunk_ids_for_document(self, document_id: UUID) -> set:
+        """ドキュメントに属する登録済みチャンクID"""
+        with self._lock:
+            return set(self._document_chunks.get(document_id, ()))
+
+    @property
+    def average_length(self) -> float:
+        return self._total_length / len(self._row_of) if self._row_of else 0.0
+
+    def add_chunk(self, chunk_id: UUID, document_id: UUID, tokens: List[str]):
+        """取り込み時に分割済みのトークンでチャンクを追加（既存なら置き換え）"""
+        term_freqs: Dict[str, int] = {}
+        for term in tokens:
+            term_freqs[term] = term_freqs.get(term, 0) + 1
+
+        with self._lock:
+            if chunk_id in self._row_of:
+                self.remove_chunk(chunk_id)
+
+            row = len(self._chunk_ids)
+            if row == len(self._lengths):
+                self._lengths = _grow(self._lengths, row * 2)
+                self._alive = _grow(self._alive, row * 2)
+            self._chunk_ids.append(chunk_id)
+            self._lengths[row] = len(tokens)
+            self._alive[row] = True
+            self._total_length += len(tokens)
+
+            for term, freq in term_freqs.items():
+                posting = self._postings.get(term)
+                if posting is None:
+                    posting = self._postings[term] = _Posting()
+                posting.append(row, freq)
+
+            self._row_of[chunk_id] = row
+            self._row_terms[row] = tuple(term_freqs)
+            self._chunk_document[chunk_id] = document_id
+            self._document_chunks.setdefault(document_id, set()).add(chunk_id)
+
+    def remove_chunk(self, chunk_id: UUID):
+        """チャンクをインデックスから削除"""
+        with self._lock:
+            row = self._row_of.pop(chunk_id, None)
+            if row is None:
+                return
+            self._alive[row] = False
+            self._total_length -= float(self._lengths[row])
+            self._chunk_ids[row] = None
+
+            for term in self._row_terms.pop(row):
+                posting = self._postings[term]
+                posting.dead += 1
+                if posting.df == 0:
+                    del self._postings[term]
+                elif posting.dead * 2 > len(posting.rows):
+                    posting.compact(self._alive)
+
+            document_id = self._chunk_document.pop(chunk_id)
+            siblings = self._document_chunks.get(document_id)
+            if siblings is not None:
+                siblings.discard(chunk_id)
+                if not siblings:
+                    del self._document_chunks[document_id]
+
+            dead_rows = len(self._chunk_ids) - len(self._row_of)
+            if dead_rows > max(len(self._row_of), MIN_COMPACT_ROWS):
+                self._compact_rows()
+
+    def _compact_rows(self):
+        """削除済みの行を取り除き、生存している行に 0 から番号を振り直す"""
+        n_rows = len(self._chunk_ids)
+        alive = self._alive[:n_rows]
+        kept = np.flatnonzero(alive)
+        renumber = np.cumsum(alive) - 1
+        for posting in self._postings.values():
+            posting.compact(alive, renumber)
+
+        capacity = max(len(kept) * 2, 16)
+        self._lengths = _grow(self._lengths[kept], capacity)
+        self._alive = _grow(np.ones(len(kept), dtype=bool), capacity)
+        self._chunk_ids = [self._chunk_ids[row] for row in kept.tolist()]
+        self._row_terms = {
+            int(renumber[row]): terms for row, terms in self._row_terms.items()
+        }
+        self._row_of = {
+            chunk_id: int(renumber[row]) for chunk_id, row in self._row_of.items()
+        }
+
+    def remove_document(self, document_id: UUID):
+        """ドキュメントに属する全チャンクを削除"""
+        with self._lock:
+            for chunk_id in list(self._document_chunks.get(document_id, ())):
+                self.remove_chunk(chunk_id)
+
+    def search(self, query: str, top_k: int = 3) -> List[Tuple[UUID, float]]:
+        """クエリタームのポスティングのみをBM25でスコアリングして上位を返す"""
+        query_terms = set(tokenize(query))
+
+        with self._lock:
+            n_chunks = len(self._row_of)
+            ranked: List[Tuple[UUID, float]] = []
+
+            postings = [self._postings[t] for t in query_terms if t in self._postings]
+            if postings:
+                n_rows = len(self._chunk_ids)
+                scores = np.zeros(n_rows, dtype=np.float32)
+                norm = self.k1 / max(self.average_length, 1e-6)
+                for posting in postings:
+                    df = posting.df
+                    idf = math.log(1.0 + (n_chunks - df + 0.5) / (df + 0.5))
+                    rows, freqs = posting.arrays()
+                    if posting.dead:
+                        keep = self._alive[rows]
+                        rows, freqs = rows[keep], freqs[keep]
+                    denom = (
+                        freqs
+                        + self.k1 * (1 - self.b)
+                        + norm * self.b * (self._lengths[rows])
+                    )
+                    scores[rows] += idf * freqs * (self.k1 + 1) / denom
+
+                candidates = np.flatnonzero(scores)
+                if len(candidates) > top_k:
+                    part = np.argpartition(-scores[candidates], top_k - 1)[:top_k]
+                    candidates = candidates[part]
+                order = candidates[np.argsort(-scores[candidates], kind="stable")]
+                ranked = [(self._chunk_ids[row], float(scores[row])) for row in order]
+
+        return ranked
+
+
+def token_rows(queryset):
+    """(チャンクID, ドキュメントID, 検索用トークン) を返すクエリ
+
+    トークン未生成の古いチャンクだけは本文も読み、ここで分割する。
+    """
+    from django.db.models import Case, F, When
+
+    rows = queryset.values_list(
+        "id",
+        "document_id",
+        "search_tokens",
+        # トークンがあるチャンクの本文は読まない（NULL になる）
+        Case(When(search_tokens__isnull=True, then=F("content"))),
+    )
+    for chunk_id, document_id, stored, content in rows.iterator():
+        yield chunk_id, document_id, split_tokens(stored, content or "")
+
+
+_index: Optional[InvertedIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_search_index(build: bool = True) -> Optional[InvertedIndex]:
+    """プロセス共有の転置インデックスを取得（初回のみDBから構築）"""
+    global _index
+    if _index is not None or not build:
+        return _index
+
+    with _index_lock:
+        if _index is None:
+            from .models import CorpusChange, DocumentChunk
+
+            index = InvertedIndex()
+            index.synced_version = CorpusChange.current_version()
+            for chunk_id, document_id, tokens in token_rows(
+                DocumentChunk.objects.searchable()
+            ):
+                index.add_chunk(chunk_id, document_id, tokens)
+            _index = index
+    return _index
+
+
+def reset_search_index():
+    """インデックスを破棄（次回アクセス時に再構築）"""
+    global _index
+    with _index_lock:
+        _index = None
@@ -7,10 +7,26 @@ from .models import (
     Question,
     Answer,
     UserFeedback,
+    IngestionJob,
 )
 
 
-class DocumentSerializer(serializers.ModelSerializer):
+class SparseFieldsetMixin:
+    """GET の ?fields=id,title のように、返す項目を指定したものだけに絞る"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get("request")
+        if request is None or request.method != "GET":
+            return
+        fields = request.query_params.get("fields")
+        if fields:
+            requested = {name.strip() for name in fields.split(",")}
+            for name in set(self.fields) - requested:
+                self.fields.pop(name)
+
+
+class DocumentSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     uploaded_by_name = serializers.CharField(
         source="uploaded_by.username", read_only=True
     )
@@ -40,10 +56,20 @@ class DocumentSerializer(serializers.ModelSerializer):
         ]
 
     def get_chunks_count(self, obj):
+        # 一覧ではビューで annotate した件数を使う（1件ごとの COUNT を避ける）
+        if hasattr(obj, "chunks_count"):
+            return obj.chunks_count
         return obj.chunks.count()
 
 
-class DocumentChunkSerializer(serializers.ModelSerializer):
+class DocumentListSerializer(DocumentSerializer):
+    """ドキュメント一覧用のシリアライザー（本文を含まない）"""
+
+    class Meta(DocumentSerializer.Meta):
+        fields = [name for name in DocumentSerializer.Meta.fields if name != "content"]
+
+
+class DocumentChunkSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     document_title = serializers.CharField(source="document.title", read_only=True)
 
     class Meta:
@@ -54,9 +80,10 @@ class DocumentChunkSerializer(serializers.ModelSerializer):
             "document_title",
             "content",
             "chunk_index",
+            "canonical",
             "created_at",
         ]
-        read_only_fields = ["id", "created_at"]
+        read_only_fields = ["id", "canonical", "created_at"]
 
 
 class ConversationSerializer(serializers.ModelSerializer):
@@ -77,6 +104,9 @@ class ConversationSerializer(serializers.ModelSerializer):
         read_only_fields = ["id", "user", "created_at", "updated_at"]
 
     def get_questions_count(self, obj):
+        # 一覧ではビューで annotate した件数を使う（1件ごとの COUNT を避ける）
+        if hasattr(obj, "questions_count"):
+            return obj.questions_count
         return obj.questions.count()
 
 
@@ -126,6 +156,7 @@ class QuestionCreateSerializer(serializers.Serializer):
 
     conversation_id = serializers.UUIDField(required=False, allow_null=True)
     text = serializers.CharField(max_length=2000)
+    stream = serializers.BooleanField(required=False, default=False)
 
     def validate_text(self, value):
         if len(value.strip()) < 3:
@@ -151,3 +182,26 @@ class ConversationDetailSerializer(serializers.ModelSerializer):
             "questions",
         ]
         read_only_fields = ["id", "user", "created_at", "updated_at"]
+
+
+class IngestionJobSerializer(serializers.ModelSerializer):
+    document_title = serializers.CharField(source="document.title", read_only=True)
+    progress = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = IngestionJob
+        fields = [
+            "id",
+            "document",
+            "document_title",
+            "status",
+            "progress",
+            "processed_chunks",
+            "total_chunks",
+            "error",
+            "attempts",
+            "created_at",
+            "started_at",
+            "finished_at",
+        ]
+        read_only_fields = fields
@@ -1,14 +1,60 @@
 # backend/rag_system/services.py
+import asyncio
+import logging
 import time
 import random
-from typing import List, Dict, Any
-from .models import DocumentChunk
+from typing import (
+    List,
+    Dict,
+    Any,
+    Callable,
+    Iterable,
+    Iterator,
+    Optional,
+    Sequence,
+    Tuple,
+)
+from uuid import UUID
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Min, Q, When
+from . import pg_search
+from .answer_cache import get_answer_cache
+from .chunk_table import get_chunk_records
+from .chunking import batched, chunk_hash, iter_text_chunks
+from .db_threads import db_sync_to_async
+from .dedup import (
+    DuplicateDetector,
+    get_duplicate_detector,
+    promote_duplicates,
+    save_buckets,
+)
+from .embedding_cache import get_embedding_cache
+from .embedding_store import get_embedding_store
+from .index_sync import sync_indexes
+from .models import CorpusChange, DocumentChunk
+from .retrieval_cache import (
+    INVALIDATE_BY_TERMS,
+    INVALIDATE_ON_CHANGE,
+    get_retrieval_cache,
+)
+from .retrievers import Retriever, get_retriever
+from .tokenizer import join_tokens, tokenize
+
+logger = logging.getLogger(__name__)
+
+STREAM_TOKEN_CHARS = 4  # ストリーミング時に1トークンとして送る文字数
+CACHED_MODEL_PREFIX = "cache:"  # キャッシュから返した回答の model_used に付ける
 
 
 class MockAIService:
     """OpenAI APIのモック実装"""
 
-    def __init__(self):
+    model_name = "mock-gpt-3.5-turbo"
+    embedding_model = "mock-embedding-128"
+
+    def __init__(self, retriever: Optional[Retriever] = None):
+        self.retriever = retriever
         self.mock_responses = [
             "申し訳ございませんが、その質問に関する具体的な情報を文書から見つけることができませんでした。",
             "提供された文書に基づくと、{}について以下の情報があります：\n\n{}",
@@ -22,58 +68,177 @@ class MockAIService:
         random.seed(hash(text) % 10000)  # テキストベースで一貫した値を生成
         return [random.uniform(-1, 1) for _ in range(128)]
 
+    async def agenerate_embedding(self, text: str) -> List[float]:
+        """generate_embedding の非同期版（実APIではHTTP呼び出しを await する）"""
+        return self.generate_embedding(text)
+
+    def embed_batch(
+        self, texts: List[str], batch_size: Optional[int] = None
+    ) -> List[List[float]]:
+        """複数テキストの埋め込みを生成（埋め込み済みの内容はキャッシュを使う）"""
+        cache = get_embedding_cache(self.embedding_model)
+        if cache is None:
+            return self._generate_embeddings(texts, batch_size)
+        return cache.embed(
+            texts, lambda missing: self._generate_embeddings(missing, batch_size)
+        )
+
+    def _generate_embeddings(
+        self, texts: List[str], batch_size: Optional[int] = None
+    ) -> List[List[float]]:
+        """複数テキストの埋め込みをバッチ単位でまとめて生成"""
+        batch_size = batch_size or settings.RAG_EMBEDDING_BATCH_SIZE
+        embeddings = []
+        for start in range(0, len(texts), batch_size):
+            # 実APIでは1バッチ＝1リクエストになる（モックは1件ずつ生成）
+            batch = texts[start : start + batch_size]
+            embeddings.extend(self.generate_embedding(text) for text in batch)
+        return embeddings
+
+    def embed_query(self, text: str) -> List[float]:
+        """検索クエリの埋め込みを取得（キャッシュ経由）"""
+        return self.embed_batch([text])[0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """embed_query の非同期版（生成は await、キャッシュの参照はスレッドで行う）"""
+        cache = get_embedding_cache(self.embedding_model)
+        if cache is None:
+            return await self.agenerate_embedding(text)
+        (embedding,) = await cache.aembed([text], self._agenerate_embeddings)
+        return embedding
+
+    async def _agenerate_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return list(
+            await asyncio.gather(*(self.agenerate_embedding(text) for text in texts))
+        )
+
     def search_similar_chunks(
-        self, query: str, chunks: List[DocumentChunk], top_k: int = 3
+        self,
+        query: str,
+        top_k: int = 3,
+        query_embedding: Optional[Sequence[float]] = None,
+    ) -> List[Dict]:
+        """類似チャンクの検索をモック実装
+
+        query_embedding を渡すと、クエリの埋め込みを生成せずにそれを使う。
+        """
+        # 他プロセス（取り込みワーカー等）での追加・削除をインデックスへ反映
+        # （検索結果キャッシュの無効化もここで行われる）
+        sync_indexes()
+
+        retriever = self.get_retriever(query_embedding)
+        scope = getattr(retriever, "cache_scope", INVALIDATE_ON_CHANGE)
+        terms = frozenset(tokenize(query))
+        # BM25 はクエリ語の集合だけで決まるので、語彙検索は語の集合をキーにする
+        key = (
+            retriever.name,
+            top_k,
+            terms if scope == INVALIDATE_BY_TERMS else query,
+        )
+        cache = get_retrieval_cache()
+        version = cache.synced_version if cache is not None else 0
+        ranked = cache.get(key) if cache is not None else None
+
+        if ranked is None:
+            ranked = retriever.search(query, top_k=top_k)
+            scored_chunks = self._hydrate_chunks(ranked)
+            if cache is not None:
+                cache.set(
+                    key,
+                    ranked,
+                    {chunk["chunk"].document_id for chunk in scored_chunks},
+                    version,
+                    terms=terms,
+                    scope=scope,
+                )
+        else:
+            scored_chunks = self._hydrate_chunks(ranked)
+        return scored_chunks
+
+    def get_retriever(
+        self, query_embedding: Optional[Sequence[float]] = None
+    ) -> Retriever:
+        """検索バックエンド（未指定なら RAG_RETRIEVAL_MODE のもの）
+
+        query_embedding を渡すと、クエリの埋め込みとしてそれを返すバックエンドを作る。
+        """
+        if self.retriever is not None:
+            return self.retriever
+        if query_embedding is None:
+            return get_retriever(settings.RAG_RETRIEVAL_MODE, self.embed_query)
+        return get_retriever(settings.RAG_RETRIEVAL_MODE, lambda text: query_embedding)
+
+    async def asearch_similar_chunks(
+        self,
+        query: str,
+        top_k: int = 3,
+        query_embedding: Optional[Sequence[float]] = None,
     ) -> List[Dict]:
-        """類似チャンクの検索をモック実装"""
-        # 実際は埋め込みベクトルの類似度計算を行うが、モックでは簡単な文字列マッチング
-        query_words = set(query.lower().split())
+        """search_similar_chunks の非同期版
+
+        クエリの埋め込みは await で取得し（実APIではHTTP呼び出し）、インデックスの
+        同期・検索とDBアクセスだけをスレッドプールで実行する（既定の
+        thread_sensitive=True では全リクエストの検索が1本のスレッドに直列化される）。
+        スレッドのDB接続は db_sync_to_async がリクエストと同じように閉じる。
+        """
+        if (
+            query_embedding is None
+            and self.retriever is None
+            and getattr(self.get_retriever(), "uses_embedding", True)
+        ):
+            query_embedding = await self.aembed_query(query)
+        return await db_sync_to_async(self.search_similar_chunks)(
+            query, top_k, query_embedding
+        )
+
+    def _hydrate_chunks(self, ranked: List[Tuple[UUID, float]]) -> List[Dict]:
+        """検索結果のチャンクIDに参照元の情報と抜粋を付けて整形
+
+        本文・埋め込みを含むチャンクの行全体は読み込まず、常駐のチャンク表の
+        軽量な情報（ドキュメントID・タイトル・抜粋）を使う。
+        """
+        records = get_chunk_records([chunk_id for chunk_id, _ in ranked])
 
         scored_chunks = []
-        for chunk in chunks:
-            content_words = set(chunk.content.lower().split())
-            # 単純な重複単語数でスコア計算
-            score = len(query_words.intersection(content_words))
-
-            # キーワードマッチングも追加（より緩い検索）
-            content_lower = chunk.content.lower()
-            query_lower = query.lower()
-
-            # 部分文字列マッチング
-            if any(word in content_lower for word in query_words if len(word) > 2):
-                score += 1
-
-            # 特定のキーワードに対する特別なスコアリング
-            if any(
-                keyword in query_lower
-                for keyword in ["rag", "システム", "ai", "機械学習", "テスト"]
-            ):
-                if any(
-                    keyword in content_lower
-                    for keyword in ["rag", "システム", "ai", "機械学習", "テスト"]
-                ):
-                    score += 2
-
-            # スコアが0でも、文書があれば少しは関連があるとする
-            if score == 0 and len(chunks) > 0:
-                score = 0.1  # 最小スコア
-
-            if score > 0:  # 少しでもマッチした場合
-                scored_chunks.append(
-                    {
-                        "chunk": chunk,
-                        "score": score,
-                        "content": (
-                            chunk.content[:200] + "..."
-                            if len(chunk.content) > 200
-                            else chunk.content
-                        ),
-                    }
-                )
+        for chunk_id, score in ranked:
+            record = records.get(chunk_id)
+            if record is None:  # インデックス更新前に削除されたチャンク
+                continue
+            scored_chunks.append(
+                {"chunk": record, "score": score, "content": record.snippet}
+            )
+        return scored_chunks
+
+    def build_sources(self, context_chunks: List[Dict]) -> List[Dict]:
+        """回答の参照元リストを作成"""
+        return [
+            {
+                "document_title": chunk["chunk"].document_title,
+                "chunk_id": str(chunk["chunk"].id),
+                "relevance_score": chunk["score"],
+            }
+            for chunk in context_chunks
+        ]
+
+    def _compose_answer(self, question: str, context_chunks: List[Dict]) -> str:
+        """コンテキストに基づいた回答文を組み立てる（モック）"""
+        if not context_chunks:
+            return "申し訳ございませんが、アップロードされた文書からは関連する情報を見つけることができませんでした。より具体的な質問をしていただくか、関連する文書をアップロードしてください。"
+
+        # より自然な回答パターンを選択
+        if "とは" in question or "について" in question:
+            answer = f"{question.replace('とは', '').replace('について', '')}について、アップロードされた文書から以下の情報が見つかりました：\n\n"
+        elif "?" in question or "？" in question:
+            answer = f"ご質問の件について、文書を参照した結果：\n\n"
+        else:
+            answer = f"「{question}」に関して、以下の情報があります：\n\n"
+
+        # コンテキストの要約を追加
+        for i, chunk in enumerate(context_chunks[:2], 1):
+            answer += f"{i}. {chunk['content'][:150]}...\n\n"
 
-        # スコア順でソートして上位を返す
-        scored_chunks.sort(key=lambda x: x["score"], reverse=True)
-        return scored_chunks[:top_k]
+        answer += "上記の情報がお役に立てば幸いです。さらに詳しい情報が必要でしたら、より具体的な質問をお聞かせください。"
+        return answer
 
     def generate_answer(
         self, question: str, context_chunks: List[Dict]
@@ -81,119 +246,292 @@ class MockAIService:
         """質問に対する回答を生成（モック）"""
         time.sleep(1)  # API呼び出しの遅延をシミュレート
 
-        if not context_chunks:
-            answer = "申し訳ございませんが、アップロードされた文書からは関連する情報を見つけることができませんでした。より具体的な質問をしていただくか、関連する文書をアップロードしてください。"
-            sources = []
-        else:
-            # コンテキストに基づいたモック回答生成
-            context_text = "\n".join([chunk["content"] for chunk in context_chunks])
-
-            # より自然な回答パターンを選択
-            if "とは" in question or "について" in question:
-                answer = f"{question.replace('とは', '').replace('について', '')}について、アップロードされた文書から以下の情報が見つかりました：\n\n"
-            elif "?" in question or "？" in question:
-                answer = f"ご質問の件について、文書を参照した結果：\n\n"
-            else:
-                answer = f"「{question}」に関して、以下の情報があります：\n\n"
-
-            # コンテキストの要約を追加
-            for i, chunk in enumerate(context_chunks[:2], 1):
-                answer += f"{i}. {chunk['content'][:150]}...\n\n"
-
-            answer += "上記の情報がお役に立てば幸いです。さらに詳しい情報が必要でしたら、より具体的な質問をお聞かせください。"
-
-            sources = [
-                {
-                    "document_title": chunk["chunk"].document.title,
-                    "chunk_id": str(chunk["chunk"].id),
-                    "relevance_score": chunk["score"],
-                }
-                for chunk in context_chunks
-            ]
+        return {
+            "answer": self._compose_answer(question, context_chunks),
+            "sources": self.build_sources(context_chunks),
+            "model_used": self.model_name,
+            "processing_time": random.uniform(0.8, 2.5),
+        }
+
+    async def agenerate_answer(
+        self, question: str, context_chunks: List[Dict]
+    ) -> Dict[str, Any]:
+        """generate_answer の非同期版（待ち時間中はイベントループを塞がない）"""
+        await asyncio.sleep(1)  # API呼び出しの遅延をシミュレート
 
         return {
-            "answer": answer,
-            "sources": sources,
-            "model_used": "mock-gpt-3.5-turbo",
+            "answer": self._compose_answer(question, context_chunks),
+            "sources": self.build_sources(context_chunks),
+            "model_used": self.model_name,
             "processing_time": random.uniform(0.8, 2.5),
         }
 
+    def stream_answer(self, question: str, context_chunks: List[Dict]) -> Iterator[str]:
+        """回答をトークン単位で逐次生成（モック）"""
+        time.sleep(0.2)  # 最初のトークンまでの遅延をシミュレート
 
-class RAGService:
-    """RAG（Retrieval-Augmented Generation）のメインサービス"""
+        answer = self._compose_answer(question, context_chunks)
+        for start in range(0, len(answer), STREAM_TOKEN_CHARS):
+            time.sleep(0.01)  # トークン生成の間隔をシミュレート
+            yield answer[start : start + STREAM_TOKEN_CHARS]
 
-    def __init__(self):
-        self.ai_service = MockAIService()
 
-    def process_document(self, document):
-        """ドキュメントを処理してチャンクに分割"""
-        # テキストをチャンクに分割（簡単な実装）
-        chunks = self._split_text(document.content)
+class RAGService:
+    """RAG（Retrieval-Augmented Generation）のメインサービス"""
 
-        created_chunks = []
-        for i, chunk_text in enumerate(chunks):
-            # ベクトル埋め込みを生成
-            embedding = self.ai_service.generate_embedding(chunk_text)
+    def __init__(self, retriever: Optional[Retriever] = None):
+        self.ai_service = MockAIService(retriever)
+
+    def process_document(
+        self,
+        document,
+        progress: Optional[Callable[[int], None]] = None,
+        text_blocks: Optional[Iterable[str]] = None,
+    ) -> int:
+        """ドキュメントを処理してチャンクに分割し、作成したチャンク数を返す
+
+        text_blocks（テキスト片のイテラブル）を渡すとそこから逐次読み込み、
+        省略時は document.content を使う。チャンク化・埋め込み生成・INSERT を
+        埋め込みバッチ単位で流すため、メモリ使用量はファイルサイズに依存しない。
+        progress を渡すとバッチごとに処理済みチャンク数で呼ばれる。
+
+        処理済みのドキュメントを再処理する場合は、既存チャンクと本文のハッシュで
+        突き合わせ、変わっていないチャンクは埋め込みごとそのまま使う。
+        埋め込み生成・INSERT は新しい本文のチャンクだけ、DELETE は無くなった
+        チャンクだけで、検索インデックスにも差分だけが反映される。
+        途中で失敗した場合も、再実行すれば保存済みのチャンクを使って続きから
+        処理し直せる（検索インデックスへの公開は全チャンクが揃った最後だけ）。
+        """
+        if text_blocks is None:
+            text_blocks = [document.content]
+
+        # 既存チャンクを本文のハッシュで引けるようにし、番号は負の仮番号へ退避する
+        # （再実行・更新のどちらでも同じチャンクを二重登録しない）
+        reusable = self._existing_chunks_by_hash(document)
+        if reusable:
+            # 途中で失敗した前回の処理の仮番号が残っていても衝突しないよう、
+            # 0以上の番号のチャンクだけを今ある最小の番号より下へ退避する
+            lowest = document.chunks.aggregate(lowest=Min("chunk_index"))["lowest"]
+            document.chunks.filter(chunk_index__gte=0).update(
+                chunk_index=min(lowest, 0) - 1 - F("chunk_index")
+            )
 
-            # DocumentChunkを作成
-            chunk = DocumentChunk.objects.create(
+        # 近似重複は既存の代表チャンクの埋め込みを共有する（消える旧チャンクは除く）
+        detector = get_duplicate_detector(Q(document=document, chunk_index__lt=0))
+        store = get_embedding_store()
+        created = 0
+        for batch in batched(
+            iter_text_chunks(text_blocks), settings.RAG_EMBEDDING_BATCH_SIZE
+        ):
+            kept, new_chunks = [], []
+            for i, chunk_text in enumerate(batch):
+                content_hash = chunk_hash(chunk_text)
+                candidates = reusable.get(content_hash)
+                if candidates:
+                    kept.append(
+                        DocumentChunk(
+                            id=candidates.pop(),
+                            chunk_index=created + i,
+                            content_hash=content_hash,
+                        )
+                    )
+                else:
+                    new_chunks.append((created + i, chunk_text, content_hash))
+            if kept:
+                DocumentChunk.objects.bulk_update(kept, ["chunk_index", "content_hash"])
+            if new_chunks:
+                self._insert_chunks(document, new_chunks, store, detector)
+            created += len(batch)
+            if progress:
+                progress(created)
+
+        # 全チャンクが揃ってから処理済みにし、変更ログで検索インデックスへ公開する
+        # （重複チャンクの付け替えと古いチャンクの削除も同じトランザクションで行い、
+        # 新しい代表の追加と古い代表の削除が別々に反映される間をつくらない）
+        with transaction.atomic():
+            # 新しい本文に無くなったチャンク（仮番号のまま残ったもの）を削除
+            stale = [chunk_id for ids in reusable.values() for chunk_id in ids]
+            if stale:
+                # 消えるチャンクを代表にしている重複チャンクは、新しい代表に付け替える
+                promote_duplicates(
+                    DocumentChunk.objects.filter(
+                        canonical__document=document, canonical__chunk_index__lt=0
+                    ).exclude(document=document, chunk_index__lt=0)
+                )
+            for start in range(0, len(stale), 500):
+                DocumentChunk.objects.filter(id__in=stale[start : start + 500]).delete()
+
+            action = "update" if document.is_processed else "add"
+            document.is_processed = True
+            document.save()
+            CorpusChange.record(document.id, action)
+
+        return created
+
+    def _existing_chunks_by_hash(self, document) -> Dict[str, List[UUID]]:
+        """既存チャンクのIDを本文のハッシュごとにまとめる（同じ本文は複数ありうる）"""
+        by_hash: Dict[str, List[UUID]] = {}
+        rows = document.chunks.order_by("-chunk_index").values_list(
+            "id",
+            "content_hash",
+            # ハッシュ未計算の古いチャンクだけ本文を読む
+            Case(When(content_hash="", then=F("content"))),
+        )
+        for chunk_id, content_hash, content in rows.iterator():
+            by_hash.setdefault(content_hash or chunk_hash(content), []).append(chunk_id)
+        return by_hash
+
+    def _insert_chunks(
+        self,
+        document,
+        new_chunks: List[Tuple[int, str, str]],
+        store,
+        detector: Optional[DuplicateDetector] = None,
+    ) -> None:
+        """(番号, 本文, ハッシュ) のチャンクの埋め込みを生成して保存
+
+        detector を渡すと近似重複のチャンクは代表を参照させ、埋め込みを
+        生成しない（代表の埋め込みストアの行を共有する）。
+        """
+        chunks = [
+            DocumentChunk(
                 document=document,
                 content=chunk_text,
-                chunk_index=i,
-                embedding=embedding,
+                chunk_index=chunk_index,
+                # 検索用トークンは取り込み時に一度だけ分割して保存する
+                search_tokens=join_tokens(tokenize(chunk_text)),
+                content_hash=content_hash,
             )
-            created_chunks.append(chunk)
-
-        # ドキュメントを処理済みにマーク
-        document.is_processed = True
-        document.save()
+            for chunk_index, chunk_text, content_hash in new_chunks
+        ]
+        originals = detector.assign(chunks) if detector else chunks
 
-        return created_chunks
+        embeddings = []
+        if originals:
+            # ベクトル埋め込みをバッチで生成して埋め込みストアへ追記
+            embeddings = self.ai_service.embed_batch(
+                [chunk.content for chunk in originals]
+            )
+            for chunk, row in zip(originals, store.append(embeddings)):
+                chunk.embedding_row = row
+        for chunk in chunks:
+            if chunk.canonical is not None:
+                chunk.embedding_row = chunk.canonical.embedding_row
+        DocumentChunk.objects.bulk_create(chunks)
+        if detector:
+            save_buckets(originals)
+        # PostgreSQL では埋め込み列にも書き込み、DB側で検索できるようにする
+        pg_search.store_vectors(
+            (chunk.id, embedding) for chunk, embedding in zip(originals, embeddings)
+        )
 
     def _split_text(
         self, text: str, chunk_size: int = 500, overlap: int = 50
     ) -> List[str]:
         """テキストをチャンクに分割"""
-        if len(text) <= chunk_size:
-            return [text]
-
-        chunks = []
-        start = 0
-
-        while start < len(text):
-            end = start + chunk_size
+        return list(iter_text_chunks([text], chunk_size=chunk_size, overlap=overlap))
 
-            # 単語の境界で分割
-            if end < len(text):
-                # 最後の完全な文または単語で終わるように調整
-                last_period = text.rfind("。", start, end)
-                last_newline = text.rfind("\n", start, end)
-                last_space = text.rfind(" ", start, end)
+    def _lookup_answer_cache(
+        self, question_text: str, embedding: Optional[Sequence[float]] = None
+    ) -> Tuple[Optional[Dict[str, Any]], Callable[[Dict[str, Any]], None]]:
+        """回答キャッシュを引き、(ヒットした回答, 生成した回答の登録関数) を返す
 
-                cut_point = max(last_period, last_newline, last_space)
-                if cut_point > start:
-                    end = cut_point + 1
+        類似質問を探す設定で embedding を省略すると、質問の埋め込みをここで求める。
+        """
+        cache = get_answer_cache()
+        if cache is None:
+            return None, lambda result: None
 
-            chunk = text[start:end].strip()
-            if chunk:
-                chunks.append(chunk)
+        # 生成前のバージョンで登録するので、生成中に文書が変わっても古い回答は使われない
+        version = CorpusChange.current_version()
+        if cache.uses_embeddings and embedding is None:
+            embedding = self.ai_service.embed_query(question_text)
+        cached = cache.get(question_text, version, embedding)
+        if cached is not None:
+            cached["model_used"] = (CACHED_MODEL_PREFIX + cached["model_used"])[:100]
+            cached["cached"] = True
 
-            start = end - overlap
+        def store(result: Dict[str, Any]):
+            cache.set(question_text, version, result, embedding)
 
-        return chunks
+        return cached, store
 
     def answer_question(self, question_text: str, user) -> Dict[str, Any]:
         """質問に対する回答を生成"""
-        # 全てのチャンクから関連するものを検索
-        all_chunks = DocumentChunk.objects.all()
-        print(f"総チャンク数: {all_chunks.count()}")  # デバッグ用
+        start_time = time.time()
+        cached, store = self._lookup_answer_cache(question_text)
+        if cached is not None:
+            # キャッシュヒット時は検索も回答生成も行わない
+            cached["processing_time"] = time.time() - start_time
+            return cached
 
-        similar_chunks = self.ai_service.search_similar_chunks(
-            question_text, all_chunks, top_k=3
-        )
-        print(f"見つかったチャンク数: {len(similar_chunks)}")  # デバッグ用
+        # インデックスから関連するチャンクを検索
+        similar_chunks = self.ai_service.search_similar_chunks(question_text, top_k=3)
+        logger.debug("見つかったチャンク数: %d", len(similar_chunks))
 
         # AI回答を生成
         result = self.ai_service.generate_answer(question_text, similar_chunks)
+        store(result)
 
         return result
+
+    async def aanswer_question(self, question_text: str, user) -> Dict[str, Any]:
+        """answer_question の非同期版
+
+        埋め込み・回答の生成は await し、DBアクセスはスレッドプールで実行する。
+        """
+        start_time = time.time()
+        cache = get_answer_cache()
+        embedding = None
+        if cache is not None and cache.uses_embeddings:
+            # 類似質問の検索とチャンク検索で同じ埋め込みを使う
+            embedding = await self.ai_service.aembed_query(question_text)
+        cached, store = await db_sync_to_async(self._lookup_answer_cache)(
+            question_text, embedding
+        )
+        if cached is not None:
+            cached["processing_time"] = time.time() - start_time
+            return cached
+
+        similar_chunks = await self.ai_service.asearch_similar_chunks(
+            question_text, top_k=3, query_embedding=embedding
+        )
+        result = await self.ai_service.agenerate_answer(question_text, similar_chunks)
+        await db_sync_to_async(store)(result)
+        return result
+
+    def stream_answer(
+        self, question_text: str, user
+    ) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """質問に対する回答を (イベント名, データ) の列として逐次返す
+
+        検索が終わった時点で参照元を "sources" として返し、続いて回答の
+        トークンを "token" として返す。最後の "done" に回答全体が入る。
+        """
+        start_time = time.time()
+        cached, store = self._lookup_answer_cache(question_text)
+        if cached is not None:
+            # キャッシュヒット時は回答全体を1トークンとして返す
+            cached["processing_time"] = time.time() - start_time
+            yield "sources", {"sources": cached["sources"]}
+            yield "token", {"text": cached["answer"]}
+            yield "done", cached
+            return
+
+        similar_chunks = self.ai_service.search_similar_chunks(question_text, top_k=3)
+        sources = self.ai_service.build_sources(similar_chunks)
+        yield "sources", {"sources": sources}
+
+        tokens = []
+        for token in self.ai_service.stream_answer(question_text, similar_chunks):
+            tokens.append(token)
+            yield "token", {"text": token}
+
+        result = {
+            "answer": "".join(tokens),
+            "sources": sources,
+            "model_used": self.ai_service.model_name,
+            "processing_time": time.time() - start_time,
+        }
+        store(result)
+        yield "done", result
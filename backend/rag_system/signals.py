@@ -0,0 +1,41 @@
+# backend/rag_system/signals.py
+from django.db import connections
+from django.db.models.signals import post_delete, post_migrate, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .dedup import promote_duplicates
+from .fts_search import ensure_fts_index
+from .models import CorpusChange, Document, DocumentChunk
+
+
+@receiver(pre_delete, sender=Document)
+def promote_duplicates_of_document(sender, instance, **kwargs):
+    """削除するチャンクを代表にしている他のドキュメントの重複チャンクを付け替える"""
+    promote_duplicates(
+        DocumentChunk.objects.filter(canonical__document=instance).exclude(
+            document=instance
+        )
+    )
+
+
+@receiver(post_delete, sender=Document)
+def record_document_removal(sender, instance, **kwargs):
+    """ドキュメント削除を変更ログに記録（各プロセスの検索インデックスへ伝搬）"""
+    CorpusChange.record(instance.id, "remove")
+
+
+@receiver(pre_save, sender=Document)
+def record_document_title_change(sender, instance, **kwargs):
+    """タイトルの変更を変更ログに記録（検索結果の参照元に反映）"""
+    if instance._state.adding:
+        return
+    previous = sender.objects.filter(pk=instance.pk).values_list("title", flat=True)
+    if previous and previous[0] != instance.title:
+        CorpusChange.record(instance.id, "update")
+
+
+@receiver(post_migrate)
+def create_fts_index(sender, using, **kwargs):
+    """SQLite ではチャンク本文の FTS5 索引とトリガーを用意する"""
+    if sender.name == "rag_system":
+        ensure_fts_index(connections[using])
@@ -1,3 +1,1864 @@
-from django.test import TestCase
+import json
+import tempfile
+from datetime import timedelta
+from io import StringIO
+import threading
+import uuid
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from . import pg_search
+from .ann_index import MIN_TRAINING_SIZE as ANN_MIN_TRAINING_SIZE
+from .ann_index import IVFIndex, reset_ann_index, spherical_kmeans
+from .answer_cache import AnswerCache, normalize_question, reset_answer_cache
+from .bulk_ingestion import ingest, iter_source_items
+from .chunk_table import reset_chunk_table
+from .chunking import iter_file_text, iter_text_chunks
+from .dedup import minhash, similarity
+from .embedding_cache import EmbeddingCache, content_hash, reset_embedding_cache
+from .embedding_store import EmbeddingStore, get_embedding_store
+from .hybrid_search import hybrid_search, reciprocal_rank_fusion
+from .fts_search import CHUNK_TABLE, fts_search, rebuild_fts_index
+from .index_sync import _reconcile_documents
+from .ingestion import (
+    claim_next_job,
+    enqueue_document,
+    requeue_stale_jobs,
+    run_job,
+    worker_loop,
+)
+from .models import (
+    Answer,
+    Conversation,
+    Document,
+    DocumentChunk,
+    EmbeddingCacheEntry,
+    IngestionJob,
+    MinHashBucket,
+    Question,
+    UserFeedback,
+)
+from .quantization import (
+    MIN_TRAINING_SIZE,
+    ProductQuantizer,
+    QuantizedVectorIndex,
+    ScalarQuantizer,
+    new_vector_index,
+)
+from .retrievers import (
+    DenseRetriever,
+    IndexedChunk,
+    LexicalRetriever,
+    get_retriever,
+)
+from .retrieval_cache import get_retrieval_cache, reset_retrieval_cache
+from .search_index import (
+    MIN_COMPACT_ROWS,
+    InvertedIndex,
+    get_search_index,
+    reset_search_index,
+    token_rows,
+)
+from .services import CACHED_MODEL_PREFIX, MockAIService, RAGService
+from .tokenizer import NgramTokenizer, tokenize
+from .vector_index import DenseVectorIndex, get_vector_index, reset_vector_index
+
+
+def reset_process_state():
+    """プロセス共有のインデックス・キャッシュを破棄（テスト間で持ち越さない）"""
+    for reset in (
+        reset_search_index,
+        reset_vector_index,
+        reset_ann_index,
+        reset_chunk_table,
+        reset_retrieval_cache,
+        reset_answer_cache,
+        reset_embedding_cache,
+    ):
+        reset()
+
+
+class QueryCountTests(TestCase):
+    """一覧・詳細APIのクエリ数が件数に比例しないことを確認する
+
+    データを2倍に増やしてもクエリ数が変わらないこと、および想定の
+    クエリ数であることを検証する。N+1 クエリの再発を検知するためのもの。
+    """
+
+    def setUp(self):
+        self.document = None
+        self.conversation = None
+        self.rows = 0
+
+    def _add_chunks(self, document, n):
+        start = document.chunks.count()
+        DocumentChunk.objects.bulk_create(
+            DocumentChunk(document=document, content="chunk", chunk_index=start + i)
+            for i in range(n)
+        )
+        IngestionJob.objects.create(document=document)
+
+    def _add_questions(self, conversation, n):
+        for _ in range(n):
+            question = Question.objects.create(
+                conversation=conversation, text="question", user=conversation.user
+            )
+            answer = Answer.objects.create(question=question, text="answer")
+            UserFeedback.objects.create(answer=answer, user=conversation.user, rating=3)
+
+    def _create_rows(self, n):
+        """各モデルのデータを n 件ずつ追加（最初の文書・会話の子も増やす）"""
+        for _ in range(n):
+            self.rows += 1
+            user = User.objects.create(username=f"user{self.rows}")
+            document = Document.objects.create(
+                title=f"doc {self.rows}", content="text", uploaded_by=user
+            )
+            self._add_chunks(document, 3)
+            conversation = Conversation.objects.create(
+                user=user, title=f"conv {self.rows}"
+            )
+            self._add_questions(conversation, 2)
+
+            if self.document is None:
+                self.document, self.conversation = document, conversation
+            else:
+                self._add_chunks(self.document, 2)
+                self._add_questions(self.conversation, 2)
+
+    def assertConstantQueries(self, url, expected):
+        """データ量を変えても url の GET が expected 回のクエリで済むこと"""
+        for _ in range(2):
+            self._create_rows(3)
+            with self.assertNumQueries(expected):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+
+    def test_document_list(self):
+        # キーセットページネーションのため件数の COUNT は発行しない
+        self.assertConstantQueries("/api/documents/", 1)
+
+    def test_document_detail(self):
+        self._create_rows(1)
+        self.assertConstantQueries(f"/api/documents/{self.document.id}/", 1)
+
+    def test_document_chunks(self):
+        self._create_rows(1)
+        self.assertConstantQueries(f"/api/documents/{self.document.id}/chunks/", 2)
+
+    def test_document_jobs(self):
+        self._create_rows(1)
+        self.assertConstantQueries(f"/api/documents/{self.document.id}/jobs/", 2)
+
+    def test_conversation_list(self):
+        self.assertConstantQueries("/api/conversations/", 2)
+
+    def test_conversation_detail(self):
+        # 会話 + 質問（回答・質問者を含む）
+        self._create_rows(1)
+        self.assertConstantQueries(f"/api/conversations/{self.conversation.id}/", 2)
+
+    def test_question_list(self):
+        self.assertConstantQueries("/api/questions/", 2)
+
+    def test_feedback_list(self):
+        self.assertConstantQueries("/api/feedback/", 2)
+
+    def test_ingestion_job_list(self):
+        self.assertConstantQueries("/api/ingestion-jobs/", 2)
+
+
+class DocumentListTests(TestCase):
+    """ドキュメント・チャンク一覧のページネーションと返す項目"""
+
+    def setUp(self):
+        user = User.objects.create(username="testuser")
+        self.documents = [
+            Document.objects.create(title=f"doc {i}", content="text", uploaded_by=user)
+            for i in range(5)
+        ]
+        DocumentChunk.objects.bulk_create(
+            DocumentChunk(document=self.documents[0], content="chunk", chunk_index=i)
+            for i in range(5)
+        )
+
+    def _collect(self, url):
+        """next を辿って全ページの結果を集める"""
+        results = []
+        while url:
+            data = self.client.get(url).json()
+            self.assertNotIn("count", data)
+            results += data["results"]
+            url = data["next"]
+        return results
+
+    def test_document_list_pages_without_content(self):
+        results = self._collect("/api/documents/?page_size=2")
+        self.assertEqual(
+            [result["id"] for result in results],
+            [str(document.id) for document in reversed(self.documents)],
+        )
+        self.assertNotIn("content", results[0])
+        self.assertEqual(results[-1]["chunks_count"], 5)
+
+    def test_sparse_fields(self):
+        data = self.client.get("/api/documents/?fields=id,title").json()
+        self.assertEqual(set(data["results"][0]), {"id", "title"})
+        data = self.client.get(
+            f"/api/documents/{self.documents[0].id}/?fields=content"
+        ).json()
+        self.assertEqual(data, {"content": "text"})
+
+    def test_chunk_list_pages_in_order(self):
+        url = f"/api/documents/{self.documents[0].id}/chunks/?page_size=2"
+        results = self._collect(url)
+        self.assertEqual([result["chunk_index"] for result in results], list(range(5)))
+
+
+class ConversationListTests(TestCase):
+    """会話一覧が更新日時の新しい順に並び、質問数を返すこと"""
+
+    def test_list_is_ordered_by_updated_at(self):
+        user = User.objects.create(username="testuser")
+        conversations = [
+            Conversation.objects.create(user=user, title=f"conv {i}") for i in range(3)
+        ]
+        Question.objects.create(conversation=conversations[1], text="q", user=user)
+        Question.objects.create(conversation=conversations[1], text="q", user=user)
+        # 最初の会話を更新して先頭に来させる
+        conversations[0].title = "renamed"
+        conversations[0].save()
+
+        data = self.client.get("/api/conversations/").json()
+        self.assertEqual(
+            [result["id"] for result in data["results"]],
+            [str(c.id) for c in (conversations[0], conversations[2], conversations[1])],
+        )
+        self.assertEqual(
+            [result["questions_count"] for result in data["results"]], [0, 0, 2]
+        )
+
+
+@skipUnless(connection.vendor == "postgresql", "PostgreSQL でのみ実行")
+class PostgresSearchTests(TestCase):
+    """PostgreSQL の全文検索インデックス・埋め込み列での検索
+
+    POSTGRES_DB を設定してテストを実行したときだけ動く（既定の SQLite では省略）。
+    """
+
+    def setUp(self):
+        user = User.objects.create(username="testuser")
+        document = Document.objects.create(
+            title="doc", content="text", uploaded_by=user
+        )
+        self.chunks = DocumentChunk.objects.bulk_create(
+            DocumentChunk(document=document, content=content, chunk_index=i)
+            for i, content in enumerate(
+                ["python django orm", "ruby rails", "python numpy"]
+            )
+        )
+
+    def test_lexical_search(self):
+        ranked = pg_search.lexical_search("django python", top_k=3)
+        self.assertEqual(ranked[0][0], self.chunks[0].id)
+        self.assertEqual(
+            {chunk_id for chunk_id, _ in ranked},
+            {self.chunks[0].id, self.chunks[2].id},
+        )
+
+    def test_vector_search(self):
+        if not pg_search.supports_vector_search():
+            self.skipTest("pgvector がインストールされていない")
+        vectors = [[0.0] * 128 for _ in self.chunks]
+        for i, vector in enumerate(vectors):
+            vector[i] = 1.0
+        pg_search.store_vectors(
+            (chunk.id, vector) for chunk, vector in zip(self.chunks, vectors)
+        )
+        ranked = pg_search.vector_search(vectors[1], top_k=1)
+        self.assertEqual(ranked[0][0], self.chunks[1].id)
+
+
+@skipUnless(connection.vendor == "sqlite", "SQLite でのみ実行")
+class FtsSearchTests(TestCase):
+    """SQLite の FTS5 索引がトリガーでチャンクに追従し、bm25() で順位付けすること"""
+
+    def setUp(self):
+        user = User.objects.create(username="testuser")
+        self.document = Document.objects.create(
+            title="doc", content="text", uploaded_by=user
+        )
+        self.chunks = DocumentChunk.objects.bulk_create(
+            DocumentChunk(document=self.document, content=content, chunk_index=i)
+            for i, content in enumerate(
+                ["python django orm", "ruby rails", "python numpy", "機械学習の入門"]
+            )
+        )
+
+    def test_ranks_by_bm25(self):
+        ranked = fts_search("django python", top_k=3)
+        self.assertEqual(ranked[0][0], self.chunks[0].id)
+        self.assertEqual(
+            {chunk_id for chunk_id, _ in ranked},
+            {self.chunks[0].id, self.chunks[2].id},
+        )
+        self.assertEqual(fts_search("機械学習", top_k=3)[0][0], self.chunks[3].id)
+
+    def test_follows_insert_update_and_delete(self):
+        chunk = DocumentChunk.objects.create(
+            document=self.document, content="golang gin", chunk_index=9
+        )
+        self.assertEqual([c for c, _ in fts_search("golang")], [chunk.id])
+        chunk.content = "rust axum"
+        chunk.save()
+        self.assertEqual(fts_search("golang"), [])
+        self.assertEqual([c for c, _ in fts_search("axum")], [chunk.id])
+        self.document.delete()
+        self.assertEqual(fts_search("axum python"), [])
+
+    def test_rebuild_follows_renumbered_rowids(self):
+        # VACUUM で rowid が振り直された状態を再現する（トリガーは反応しない）
+        with connection.cursor() as cursor:
+            cursor.execute(f"UPDATE {CHUNK_TABLE} SET rowid = rowid + 1000")
+        self.assertEqual(fts_search("numpy"), [])
+
+        self.assertTrue(rebuild_fts_index())
+        self.assertEqual([c for c, _ in fts_search("numpy")], [self.chunks[2].id])
+
+
+class KeywordRetriever:
+    """テスト用の検索バックエンド（ドットパス指定の確認用）"""
+
+    name = "keyword"
+    cache_scope = "change"
+
+    def __init__(self, embed=None, store=None):
+        self.chunks = {}
+
+    def index(self, chunks):
+        self.chunks = {}
+        self.add(chunks)
+
+    def add(self, chunks):
+        self.chunks.update((chunk.id, chunk.content) for chunk in chunks)
+
+    def remove(self, chunk_ids):
+        for chunk_id in chunk_ids:
+            self.chunks.pop(chunk_id, None)
+
+    def search(self, query, top_k=3):
+        return [(i, 1.0) for i, text in self.chunks.items() if query in text][:top_k]
+
+
+class RetrieverTests(TestCase):
+    """検索バックエンドの切り替えと index/add/remove/search"""
+
+    def setUp(self):
+        user = User.objects.create(username="testuser")
+        document = Document.objects.create(
+            title="doc", content="text", uploaded_by=user
+        )
+        self.chunks = [
+            IndexedChunk(chunk.id, document.id, chunk.content)
+            for chunk in DocumentChunk.objects.bulk_create(
+                DocumentChunk(document=document, content=content, chunk_index=i)
+                for i, content in enumerate(["python django", "ruby rails"])
+            )
+        ]
+
+    def test_selects_backend_by_name(self):
+        self.assertIsInstance(get_retriever("lexical"), LexicalRetriever)
+        self.assertIsInstance(get_retriever("dense", embed=len), DenseRetriever)
+        retriever = get_retriever("rag_system.tests.KeywordRetriever")
+        self.assertIsInstance(retriever, KeywordRetriever)
+
+    def test_unknown_backend_is_a_configuration_error(self):
+        for name in ("lexcial", "rag_system.tests.MissingRetriever"):
+            with self.assertRaises(ImproperlyConfigured):
+                get_retriever(name)
+        with override_settings(RAG_HYBRID_VECTOR_INDEX="ivf"):
+            with self.assertRaises(ImproperlyConfigured):
+                get_retriever("hybrid", embed=len)
+
+    def test_lexical_lifecycle(self):
+        retriever = LexicalRetriever()
+        retriever.index(self.chunks[:1])
+        retriever.add(self.chunks[1:])
+        self.assertEqual(retriever.search("rails")[0][0], self.chunks[1].id)
+        retriever.remove([self.chunks[1].id])
+        self.assertEqual(retriever.search("rails"), [])
+
+    def test_dense_lifecycle(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = EmbeddingStore(directory, dimension=2)
+            rows = store.append([[1.0, 0.0], [0.0, 1.0]])
+            chunks = [
+                chunk._replace(embedding_row=row)
+                for chunk, row in zip(self.chunks, rows)
+            ]
+            vectors = {"first": [1.0, 0.1], "second": [0.1, 1.0]}
+            retriever = DenseRetriever(vectors.__getitem__, store)
+            retriever.index(chunks)
+            self.assertEqual(retriever.search("second", top_k=1)[0][0], chunks[1].id)
+            retriever.remove([chunks[1].id])
+            self.assertEqual(retriever.search("second", top_k=1)[0][0], chunks[0].id)
+
+    @override_settings(RAG_RETRIEVAL_MODE="rag_system.tests.KeywordRetriever")
+    def test_service_uses_configured_backend(self):
+        retriever = KeywordRetriever()
+        retriever.index(self.chunks)
+        results = MockAIService(retriever).search_similar_chunks("ruby", top_k=3)
+        self.assertEqual([r["chunk"].id for r in results], [self.chunks[1].id])
+        # 未指定なら設定のバックエンドを使う
+        self.assertIsInstance(MockAIService().get_retriever(), KeywordRetriever)
+
+
+class TokenizerTests(TestCase):
+    """日本語の n-gram 分割と、取り込み時に保存したトークンでの検索"""
+
+    def test_ngram_tokenizer(self):
+        tokens = NgramTokenizer(2).tokenize("機械学習はＰｙｔｈｏｎで、ｶﾅ")
+        self.assertEqual(
+            tokens, ["機械", "械学", "学習", "習は", "python", "で", "カナ"]
+        )
+
+    def test_unknown_tokenizer_is_a_configuration_error(self):
+        for name in ("bigrams", "rag_system.tests.MissingTokenizer"):
+            with override_settings(RAG_TOKENIZER=name):
+                with self.assertRaises(ImproperlyConfigured):
+                    tokenize("機械学習")
+
+    def test_search_with_stored_tokens(self):
+        user = User.objects.create(username="testuser")
+        document = Document.objects.create(
+            title="doc",
+            content="機械学習はデータから規則を学ぶ。Django は Python 製のフレームワーク。",
+            uploaded_by=user,
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(RAG_VECTOR_STORE_DIR=directory):
+                RAGService().process_document(document)
+        self.assertFalse(document.chunks.filter(search_tokens__isnull=True).exists())
+
+        # 索引は保存済みのトークンだけで作る（本文は渡さない）
+        retriever = LexicalRetriever()
+        retriever.index(
+            IndexedChunk(chunk_id, document_id, "", tokens=tokens)
+            for chunk_id, document_id, tokens in token_rows(DocumentChunk.objects.all())
+        )
+        chunk_id = document.chunks.get().id
+        self.assertEqual(retriever.search("機械学習とは？")[0][0], chunk_id)
+        self.assertEqual(retriever.search("ＰＹＴＨＯＮ")[0][0], chunk_id)
+        self.assertEqual(retriever.search("深層生成"), [])
+
+
+class BulkIngestionTests(TestCase):
+    """manage.py ingest の一括取り込みと、再実行時の取り込み済みの飛ばし"""
+
+    def setUp(self):
+        self.user = User.objects.create(username="testuser")
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        root = Path(self.directory.name)
+        (root / "corpus").mkdir()
+        (root / "corpus" / "a.txt").write_text(
+            "機械学習の入門。" * 100, encoding="utf-8"
+        )
+        (root / "corpus" / "b.md").write_text("# Django\n", encoding="utf-8")
+        (root / "corpus" / "skip.bin").write_bytes(b"\0")
+        with open(root / "corpus.jsonl", "w", encoding="utf-8") as f:
+            for i in range(3):
+                f.write(
+                    json.dumps({"id": i, "title": f"t{i}", "content": "本文"}) + "\n"
+                )
+        self.root = root
+        override = override_settings(RAG_VECTOR_STORE_DIR=str(root / "vectors"))
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_ingest_directory_and_resume(self):
+        documents, chunks = ingest(
+            iter_source_items(self.root / "corpus"), self.user, workers=0
+        )
+        self.assertEqual(documents, 2)
+        self.assertEqual(chunks, DocumentChunk.objects.count())
+        document = Document.objects.get(title="a.txt")
+        self.assertTrue(document.is_processed)
+        self.assertGreater(document.chunks.count(), 1)
+        self.assertFalse(
+            DocumentChunk.objects.filter(search_tokens__isnull=True).exists()
+        )
+        self.assertFalse(
+            DocumentChunk.objects.filter(embedding_row__isnull=True).exists()
+        )
+        # 再実行では取り込み済みを飛ばす
+        self.assertEqual(
+            ingest(iter_source_items(self.root / "corpus"), self.user, workers=0),
+            (0, 0),
+        )
+
+    def test_ingest_jsonl_in_batches(self):
+        writes = []
+        ingest(
+            iter_source_items(self.root / "corpus.jsonl"),
+            self.user,
+            workers=0,
+            batch_chunks=1,
+            on_write=lambda documents, chunks: writes.append(documents),
+        )
+        self.assertEqual(writes, [1, 2, 3])
+        self.assertEqual(
+            sorted(Document.objects.values_list("title", flat=True)), ["t0", "t1", "t2"]
+        )
+
+    def test_writer_deduplicates_and_fills_embedding_cache(self):
+        reset_embedding_cache()
+        self.addCleanup(reset_embedding_cache)
+        ingest(iter_source_items(self.root / "corpus.jsonl"), self.user, workers=0)
+
+        # 同じ本文の3件は、最初のチャンクを代表にして埋め込みの行を共有する
+        chunks = list(DocumentChunk.objects.order_by("document__title"))
+        self.assertIsNone(chunks[0].canonical_id)
+        self.assertEqual([c.canonical_id for c in chunks[1:]], [chunks[0].id] * 2)
+        self.assertEqual({c.embedding_row for c in chunks}, {chunks[0].embedding_row})
+
+        # ワーカーで生成した埋め込みはキャッシュに登録され、再生成しない
+        self.assertTrue(
+            EmbeddingCacheEntry.objects.filter(
+                pk=content_hash("本文", MockAIService.embedding_model)
+            ).exists()
+        )
+        reset_embedding_cache()
+        with mock.patch.object(MockAIService, "_generate_embeddings") as generate:
+            MockAIService().embed_batch(["本文"])
+        generate.assert_not_called()
+
+
+class IncrementalReingestTests(TestCase):
+    """本文の更新時に、変わったチャンクだけ埋め込みを作り直す"""
+
+    def setUp(self):
+        user = User.objects.create(username="testuser")
+        self.paragraphs = [f"第{i}節の本文です。" * 40 + "\n" for i in range(6)]
+        self.document = Document.objects.create(
+            title="doc", content="".join(self.paragraphs), uploaded_by=user
+        )
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = override_settings(
+            RAG_VECTOR_STORE_DIR=directory.name, RAG_INGESTION_MODE="sync"
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        RAGService().process_document(self.document)
+
+    def test_update_embeds_only_changed_chunks(self):
+        before = dict(self.document.chunks.values_list("content", "id"))
+        self.paragraphs[3] = "書き換えた節です。" * 40 + "\n"
+        content = "".join(self.paragraphs)
+
+        with mock.patch.object(
+            MockAIService,
+            "embed_batch",
+            autospec=True,
+            side_effect=MockAIService.embed_batch,
+        ) as embed_batch:
+            response = self.client.patch(
+                f"/api/documents/{self.document.id}/",
+                {"content": content},
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["job_status"], IngestionJob.STATUS_COMPLETED)
+
+        chunks = list(self.document.chunks.order_by("chunk_index"))
+        expected = RAGService()._split_text(content)
+        self.assertEqual([chunk.content for chunk in chunks], expected)
+        self.assertEqual(
+            [chunk.chunk_index for chunk in chunks], list(range(len(expected)))
+        )
+        embedded = [text for call in embed_batch.call_args_list for text in call[0][1]]
+        self.assertEqual(embedded, [text for text in expected if text not in before])
+        self.assertLess(len(embedded), len(expected))
+        # 変わっていないチャンクは同じ行のまま残す
+        for chunk in chunks:
+            if chunk.content in before:
+                self.assertEqual(chunk.id, before[chunk.content])
+
+    def test_retry_after_failure_midway(self):
+        content = "".join(f"改訂した第{i}節です。" * 40 + "\n" for i in range(6))
+        self.document.content = content
+        expected = RAGService()._split_text(content)
+        calls = []
+
+        def fail_on_second_batch(service, texts, batch_size=None):
+            calls.append(list(texts))
+            if len(calls) == 2:
+                raise RuntimeError("embedding API error")
+            return MockAIService._generate_embeddings(service, texts, batch_size)
+
+        with override_settings(RAG_EMBEDDING_BATCH_SIZE=2):
+            with mock.patch.object(
+                MockAIService,
+                "embed_batch",
+                autospec=True,
+                side_effect=fail_on_second_batch,
+            ):
+                with self.assertRaises(RuntimeError):
+                    RAGService().process_document(self.document)
+                # 途中まで保存された状態（正負の番号が混在）から2回処理し直す
+                self.assertTrue(self.document.chunks.filter(chunk_index__lt=0).exists())
+                for _ in range(2):
+                    RAGService().process_document(self.document)
+
+        chunks = list(self.document.chunks.order_by("chunk_index"))
+        self.assertEqual([chunk.content for chunk in chunks], expected)
+        self.assertEqual(
+            [chunk.chunk_index for chunk in chunks], list(range(len(expected)))
+        )
+        # 失敗前に保存できたチャンクは再実行で埋め込み直さない
+        embedded = [text for texts in calls for text in texts]
+        self.assertEqual(sorted(embedded), sorted(expected + calls[1]))
+
+    def test_title_only_update_does_not_reingest(self):
+        response = self.client.patch(
+            f"/api/documents/{self.document.id}/",
+            {"title": "renamed"},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("job_id", response.json())
+        self.assertFalse(self.document.ingestion_jobs.exists())
+
+
+class NearDuplicateTests(TestCase):
+    """取り込み時の近似重複チャンクの検出と、代表チャンクへの集約"""
+
+    DISCLAIMER = (
+        "本資料の内容は作成時点の情報に基づいており、将来予告なく変更される"
+        "ことがあります。本資料の無断転載・複製を禁じます。お問い合わせは"
+        "サポート窓口までご連絡ください。"
+    ) * 3
+
+    def setUp(self):
+        self.user = User.objects.create(username="testuser")
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = override_settings(
+            RAG_VECTOR_STORE_DIR=directory.name, RAG_DEDUP_THRESHOLD=0.8
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def _process(self, title, content):
+        document = Document.objects.create(
+            title=title, content=content, uploaded_by=self.user
+        )
+        RAGService().process_document(document)
+        return document.chunks.get()
+
+    def test_minhash_similarity(self):
+        edited = self.DISCLAIMER.replace("作成時点", "発行時点", 1)
+        self.assertGreater(similarity(minhash(self.DISCLAIMER), minhash(edited)), 0.8)
+        self.assertLess(
+            similarity(minhash(self.DISCLAIMER), minhash("機械学習の入門")), 0.2
+        )
+
+    def test_duplicate_shares_canonical_and_is_promoted(self):
+        first = self._process("first", self.DISCLAIMER)
+        with mock.patch.object(
+            MockAIService,
+            "embed_batch",
+            autospec=True,
+            side_effect=MockAIService.embed_batch,
+        ) as embed_batch:
+            second = self._process(
+                "second", self.DISCLAIMER.replace("作成時点", "発行時点", 1)
+            )
+        embed_batch.assert_not_called()
+        self.assertEqual(second.canonical_id, first.id)
+        self.assertEqual(second.embedding_row, first.embedding_row)
+
+        # 検索インデックスには代表だけを載せる
+        index = InvertedIndex()
+        _reconcile_documents(index, {first.document_id, second.document_id})
+        self.assertEqual(
+            [chunk_id for chunk_id, _ in index.search("無断転載", top_k=5)],
+            [first.id],
+        )
+
+        # 代表のドキュメントを消すと、重複チャンクが新しい代表になる
+        first.document.delete()
+        second.refresh_from_db()
+        self.assertIsNone(second.canonical_id)
+        self.assertTrue(MinHashBucket.objects.filter(chunk=second).exists())
+        _reconcile_documents(index, {first.document_id, second.document_id})
+        self.assertEqual(
+            [chunk_id for chunk_id, _ in index.search("無断転載", top_k=5)],
+            [second.id],
+        )
+
+    def test_promoted_duplicate_keeps_shared_vector_row(self):
+        first = self._process("first", self.DISCLAIMER)
+        second = self._process(
+            "second", self.DISCLAIMER.replace("作成時点", "発行時点", 1)
+        )
+        index = DenseVectorIndex(get_embedding_store())
+        _reconcile_documents(index, {first.document_id, second.document_id})
+        query = get_embedding_store().get(first.embedding_row)
+
+        # 代表のドキュメントの本文を変えると、重複チャンクが新しい代表になる
+        # （付け替えと古い代表の削除は同じコミットで記録される）
+        first.document.content = "差し替えた本文です。"
+        with self.captureOnCommitCallbacks() as callbacks:
+            RAGService().process_document(first.document)
+        self.assertEqual(len(callbacks), 2)
+        second.refresh_from_db()
+        self.assertIsNone(second.canonical_id)
+
+        # 新しい代表の追加が古い代表の削除より先に反映されても、共有する行は残る
+        _reconcile_documents(index, {second.document_id})
+        self.assertEqual([c for c, _ in index.search(query, top_k=5)][:1], [first.id])
+        _reconcile_documents(index, {first.document_id})
+        self.assertEqual([c for c, _ in index.search(query, top_k=5)][:1], [second.id])
+
+        second.document.delete()
+        _reconcile_documents(index, {second.document_id})
+        self.assertNotIn(second.id, [c for c, _ in index.search(query, top_k=5)])
+
+
+class InvertedIndexTests(TestCase):
+    """転置インデックスの BM25 の順位と、削除後の行の詰め直し"""
+
+    @override_settings(RAG_RETRIEVAL_MODE="lexical", RAG_RETRIEVAL_CACHE_SIZE=0)
+    def test_service_index_follows_corpus_changes(self):
+        user = User.objects.create(username="testuser")
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = override_settings(RAG_VECTOR_STORE_DIR=directory.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        reset_process_state()
+        self.addCleanup(reset_process_state)
+
+        def add_document(content):
+            document = Document.objects.create(
+                title="doc", content=content, uploaded_by=user
+            )
+            with self.captureOnCommitCallbacks(execute=True):
+                RAGService().process_document(document)
+            return document
+
+        def search(query):
+            results = MockAIService().search_similar_chunks(query, top_k=3)
+            return [result["chunk"].document_id for result in results]
+
+        django = add_document("Django はウェブフレームワークです。")
+        for i in range(20):
+            add_document(f"無関係な文書 {i} です。")
+        self.assertEqual(search("Django"), [django.id])
+        index = get_search_index()
+
+        # 追加・削除は同じインデックスに差分で反映される
+        other = add_document("Django の管理画面の使い方。")
+        with self.captureOnCommitCallbacks(execute=True):
+            django.delete()
+        self.assertEqual(search("Django"), [other.id])
+        self.assertIs(get_search_index(), index)
+        # 変更がなければ検索はチャンクのテーブルを読まない（変更ログの確認だけ）
+        with self.assertNumQueries(1):
+            self.assertEqual(search("Django"), [other.id])
+
+    def test_bm25_ordering_and_removal(self):
+        document_id = uuid.uuid4()
+        corpus = {
+            "short": ["django", "orm"],
+            "long": ["django", "orm", "view", "form", "admin", "test"],
+            "twice": ["django", "django", "view", "form", "admin", "test"],
+            "rare": ["numpy", "array"],
+        }
+        ids = {name: uuid.uuid4() for name in corpus}
+        index = InvertedIndex()
+        for name, tokens in corpus.items():
+            index.add_chunk(ids[name], document_id, tokens)
+
+        def bm25(name, terms, live):
+            lengths = [len(corpus[other]) for other in live]
+            average = sum(lengths) / len(lengths)
+            score = 0.0
+            for term in terms:
+                df = sum(term in corpus[other] for other in live)
+                freq = corpus[name].count(term)
+                if not freq:
+                    continue
+                idf = np.log(1 + (len(live) - df + 0.5) / (df + 0.5))
+                norm = 1 - index.b + index.b * len(corpus[name]) / average
+                score += idf * freq * (index.k1 + 1) / (freq + index.k1 * norm)
+            return score
+
+        def assert_matches(query, live):
+            ranked = index.search(query, top_k=len(live))
+            expected = sorted(
+                (name for name in live if bm25(name, query.split(), live)),
+                key=lambda name: -bm25(name, query.split(), live),
+            )
+            self.assertEqual([c for c, _ in ranked], [ids[name] for name in expected])
+            for (_, score), name in zip(ranked, expected):
+                self.assertAlmostEqual(score, bm25(name, query.split(), live), 5)
+
+        # 同じ長さなら出現回数が多いほど、同じ回数なら短いほど上位（ここでは
+        # 短さが効いて short が twice より上）。クエリ語を含まないものは返さない
+        assert_matches("django", list(corpus))
+        self.assertEqual(
+            [c for c, _ in index.search("django", top_k=3)],
+            [ids["short"], ids["twice"], ids["long"]],
+        )
+        assert_matches("django numpy", list(corpus))
+
+        # 削除後は DF・平均長も削除後のコーパスで計算し直される
+        index.remove_chunk(ids["twice"])
+        assert_matches("django view", ["short", "long", "rare"])
+        index.remove_document(document_id)
+        self.assertEqual(index.search("django"), [])
+        self.assertEqual(len(index), 0)
+
+    def test_compacts_rows_after_many_removals(self):
+        document_id = uuid.uuid4()
+        words = ["python", "django", "numpy", "sqlite", "rust"]
+        chunks = [
+            (uuid.uuid4(), [words[i % 5], words[i % 3], f"id{i}"])
+            for i in range(MIN_COMPACT_ROWS * 3)
+        ]
+        index = InvertedIndex()
+        for chunk_id, tokens in chunks:
+            index.add_chunk(chunk_id, document_id, tokens)
+        for chunk_id, _ in chunks[: MIN_COMPACT_ROWS * 2 + 10]:
+            index.remove_chunk(chunk_id)
+
+        # 削除済みの行は残らず、作り直したインデックスと同じ結果になる
+        survivors = chunks[MIN_COMPACT_ROWS * 2 + 10 :]
+        self.assertLess(len(index._chunk_ids), len(chunks) - MIN_COMPACT_ROWS)
+        rebuilt = InvertedIndex()
+        for chunk_id, tokens in survivors:
+            rebuilt.add_chunk(chunk_id, document_id, tokens)
+        for query in ("django numpy", "rust", f"id{len(chunks) - 1}"):
+            expected = rebuilt.search(query, top_k=5)
+            actual = index.search(query, top_k=5)
+            self.assertEqual([c for c, _ in actual], [c for c, _ in expected])
+            np.testing.assert_allclose(
+                [score for _, score in actual],
+                [score for _, score in expected],
+                rtol=1e-5,
+            )
+
+        # 詰め直した後も追加・削除できる
+        added = uuid.uuid4()
+        index.add_chunk(added, document_id, ["golang"])
+        self.assertEqual(index.search("golang")[0][0], added)
+        index.remove_chunk(survivors[-1][0])
+        self.assertEqual(index.search(f"id{len(chunks) - 1}"), [])
+
+
+class DenseVectorIndexTests(TestCase):
+    """埋め込み行列の総当たり検索がコサイン類似度の正確な順位を返すこと"""
+
+    def test_matches_exact_cosine_ranking(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        store = EmbeddingStore(directory.name, dimension=8)
+        rng = np.random.default_rng(0)
+        # 長さの違うベクトルも、向きだけで比べる（追記時に正規化される）
+        vectors = rng.normal(size=(200, 8)) * rng.uniform(0.1, 10, size=(200, 1))
+        rows = store.append(vectors)
+        ids = [uuid.uuid4() for _ in rows]
+        documents = [uuid.uuid4(), uuid.uuid4()]
+        index = DenseVectorIndex(store)
+        for i, (chunk_id, row) in enumerate(zip(ids, rows)):
+            index.add_chunk(chunk_id, documents[i % 2], row)
+
+        def exact(query, live, k):
+            unit = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+            scores = unit @ (query / np.linalg.norm(query))
+            order = [i for i in np.argsort(-scores) if i in live][:k]
+            return [ids[i] for i in order], scores[order]
+
+        query = rng.normal(size=8)
+        expected, scores = exact(query, set(range(200)), 10)
+        ranked = index.search(query * 3, top_k=10)
+        self.assertEqual([c for c, _ in ranked], expected)
+        np.testing.assert_allclose([s for _, s in ranked], scores, atol=1e-5)
+
+        # 削除したチャンク・ドキュメントは結果に出ない
+        index.remove_chunk(expected[0])
+        index.remove_document(documents[1])
+        live = {i for i in range(0, 200, 2)} - {ids.index(expected[0])}
+        self.assertEqual(
+            [c for c, _ in index.search(query, top_k=10)], exact(query, live, 10)[0]
+        )
+        self.assertEqual(len(index), len(live))
+
+
+class HybridSearchTests(TestCase):
+    """語彙検索とベクトル検索の順位を RRF で統合する"""
+
+    def test_rank_fusion(self):
+        both, lexical_top, dense_top, lexical_only = (uuid.uuid4() for _ in range(4))
+        lexical = [(lexical_top, 9.0), (both, 5.0), (lexical_only, 1.0)]
+        dense = [(dense_top, 0.9), (both, 0.8)]
+
+        fused = reciprocal_rank_fusion([lexical, dense], top_k=4, k=60)
+        # 両方で2位のチャンクが、片方だけで1位のチャンクより上に来る
+        self.assertEqual(fused[0], (both, 2 / 62))
+        self.assertEqual(
+            {chunk_id for chunk_id, _ in fused[1:3]}, {lexical_top, dense_top}
+        )
+        self.assertEqual(fused[3], (lexical_only, 1 / 63))
+        self.assertEqual(
+            reciprocal_rank_fusion([lexical, dense], top_k=4, weights=[1.0, 0.0])[0][0],
+            lexical_top,
+        )
+
+    def test_hybrid_search_merges_both_sides(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        store = EmbeddingStore(directory.name, dimension=2)
+        document_id = uuid.uuid4()
+        texts = {
+            "lexical": ("Django の設定", [0.0, 1.0]),
+            "both": ("Django のモデル", [1.0, 0.1]),
+            "dense": ("データベースの話", [1.0, 0.0]),
+            "other": ("関係のない文章", [0.9, 0.5]),
+        }
+        ids = {name: uuid.uuid4() for name in texts}
+        lexical_index = InvertedIndex()
+        vector_index = DenseVectorIndex(store)
+        for name, (text, vector) in texts.items():
+            lexical_index.add_chunk(ids[name], document_id, tokenize(text))
+            vector_index.add_chunk(ids[name], document_id, store.append([vector])[0])
+
+        results = hybrid_search(
+            "Django モデル",
+            embed=lambda query: [1.0, 0.0],
+            top_k=3,
+            candidates=3,
+            lexical_index=lexical_index,
+            vector_index=vector_index,
+        )
+        # 両方に現れたものが先頭、片方の上位にだけ現れたものも結果に残る
+        # （lexical はベクトル検索の上位3件に入らない）
+        self.assertEqual(
+            [chunk_id for chunk_id, _ in results],
+            [ids["both"], ids["dense"], ids["lexical"]],
+        )
+
+
+class QuantizationTests(TestCase):
+    """int8・直積量子化の近似スコアと、float32 での並べ直し"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = EmbeddingStore(directory.name, dimension=16)
+        rng = np.random.default_rng(0)
+        self.rows = self.store.append(rng.normal(size=(MIN_TRAINING_SIZE, 16)))
+        self.vectors = np.asarray(self.store.matrix)
+        self.query = self.vectors[0]
+
+    def test_unknown_quantization_is_a_configuration_error(self):
+        with override_settings(RAG_VECTOR_QUANTIZATION="int4"):
+            with self.assertRaises(ImproperlyConfigured):
+                new_vector_index(self.store)
+
+    def test_scores_match_decoded_vectors(self):
+        for quantizer in (ScalarQuantizer(16), ProductQuantizer(16, subspaces=4)):
+            quantizer.train(self.vectors)
+            codes = quantizer.encode(self.vectors)
+            self.assertEqual(codes.shape, (len(self.vectors), quantizer.code_size))
+            np.testing.assert_allclose(
+                quantizer.scores(codes, self.query),
+                quantizer.decode(codes) @ self.query,
+                atol=1e-4,
+            )
+        # int8 の復元誤差は1段階の幅の半分以内
+        scalar = ScalarQuantizer(16)
+        scalar.train(self.vectors)
+        error = np.abs(scalar.decode(scalar.encode(self.vectors)) - self.vectors)
+        self.assertTrue((error <= scalar.scale / 2 + 1e-6).all())
+
+    def test_index_reranks_with_exact_scores(self):
+        for quantizer in (ScalarQuantizer(16), ProductQuantizer(16, subspaces=4)):
+            index = QuantizedVectorIndex(self.store, quantizer, rerank=10)
+            ids = [uuid.uuid4() for _ in self.rows]
+            document_id = uuid.uuid4()
+            for chunk_id, row in zip(ids, self.rows):
+                index.add_chunk(chunk_id, document_id, row)
+            index.train_in_background().join()
+            self.assertTrue(index.is_trained)
+            self.assertEqual(index.code_bytes, len(self.rows) * quantizer.code_size)
+
+            (chunk_id, score), *_ = index.search(self.query, top_k=3)
+            self.assertEqual(chunk_id, ids[0])
+            self.assertAlmostEqual(score, 1.0, places=5)
+            index.remove_chunk(ids[0])
+            self.assertNotIn(ids[0], [c for c, _ in index.search(self.query, top_k=3)])
+
+            # 学習後に追加した行も符号化して検索できる
+            row = self.store.append([self.query])[0]
+            added = uuid.uuid4()
+            index.add_chunk(added, document_id, row)
+            self.assertEqual(index.search(self.query, top_k=1)[0][0], added)
+
+            # 近似重複のチャンクが共有する行は符号も結果も1つだけ
+            code_bytes = index.code_bytes
+            index.add_chunk(uuid.uuid4(), document_id, row)
+            self.assertEqual(index.code_bytes, code_bytes)
+            results = [c for c, _ in index.search(self.query, top_k=len(index))]
+            self.assertEqual(len(results), len(set(results)))
+            self.assertEqual(len(results), len(index) - 1)
+
+
+class AnnIndexTests(TestCase):
+    """IVFインデックスの再現率と、バックグラウンドでの学習"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = EmbeddingStore(directory.name, dimension=32)
+        rng = np.random.default_rng(0)
+        # 話題ごとにまとまった分布（クラスタの中心の周りに散らばる）
+        centers = rng.normal(size=(50, 32))
+        vectors = centers[rng.integers(0, 50, 5000)] + rng.normal(
+            scale=1.5, size=(5000, 32)
+        )
+        self.rows = self.store.append(vectors)
+        self.ids = [uuid.uuid4() for _ in self.rows]
+        self.document_id = uuid.uuid4()
+        self.queries = np.asarray(self.store.matrix[:100]) + rng.normal(
+            scale=0.05, size=(100, 32)
+        )
+
+    def _fill(self, index, count=None):
+        for chunk_id, row in list(zip(self.ids, self.rows))[:count]:
+            DenseVectorIndex.add_chunk(index, chunk_id, self.document_id, row)
+
+    def test_recall_against_exact_search(self):
+        exact = DenseVectorIndex(self.store)
+        ivf = IVFIndex(self.store)
+        self._fill(exact)
+        self._fill(ivf)
+        ivf.train()
+
+        recall = np.mean(
+            [
+                len(
+                    {c for c, _ in ivf.search(query, top_k=10)}
+                    & {c for c, _ in exact.search(query, top_k=10)}
+                )
+                / 10
+                for query in self.queries
+            ]
+        )
+        # 既定の nprobe（nlist に比例）なら上位10件の9割以上を取りこぼさない
+        # （このデータでは以前の既定値 nprobe 8 だと 0.7 程度）
+        self.assertGreaterEqual(recall, 0.9)
+
+    def test_save_and_load_round_trip(self):
+        path = Path(self.store.directory) / "ivf_index.npz"
+        ivf = IVFIndex(self.store, nprobe=4, path=path)
+        self._fill(ivf, 2000)
+        ivf.train()
+        self.assertTrue(path.exists())
+        # 学習後に削除したチャンクも、保存し直せば読み込み後に残らない
+        ivf.remove_chunk(self.ids[0])
+        ivf.save(path)
+
+        loaded = IVFIndex.load(path, self.store, nprobe=4)
+        self.assertTrue(loaded.is_trained)
+        self.assertEqual(len(loaded), len(ivf))
+        self.assertNotIn(self.ids[0], loaded._row_of)
+        np.testing.assert_array_equal(loaded.centroids, ivf.centroids)
+        for query in self.queries[:20]:
+            self.assertEqual(
+                loaded.search(query, top_k=10), ivf.search(query, top_k=10)
+            )
+
+        # 読み込んだインデックスへの追加も重心のリストに振り分けられる
+        loaded.add_chunk(self.ids[2000], self.document_id, self.rows[2000])
+        query = self.store.get(self.rows[2000])
+        self.assertEqual(loaded.search(query, top_k=1)[0][0], self.ids[2000])
+
+    def test_rows_shared_by_duplicates_are_searched_once(self):
+        ivf = IVFIndex(self.store, nprobe=4)
+        self._fill(ivf, 2000)
+        ivf.train()
+        original, duplicate = self.ids[5], uuid.uuid4()
+        query = self.store.get(self.rows[5])
+
+        def top_ids():
+            return [chunk_id for chunk_id, _ in ivf.search(query, top_k=10)]
+
+        # 近似重複のチャンクは代表と同じ行に載り、行は1回だけ返す
+        ivf.add_chunk(duplicate, self.document_id, self.rows[5])
+        self.assertEqual(top_ids()[0], original)
+        self.assertNotIn(duplicate, top_ids())
+        ivf.remove_chunk(original)
+        self.assertEqual(top_ids()[0], duplicate)
+        self.assertEqual(len(set(top_ids())), 10)
+
+        # 削除してから登録し直しても（インデックスの差分反映）同じ行を2回返さない
+        ivf.remove_chunk(duplicate)
+        self.assertNotIn(duplicate, top_ids())
+        ivf.add_chunk(duplicate, self.document_id, self.rows[5])
+        self.assertEqual(top_ids()[0], duplicate)
+        self.assertEqual(len(set(top_ids())), 10)
+
+        # 共有する行があるまま保存・読み込みしても同じ
+        ivf.add_chunk(original, self.document_id, self.rows[5])
+        path = Path(self.store.directory) / "ivf_index.npz"
+        ivf.save(path)
+        loaded = IVFIndex.load(path, self.store, nprobe=4)
+        self.assertEqual(len(loaded), len(ivf))
+        loaded.remove_chunk(duplicate)
+        results = [chunk_id for chunk_id, _ in loaded.search(query, top_k=10)]
+        self.assertEqual(results[0], original)
+        self.assertEqual(len(set(results)), 10)
+
+    def test_failed_save_keeps_previous_file(self):
+        path = Path(self.store.directory) / "ivf_index.npz"
+        ivf = IVFIndex(self.store, nprobe=4, path=path)
+        self._fill(ivf, 2000)
+        ivf.train()
+        saved = path.read_bytes()
+
+        def write_partially(f, **arrays):
+            f.write(b"PK\x03\x04")
+            raise OSError("No space left on device")
+
+        # 書き込みが途中で失敗しても、保存済みのファイルはそのまま読める
+        ivf.remove_chunk(self.ids[0])
+        with mock.patch("rag_system.ann_index.np.savez", write_partially):
+            with self.assertRaises(OSError):
+                ivf.save(path)
+        self.assertEqual(path.read_bytes(), saved)
+        self.assertIn(self.ids[0], IVFIndex.load(path, self.store)._row_of)
+        self.assertEqual(
+            [p.name for p in Path(self.store.directory).iterdir() if ".npz" in p.name],
+            ["ivf_index.npz"],
+        )
+
+    def test_searches_while_training_in_background(self):
+        ivf = IVFIndex(self.store)
+        self._fill(ivf, ANN_MIN_TRAINING_SIZE - 1)
+        started, release = threading.Event(), threading.Event()
+
+        def blocked_kmeans(*args, **kwargs):
+            started.set()
+            release.wait(10)
+            return spherical_kmeans(*args, **kwargs)
+
+        with mock.patch("rag_system.ann_index.spherical_kmeans", blocked_kmeans):
+            # 学習に必要な件数に達しても、追加は学習を待たずに戻る
+            last = ANN_MIN_TRAINING_SIZE - 1
+            ivf.add_chunk(self.ids[last], self.document_id, self.rows[last])
+            self.assertTrue(started.wait(10))
+            self.assertFalse(ivf.is_trained)
+
+            # 学習中も総当たりで検索でき、追加した行も見つかる
+            query = self.store.get(self.rows[last])
+            self.assertEqual(ivf.search(query, top_k=1)[0][0], self.ids[last])
+            added = ANN_MIN_TRAINING_SIZE
+            ivf.add_chunk(self.ids[added], self.document_id, self.rows[added])
+
+            release.set()
+            ivf.train_in_background().join()
+
+        # 学習中に追加した行も新しい重心のリストに振り分けられる
+        self.assertTrue(ivf.is_trained)
+        query = self.store.get(self.rows[added])
+        self.assertEqual(ivf.search(query, top_k=1)[0][0], self.ids[added])
+
+
+class EmbeddingStoreTests(TestCase):
+    """埋め込みストアの追記・読み出しと、削除後の詰め直し"""
+
+    def setUp(self):
+        self.user = User.objects.create(username="testuser")
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = override_settings(
+            RAG_VECTOR_STORE_DIR=directory.name, RAG_RETRIEVAL_MODE="dense"
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        reset_process_state()
+        self.addCleanup(reset_process_state)
+
+    def _add_document(self, content):
+        document = Document.objects.create(
+            title="doc", content=content, uploaded_by=self.user
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            RAGService().process_document(document)
+        return document
+
+    def test_append_and_read_across_instances(self):
+        store = get_embedding_store()
+        vectors = np.arange(1, 2 * store.dimension + 1, dtype=np.float32).reshape(2, -1)
+        self.assertEqual(store.append(vectors), [0, 1])
+        self.assertEqual(store.append(vectors[:1] * 5), [2])
+        self.assertEqual(store.append([]), [])
+        self.assertEqual(len(store), 3)
+        for row, vector in enumerate([vectors[0], vectors[1], vectors[0]]):
+            np.testing.assert_allclose(
+                store.get(row), vector / np.linalg.norm(vector), rtol=1e-6
+            )
+
+        # 同じディレクトリを開いた別プロセス相当のストアからも読める
+        other = EmbeddingStore(store.directory, dimension=store.dimension)
+        np.testing.assert_array_equal(other.matrix, store.matrix)
+        self.assertEqual(other.append(vectors[1:]), [3])
+        self.assertEqual(store.matrix.shape, (4, store.dimension))
+        np.testing.assert_array_equal(store.get(3), store.get(1))
+
+        with self.assertRaises(ValueError):
+            store.append(np.ones((1, store.dimension + 1)))
+        self.assertEqual(len(store), 4)
+
+    def test_reprocessing_unchanged_content_reuses_rows(self):
+        document = self._add_document("Django の解説です。" * 60)
+        store = get_embedding_store()
+        rows = dict(document.chunks.values_list("id", "embedding_row"))
+        before = len(store)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            RAGService().process_document(document)
+
+        self.assertEqual(dict(document.chunks.values_list("id", "embedding_row")), rows)
+        self.assertEqual(len(store), before)
+
+    def test_compact_remaps_rows(self):
+        documents = [
+            self._add_document(f"{topic} の解説です。" * 60)
+            for topic in ("Django", "NumPy", "SQLite")
+        ]
+        store = get_embedding_store()
+        vectors = {
+            chunk_id: store.get(row)
+            for chunk_id, row in DocumentChunk.objects.values_list(
+                "id", "embedding_row"
+            )
+        }
+        index = get_vector_index()
+        with self.captureOnCommitCallbacks(execute=True):
+            documents[0].delete()
+
+        call_command("compact_embeddings", min_dead_ratio=0, stdout=StringIO())
+
+        rows = list(DocumentChunk.objects.values_list("embedding_row", flat=True))
+        self.assertEqual(len(store), len(set(rows)))
+        self.assertEqual(sorted(set(rows)), list(range(len(store))))
+        for chunk_id, row in DocumentChunk.objects.values_list("id", "embedding_row"):
+            np.testing.assert_array_equal(store.get(row), vectors[chunk_id])
+        # 行番号が変わったので、構築済みのインデックスは作り直される
+        self.assertTrue(index.is_stale)
+        self.assertIsNot(get_vector_index(), index)
+        chunk = documents[2].chunks.first()
+        self.assertEqual(
+            MockAIService()
+            .search_similar_chunks(chunk.content, top_k=1)[0]["chunk"]
+            .id,
+            chunk.id,
+        )
+
+    def test_compact_skips_below_threshold(self):
+        self._add_document("Django の解説です。" * 60)
+        store = get_embedding_store()
+        before = len(store)
+        call_command("compact_embeddings", stdout=StringIO())
+        self.assertEqual(len(store), before)
+        self.assertEqual(store.generation, 0)
+
+
+class ChunkingTests(TestCase):
+    """テキスト片のストリームからの分割が、全体を一度に分割した結果と一致する"""
+
+    def test_stream_matches_whole_text(self):
+        texts = [
+            "".join(f"第{i}節の本文です。" * 30 + "\n" for i in range(8)),
+            " ".join(f"word{i}" for i in range(600)),
+            "区切りのない長い本文" * 200,
+            "短い本文",
+        ]
+        for text in texts:
+            expected = list(iter_text_chunks([text], chunk_size=120, overlap=20))
+            for size in (1, 7, 119, 121, 1000):
+                blocks = [text[i : i + size] for i in range(0, len(text), size)]
+                with self.subTest(text=text[:10], size=size):
+                    self.assertEqual(
+                        list(iter_text_chunks(blocks, chunk_size=120, overlap=20)),
+                        expected,
+                    )
+
+    def test_file_blocks_split_multibyte_characters(self):
+        text = "".join(f"第{i}節の本文です。" * 30 + "\n" for i in range(8))
+        # 7バイトずつ読むと UTF-8 の多バイト文字が読み込みの境界をまたぐ
+        with mock.patch("rag_system.chunking.READ_BLOCK_SIZE", 7):
+            blocks = list(iter_file_text(ContentFile(text.encode("utf-8"))))
+        self.assertGreater(len(blocks), 1)
+        self.assertEqual("".join(blocks), text)
+        self.assertEqual(list(iter_text_chunks(blocks)), RAGService()._split_text(text))
+
+
+class IngestionJobTests(TestCase):
+    """取り込みジョブの実行と進捗"""
+
+    def setUp(self):
+        self.user = User.objects.create(username="testuser")
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = override_settings(
+            RAG_VECTOR_STORE_DIR=directory.name, RAG_EMBEDDING_BATCH_SIZE=2
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        reset_process_state()
+        self.addCleanup(reset_process_state)
+
+    def test_progress_is_estimated_while_running(self):
+        document = Document.objects.create(
+            title="doc",
+            content="".join(f"第{i}節の本文です。" * 40 + "\n" for i in range(6)),
+            uploaded_by=self.user,
+        )
+        job = IngestionJob.objects.create(document=document)
+        observed = []
+        process_document = RAGService.process_document
+
+        def record_progress(service, document, progress=None, **kwargs):
+            def report(processed):
+                progress(processed)
+                observed.append(IngestionJob.objects.get(id=job.id).progress)
+
+            return process_document(service, document, progress=report, **kwargs)
+
+        with mock.patch.object(
+            RAGService, "process_document", autospec=True, side_effect=record_progress
+        ):
+            run_job(job)
+
+        # 途中のバッチでも 0 と 1 の間で増えていき、完了時に確定する
+        self.assertGreater(len(observed), 1)
+        self.assertTrue(all(0 < value < 1 for value in observed[:-1]))
+        self.assertEqual(observed, sorted(observed))
+        job.refresh_from_db()
+        self.assertEqual(job.total_chunks, document.chunks.count())
+        self.assertEqual(job.progress, 1.0)
+
+    def test_job_is_claimed_by_only_one_worker(self):
+        document = Document.objects.create(
+            title="doc", content="本文です。", uploaded_by=self.user
+        )
+        job = IngestionJob.objects.create(document=document)
+        now = timezone.now
+        rival = []
+
+        def claim_in_between():
+            # 1つ目のワーカーが候補を読んでから UPDATE するまでの間に、
+            # 2つ目のワーカーが同じジョブを確保する
+            if not rival:
+                rival.append(None)  # 入れ子の呼び出しでは割り込まない
+                rival[0] = claim_next_job()
+            return now()
+
+        with mock.patch("rag_system.ingestion.timezone.now", claim_in_between):
+            claimed = claim_next_job()
+
+        self.assertIsNone(claimed)
+        self.assertEqual(rival[0].id, job.id)
+        job.refresh_from_db()
+        self.assertEqual(job.status, IngestionJob.STATUS_RUNNING)
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNone(claim_next_job())
+
+    def test_worker_logs_failure_and_continues(self):
+        jobs = [
+            IngestionJob.objects.create(
+                document=Document.objects.create(
+                    title=title, content="本文です。", uploaded_by=self.user
+                )
+            )
+            for title in ("broken", "ok")
+        ]
+        process_document = RAGService.process_document
+
+        def fail_first(service, document, **kwargs):
+            if document.title == "broken":
+                raise RuntimeError("embedding API error")
+            return process_document(service, document, **kwargs)
+
+        with mock.patch.object(
+            RAGService, "process_document", autospec=True, side_effect=fail_first
+        ), self.assertLogs("rag_system.ingestion", "ERROR") as logs:
+            worker_loop(once=True)
+
+        self.assertIn(str(jobs[0].id), logs.output[0])
+        statuses = [IngestionJob.objects.get(id=job.id).status for job in jobs]
+        self.assertEqual(
+            statuses, [IngestionJob.STATUS_FAILED, IngestionJob.STATUS_COMPLETED]
+        )
+
+    @override_settings(RAG_INGESTION_MODE="sync")
+    def test_sync_upload_records_unreadable_file(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        # UTF-8 として読めない（Shift_JIS の）ファイル
+        upload = SimpleUploadedFile(
+            "sjis.txt", "日本語の本文です。".encode("shift_jis")
+        )
+        with override_settings(MEDIA_ROOT=media.name), self.assertLogs(
+            "rag_system.views", "ERROR"
+        ):
+            response = self.client.post(
+                "/api/documents/", {"title": "sjis", "content": "-", "file": upload}
+            )
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual(data["job_status"], IngestionJob.STATUS_FAILED)
+        self.assertTrue(data["content"].startswith("ファイル読み取りエラー: "))
+        job = IngestionJob.objects.get(id=data["job_id"])
+        self.assertIn("UnicodeDecodeError", job.error)
+
+    def test_one_job_per_document_at_a_time(self):
+        document = Document.objects.create(
+            title="doc", content="本文です。", uploaded_by=self.user
+        )
+        # 待機中のジョブがあれば、更新のたびに増やさず同じジョブを使う
+        first = enqueue_document(document)
+        self.assertEqual(enqueue_document(document), first)
+        self.assertEqual(claim_next_job(), first)
+
+        # 処理中に更新されたら新しいジョブを待たせ、処理中の間は確保しない
+        second = enqueue_document(document)
+        self.assertNotEqual(second, first)
+        self.assertIsNone(claim_next_job())
+
+        run_job(first)
+        self.assertEqual(claim_next_job(), second)
+
+    def test_requeue_stale_jobs(self):
+        documents = [
+            Document.objects.create(title=title, content="本文", uploaded_by=self.user)
+            for title in ("merged", "requeued", "alive")
+        ]
+        old = timezone.now() - timedelta(seconds=3600)
+        jobs = [
+            IngestionJob.objects.create(
+                document=document,
+                status=IngestionJob.STATUS_RUNNING,
+                started_at=old,
+                heartbeat_at=heartbeat,
+            )
+            for document, heartbeat in zip(documents, (old, None, timezone.now()))
+        ]
+        pending = IngestionJob.objects.create(document=documents[0])
+
+        self.assertEqual(requeue_stale_jobs(600), 1)
+        statuses = [IngestionJob.objects.get(id=job.id).status for job in jobs]
+        # 待機中のジョブがあるものは統合し、進捗を報告し続けているものは戻さない
+        self.assertEqual(
+            statuses,
+            [
+                IngestionJob.STATUS_FAILED,
+                IngestionJob.STATUS_PENDING,
+                IngestionJob.STATUS_RUNNING,
+            ],
+        )
+        self.assertEqual(
+            IngestionJob.objects.get(id=pending.id).status,
+            IngestionJob.STATUS_PENDING,
+        )
+
+    def test_embeds_in_batches(self):
+        content = "".join(f"第{i}節の本文です。" * 40 + "\n" for i in range(5))
+        document = Document.objects.create(
+            title="doc", content=content, uploaded_by=self.user
+        )
+        with mock.patch.object(
+            MockAIService,
+            "embed_batch",
+            autospec=True,
+            side_effect=MockAIService.embed_batch,
+        ) as embed_batch:
+            RAGService().process_document(document)
+
+        # RAG_EMBEDDING_BATCH_SIZE 件ずつまとめて生成し、順序も保つ
+        batches = [call[0][1] for call in embed_batch.call_args_list]
+        expected = RAGService()._split_text(content)
+        self.assertGreater(len(expected), 2)
+        self.assertEqual(
+            [len(batch) for batch in batches],
+            [2] * (len(expected) // 2) + [1] * (len(expected) % 2),
+        )
+        self.assertEqual([text for batch in batches for text in batch], expected)
+        self.assertEqual(
+            len(set(document.chunks.values_list("embedding_row", flat=True))),
+            len(expected),
+        )
+
+
+@override_settings(RAG_RETRIEVAL_MODE="lexical", RAG_RETRIEVAL_CACHE_SIZE=100)
+class RetrievalCacheTests(TestCase):
+    """検索結果キャッシュを、影響する文書の変更でだけ破棄する"""
+
+    def setUp(self):
+        self.user = User.objects.create(username="testuser")
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = override_settings(RAG_VECTOR_STORE_DIR=directory.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        reset_process_state()
+        self.addCleanup(reset_process_state)
+        self.django = self._add_document("Django はウェブフレームワークです。")
+        self._add_document("NumPy は配列計算のライブラリです。")
+
+    def _add_document(self, content):
+        document = Document.objects.create(
+            title="doc", content=content, uploaded_by=self.user
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            RAGService().process_document(document)
+        return document
+
+    def _search(self):
+        cache = get_retrieval_cache()
+        hits = cache.hits
+        results = MockAIService().search_similar_chunks("Django", top_k=3)
+        return [result["chunk"].document_id for result in results], cache.hits > hits
+
+    def test_invalidates_only_affected_entries(self):
+        self.assertEqual(self._search(), ([self.django.id], False))
+        self.assertEqual(self._search(), ([self.django.id], True))
+
+        # クエリ語を含まない文書の追加では破棄しない（IDF の変化は近似として許す）
+        self._add_document("SQLite は組み込みのデータベースです。")
+        self.assertEqual(self._search(), ([self.django.id], True))
+
+        # クエリ語を含む文書が追加されたら破棄する
+        other = self._add_document("Django の管理画面の使い方。")
+        documents, cached = self._search()
+        self.assertFalse(cached)
+        self.assertEqual(set(documents), {self.django.id, other.id})
+
+        # 結果に含まれる文書が削除されたら破棄する
+        with self.captureOnCommitCallbacks(execute=True):
+            self.django.delete()
+        self.assertEqual(self._search(), ([other.id], False))
+
+
+class EmbeddingCacheTests(TestCase):
+    """テキスト内容のハッシュをキーにした埋め込みキャッシュ"""
+
+    def _compute(self, texts):
+        self.computed.extend(texts)
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def setUp(self):
+        self.computed = []
+
+    def test_reuses_persisted_entries_across_processes(self):
+        EmbeddingCache("model").embed(["Django の本", "Django  の本"], self._compute)
+        # 空白の違いは同じ内容とみなし、1回だけ生成する
+        self.assertEqual(self.computed, ["Django の本"])
+
+        # 別プロセス（プロセス内の LRU が空）でもテーブルから引ける
+        vectors = EmbeddingCache("model").embed(["Ｄｊａｎｇｏ の本"], self._compute)
+        self.assertEqual(self.computed, ["Django の本"])
+        self.assertEqual(vectors, [[9.0, 1.0]])
+        # モデルが違えば別のエントリ
+        EmbeddingCache("other").embed(["Django の本"], self._compute)
+        self.assertEqual(len(self.computed), 2)
+
+    def test_prunes_oldest_rows_beyond_max_rows(self):
+        cache = EmbeddingCache("model", max_rows=3)
+        with mock.patch("rag_system.embedding_cache.PRUNE_INTERVAL", 1):
+            for i in range(5):
+                cache.embed([f"text {i}"], self._compute)
+
+        self.assertLessEqual(EmbeddingCacheEntry.objects.count(), 3)
+        remaining = set(EmbeddingCacheEntry.objects.values_list("pk", flat=True))
+        self.assertIn(content_hash("text 4", "model"), remaining)
+        self.assertNotIn(content_hash("text 0", "model"), remaining)
+
+
+class AnswerCacheTests(TestCase):
+    """回答キャッシュの質問文の正規化、コーパスの変更での無効化、類似質問の再利用"""
+
+    def setUp(self):
+        self.user = User.objects.create(username="testuser")
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = override_settings(RAG_VECTOR_STORE_DIR=directory.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        reset_process_state()
+        self.addCleanup(reset_process_state)
+        # 回答生成の待ち時間（モック）を飛ばす
+        sleep = mock.patch("rag_system.services.time.sleep")
+        sleep.start()
+        self.addCleanup(sleep.stop)
+        self.document = self._add_document("Django は Python 製のフレームワーク。")
+
+    def _add_document(self, content):
+        document = Document.objects.create(
+            title="doc", content=content, uploaded_by=self.user
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            RAGService().process_document(document)
+        return document
+
+    def test_normalized_question_hits_cache(self):
+        self.assertEqual(normalize_question("  ＤＪＡＮＧＯ　とは？ "), "django とは")
+        first = RAGService().answer_question("Djangoとは？", self.user)
+        self.assertNotIn("cached", first)
+        self.assertTrue(first["sources"])
+
+        cached = RAGService().answer_question("  ｄｊａｎｇｏとは", self.user)
+        self.assertTrue(cached["cached"])
+        self.assertEqual(
+            cached["model_used"], CACHED_MODEL_PREFIX + first["model_used"]
+        )
+        self.assertEqual(cached["answer"], first["answer"])
+        self.assertEqual(cached["sources"], first["sources"])
+
+    def test_document_add_and_delete_invalidate(self):
+        question = "Djangoとは？"
+        RAGService().answer_question(question, self.user)
+        other = self._add_document("Rails は Ruby 製のフレームワーク。")
+        self.assertNotIn("cached", RAGService().answer_question(question, self.user))
+        self.assertTrue(RAGService().answer_question(question, self.user)["cached"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+        self.assertNotIn("cached", RAGService().answer_question(question, self.user))
+
+    def test_similarity_threshold(self):
+        cache = AnswerCache(similarity_threshold=0.9)
+        cache.set("Djangoとは", 1, {"answer": "a"}, embedding=[1.0, 0.0])
+        self.assertEqual(cache.get("Django って何", 1, [0.99, 0.1]), {"answer": "a"})
+        self.assertIsNone(cache.get("Rails って何", 1, [0.5, 0.8]))
+        # バージョンが変わった後は類似質問でも使わない
+        self.assertIsNone(cache.get("Django って何", 2, [1.0, 0.0]))
+        # 閾値を指定しなければ完全一致（正規化後）だけ
+        exact_only = AnswerCache()
+        exact_only.set("Djangoとは", 1, {"answer": "a"}, embedding=[1.0, 0.0])
+        self.assertIsNone(exact_only.get("Django って何", 1, [1.0, 0.0]))
+        self.assertEqual(exact_only.get("DJANGOとは?", 1), {"answer": "a"})
+
+
+@override_settings(RAG_RETRIEVAL_MODE="lexical", RAG_ANSWER_CACHE_SIZE=0)
+class StreamingAnswerTests(TestCase):
+    """SSE での回答ストリーミングと、完了時の Answer の保存"""
+
+    def setUp(self):
+        user = User.objects.create(username="testuser")
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = override_settings(RAG_VECTOR_STORE_DIR=directory.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        reset_process_state()
+        self.addCleanup(reset_process_state)
+        document = Document.objects.create(
+            title="doc", content="Django のモデルの解説です。" * 20, uploaded_by=user
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            RAGService().process_document(document)
+        sleep = mock.patch("rag_system.services.time.sleep")
+        sleep.start()
+        self.addCleanup(sleep.stop)
+
+    def _events(self, response):
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        body = b"".join(response.streaming_content).decode("utf-8")
+        events = []
+        for message in body.strip().split("\n\n"):
+            event, data = message.split("\n")
+            events.append(
+                (event.removeprefix("event: "), json.loads(data.removeprefix("data: ")))
+            )
+        return events
+
+    def test_events_are_ordered_and_answer_is_saved(self):
+        for path, data in (
+            ("/api/ask/ask/", {"text": "Django のモデル", "stream": True}),
+            ("/api/ask/ask/?stream=1", {"text": "Django のモデル"}),
+        ):
+            with self.subTest(path=path):
+                events = self._events(
+                    self.client.post(path, data, content_type="application/json")
+                )
+                names = [name for name, _ in events]
+                self.assertEqual(names[:2], ["question", "sources"])
+                self.assertEqual(names[-1], "done")
+                self.assertGreater(names.count("token"), 1)
+                self.assertEqual(set(names[2:-1]), {"token"})
+                self.assertTrue(events[1][1]["sources"])
+
+                question = Question.objects.get(id=events[0][1]["question_id"])
+                tokens = "".join(data["text"] for name, data in events[2:-1])
+                self.assertEqual(question.answer.text, tokens)
+                self.assertEqual(events[-1][1]["question"]["answer"]["text"], tokens)
+                self.assertEqual(
+                    events[-1][1]["conversation_id"],
+                    str(question.conversation_id),
+                )
+
+    def test_generation_error_is_logged_and_sent_as_event(self):
+        with mock.patch.object(
+            MockAIService, "stream_answer", side_effect=RuntimeError("LLM error")
+        ), self.assertLogs("rag_system.views", "ERROR") as logs:
+            events = self._events(
+                self.client.post(
+                    "/api/ask/ask/",
+                    {"text": "Django のモデル", "stream": True},
+                    content_type="application/json",
+                )
+            )
+        self.assertEqual([name for name, _ in events], ["question", "sources", "error"])
+        self.assertIn("RuntimeError: LLM error", logs.output[0])
+        self.assertFalse(Answer.objects.exists())
+
+
+class AsyncSearchTests(TransactionTestCase):
+    """非同期の検索はクエリの埋め込みを await で取得し、検索をスレッドプールで行う
+
+    非同期版の質問APIも同じデータで確かめる。スレッドプールのDB接続から
+    見えるよう、データはコミットする（TransactionTestCase）。
+    """
+
+    def setUp(self):
+        user = User.objects.create(username="testuser")
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = override_settings(RAG_VECTOR_STORE_DIR=directory.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        reset_process_state()
+        self.addCleanup(reset_process_state)
+        document = Document.objects.create(
+            title="doc",
+            content="Django は Python 製のフレームワーク。",
+            uploaded_by=user,
+        )
+        RAGService().process_document(document)
+        self.chunk = document.chunks.get()
+
+    def _search(self, query):
+        threads = []
+        search = MockAIService.search_similar_chunks
+
+        def record_thread(service, *args, **kwargs):
+            threads.append(threading.current_thread())
+            return search(service, *args, **kwargs)
+
+        with mock.patch.object(
+            MockAIService,
+            "agenerate_embedding",
+            autospec=True,
+            side_effect=MockAIService.agenerate_embedding,
+        ) as agenerate, mock.patch.object(
+            MockAIService,
+            "embed_batch",
+            autospec=True,
+            side_effect=MockAIService.embed_batch,
+        ) as embed_batch, mock.patch.object(
+            MockAIService,
+            "search_similar_chunks",
+            autospec=True,
+            side_effect=record_thread,
+        ):
+            results = async_to_sync(MockAIService().asearch_similar_chunks)(query, 1)
+        # 同期の埋め込み生成は使わず、検索は共有の同期スレッド（メイン）以外で行う
+        embed_batch.assert_not_called()
+        self.assertIsNot(threads[0], threading.main_thread())
+        return results, agenerate
+
+    @override_settings(RAG_RETRIEVAL_MODE="dense")
+    def test_dense_search_awaits_query_embedding(self):
+        results, agenerate = self._search("Django")
+        agenerate.assert_called_once()
+        self.assertEqual(results[0]["chunk"].id, self.chunk.id)
+
+    @override_settings(RAG_RETRIEVAL_MODE="lexical")
+    def test_lexical_search_skips_query_embedding(self):
+        results, agenerate = self._search("Django")
+        agenerate.assert_not_called()
+        self.assertEqual(results[0]["chunk"].id, self.chunk.id)
+
+    @override_settings(RAG_RETRIEVAL_MODE="hybrid")
+    def test_worker_threads_close_db_connections(self):
+        closed = []
+        with mock.patch(
+            "rag_system.db_threads.close_old_connections",
+            side_effect=lambda: closed.append(threading.current_thread().name),
+        ):
+            results = async_to_sync(MockAIService().asearch_similar_chunks)("Django", 1)
+        self.assertEqual(results[0]["chunk"].id, self.chunk.id)
+        # 埋め込みキャッシュの参照・検索・ハイブリッド検索のベクトル側のそれぞれで、
+        # 実行したスレッドが前後に接続を閉じる（メインスレッドでは行わない）
+        self.assertGreaterEqual(len(closed), 6)
+        self.assertEqual(len(closed) % 2, 0)
+        self.assertNotIn(threading.main_thread().name, closed)
+        self.assertTrue(any(name.startswith("hybrid-search") for name in closed))
+
+    @override_settings(RAG_RETRIEVAL_MODE="lexical", RAG_ANSWER_CACHE_SIZE=0)
+    def test_async_endpoints_save_answers(self):
+        with mock.patch("rag_system.services.asyncio.sleep", new=mock.AsyncMock()):
+            response = self.client.post(
+                "/api/async/ask/", {"text": "Django"}, content_type="application/json"
+            )
+            self.assertEqual(response.status_code, 201)
+            data = response.json()
+            conversation_id = data["conversation_id"]
+            response = self.client.post(
+                f"/api/async/conversations/{conversation_id}/ask_question/",
+                {"text": "Python"},
+                content_type="application/json",
+            )
+            self.assertEqual(response.status_code, 201)
+
+        answer = Answer.objects.get(question_id=data["question"]["id"])
+        self.assertEqual(data["question"]["answer"]["text"], answer.text)
+        self.assertEqual(answer.sources[0]["chunk_id"], str(self.chunk.id))
+        self.assertEqual(
+            list(
+                Question.objects.filter(conversation_id=conversation_id)
+                .order_by("created_at")
+                .values_list("text", "answer__text")
+            ),
+            [("Django", answer.text), ("Python", response.json()["answer"]["text"])],
+        )
+
+        # 不正なリクエストと存在しない会話
+        response = self.client.post(
+            "/api/async/ask/", {"text": ""}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            f"/api/async/conversations/{uuid.uuid4()}/ask_question/",
+            {"text": "Django"},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,110 @@
+# backend/rag_system/tokenizer.py
+import re
+import unicodedata
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional, Protocol
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+# ひらがな・カタカナ（長音・々を含む）・漢字
+_CJK = (
+    "\u3005\u3041-\u3096\u309d\u309e\u30a1-\u30fa\u30fc-\u30fe"
+    "\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+)
+_CJK_RUN = re.compile(f"[{_CJK}]+")
+# 日本語の文字の連続、または日本語以外の英数字（\w）の連続
+_RUN = re.compile(f"[{_CJK}]+|[^\\W{_CJK}]+")
+
+
+def normalize(text: str) -> str:
+    """全角英数・半角カナなどを NFKC で揃え、小文字にする"""
+    return unicodedata.normalize("NFKC", text).lower()
+
+
+def split_runs(text: str) -> List[str]:
+    """正規化したテキストを日本語の連続と英数字の語に分ける（記号・空白は捨てる）"""
+    return _RUN.findall(normalize(text))
+
+
+class Tokenizer(Protocol):
+    """検索用のトークン分割（索引とクエリで同じものを使う）
+
+    トークンは空白を含まないこと（空白区切りでDBに保存する）。
+    """
+
+    def tokenize(self, text: str) -> List[str]: ...
+
+
+class WhitespaceTokenizer:
+    """空白で区切るだけの分割（日本語の文は1語になる）"""
+
+    def tokenize(self, text: str) -> List[str]:
+        return normalize(text).split()
+
+
+class NgramTokenizer:
+    """英数字は語単位、日本語は文字 n-gram に分割する
+
+    分かち書きされない日本語でも、クエリと本文の n-gram の一致で検索できる。
+    n 文字に満たない日本語の連続はそのまま1トークンにする。
+    """
+
+    def __init__(self, n: int = 2):
+        self.n = n
+
+    def tokenize(self, text: str) -> List[str]:
+        n = self.n
+        tokens = []
+        for run in split_runs(text):
+            if len(run) > n and _CJK_RUN.fullmatch(run):
+                tokens.extend(run[i : i + n] for i in range(len(run) - n + 1))
+            else:
+                tokens.append(run)
+        return tokens
+
+
+TOKENIZERS: Dict[str, Callable[[], Tokenizer]] = {
+    "bigram": lambda: NgramTokenizer(2),
+    "trigram": lambda: NgramTokenizer(3),
+    "whitespace": WhitespaceTokenizer,
+}
+
+
+@lru_cache(maxsize=None)
+def _load_tokenizer(name: str) -> Tokenizer:
+    if name in TOKENIZERS:
+        return TOKENIZERS[name]()
+    if "." in name:
+        try:
+            return import_string(name)()
+        except ImportError as e:
+            raise ImproperlyConfigured(
+                f"RAG_TOKENIZER のクラスを読み込めません: {name!r}"
+            ) from e
+    # 索引とクエリの分割が食い違わないよう、未知の名前は既定に戻さずエラーにする
+    raise ImproperlyConfigured(
+        f"未知のトークン分割です: {name!r}（{', '.join(TOKENIZERS)} または"
+        "クラスのドットパスを指定してください）"
+    )
+
+
+def get_tokenizer() -> Tokenizer:
+    """設定（RAG_TOKENIZER）のトークン分割を取得"""
+    return _load_tokenizer(settings.RAG_TOKENIZER or "bigram")
+
+
+def tokenize(text: str) -> List[str]:
+    """検索用にテキストをタームへ分割"""
+    return get_tokenizer().tokenize(text)
+
+
+def join_tokens(tokens: Iterable[str]) -> str:
+    """トークンをDB保存用の空白区切りの文字列にする"""
+    return " ".join(tokens)
+
+
+def split_tokens(stored: Optional[str], content: str = "") -> List[str]:
+    """保存済みのトークンを戻す（未生成の古いチャンクは本文から分割する）"""
+    return stored.split() if stored is not None else tokenize(content)
@@ -1,12 +1,14 @@
 # backend/rag_system/urls.py
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from . import async_views
 from .views import (
     DocumentViewSet,
     ConversationViewSet,
     QuestionViewSet,
     QuestionCreateView,
     UserFeedbackViewSet,
+    IngestionJobViewSet,
 )
 
 router = DefaultRouter()
@@ -15,7 +17,15 @@ router.register(r"conversations", ConversationViewSet, basename="conversations")
 router.register(r"questions", QuestionViewSet, basename="questions")
 router.register(r"feedback", UserFeedbackViewSet, basename="feedback")
 router.register(r"ask", QuestionCreateView, basename="ask")
+router.register(r"ingestion-jobs", IngestionJobViewSet, basename="ingestion-jobs")
 
 urlpatterns = [
+    # 非同期版の質問API（ASGIサーバーで動かす）
+    path("api/async/ask/", async_views.ask, name="async-ask"),
+    path(
+        "api/async/conversations/<uuid:pk>/ask_question/",
+        async_views.ask_question,
+        name="async-ask-question",
+    ),
     path("api/", include(router.urls)),
 ]
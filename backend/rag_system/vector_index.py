@@ -0,0 +1,185 @@
+# backend/rag_system/vector_index.py
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+import numpy as np
+
+from .embedding_store import EmbeddingStore, get_embedding_store, normalize
+
+
+class DenseVectorIndex:
+    """埋め込みストアの mmap 行列に対する総当たり検索インデックス
+
+    ストアの埋め込みは追記時に正規化済みのため、コサイン類似度は
+    クエリとの行列ベクトル積1回で求まる。プロセスごとに持つのは
+    行番号とチャンクIDの対応表と生存フラグだけで、ベクトル本体は共有する。
+    近似重複のチャンクは代表と同じ行を共有するため、1つの行に複数の
+    チャンクが載ることがある。行は載っているチャンクが全て削除されるまで
+    生存し、検索結果にはその行で最初に登録されたチャンクを返す。
+    """
+
+    def __init__(self, store: EmbeddingStore):
+        self._store = store
+        self.store_generation = store.generation  # 行番号を読んだ時点のストア
+        self._alive = np.zeros(16, dtype=bool)
+        self._chunk_ids: Dict[int, UUID] = {}  # 生存している行 → 代表のチャンク
+        self._shared: Dict[int, List[UUID]] = {}  # 複数のチャンクが載っている行
+        self._row_of: Dict[UUID, int] = {}
+        self._chunk_document: Dict[UUID, UUID] = {}
+        self._document_chunks: Dict[UUID, set] = {}
+        self._lock = threading.RLock()
+        self._training: Optional[threading.Thread] = None
+        self.synced_version = 0  # 反映済みの CorpusChange ID
+
+    def __len__(self):
+        return len(self._row_of)
+
+    @property
+    def is_stale(self) -> bool:
+        """構築後にストアが詰め直され、持っている行番号が使えなくなったか"""
+        return self.store_generation != self._store.generation
+
+    def __contains__(self, chunk_id: UUID) -> bool:
+        return chunk_id in self._row_of
+
+    def train(self, seed: int = 0):
+        """近似検索のモデルを学習する（総当たりのこのクラスでは何もしない）"""
+
+    def train_in_background(self) -> threading.Thread:
+        """train をバックグラウンドのスレッドで始める（学習中ならそのスレッドを返す）
+
+        学習の間も検索・追加は止めず、学習前のモデル（未学習なら総当たり）で続ける。
+        """
+        with self._lock:
+            if self._training is None or not self._training.is_alive():
+                self._training = threading.Thread(
+                    target=self.train, name=f"{type(self).__name__}.train", daemon=True
+                )
+                self._training.start()
+            return self._training
+
+    def chunk_ids_for_document(self, document_id: UUID) -> set:
+        """ドキュメントに属する登録済みチャンクID"""
+        with self._lock:
+            return set(self._document_chunks.get(document_id, ()))
+
+    def _rows(self) -> np.ndarray:
+        """生存している行番号（複数のチャンクが載っている行も1回だけ）"""
+        return np.fromiter(self._chunk_ids, dtype=np.int64, count=len(self._chunk_ids))
+
+    def add_chunk(self, chunk_id: UUID, document_id: UUID, row: int) -> bool:
+        """ストアの行番号でチャンクを登録（既存なら置き換え）
+
+        行が新しく生存したら True、他のチャンクが既に載っている行なら False。
+        """
+        with self._lock:
+            if chunk_id in self._row_of:
+                self.remove_chunk(chunk_id)
+
+            if row >= len(self._alive):
+                alive = np.zeros(max(row + 1, len(self._alive) * 2), dtype=bool)
+                alive[: len(self._alive)] = self._alive
+                self._alive = alive
+            added = not self._alive[row]
+            if added:
+                self._alive[row] = True
+                self._chunk_ids[row] = chunk_id
+            else:
+                self._shared.setdefault(row, [self._chunk_ids[row]]).append(chunk_id)
+
+            self._row_of[chunk_id] = row
+            self._chunk_document[chunk_id] = document_id
+            self._document_chunks.setdefault(document_id, set()).add(chunk_id)
+            return added
+
+    def remove_chunk(self, chunk_id: UUID):
+        """チャンクをインデックスから削除"""
+        with self._lock:
+            row = self._row_of.pop(chunk_id, None)
+            if row is None:
+                return
+            shared = self._shared.get(row)
+            if shared:
+                # 同じ行に載っている他のチャンクを残す
+                shared.remove(chunk_id)
+                self._chunk_ids[row] = shared[0]
+                if len(shared) == 1:
+                    del self._shared[row]
+            else:
+                self._alive[row] = False
+                del self._chunk_ids[row]
+
+            document_id = self._chunk_document.pop(chunk_id)
+            siblings = self._document_chunks.get(document_id)
+            if siblings is not None:
+                siblings.discard(chunk_id)
+                if not siblings:
+                    del self._document_chunks[document_id]
+
+    def remove_document(self, document_id: UUID):
+        """ドキュメントに属する全チャンクを削除"""
+        with self._lock:
+            for chunk_id in list(self._document_chunks.get(document_id, ())):
+                self.remove_chunk(chunk_id)
+
+    def search(
+        self, query_embedding: Sequence[float], top_k: int = 3
+    ) -> List[Tuple[UUID, float]]:
+        """クエリとのコサイン類似度が高い順に上位を返す"""
+        query = normalize(query_embedding)
+        with self._lock:
+            if not self._row_of:
+                return []
+
+            matrix = self._store.matrix
+            n_rows = min(len(matrix), len(self._alive))
+            scores = matrix[:n_rows] @ query
+            scores[~self._alive[:n_rows]] = -np.inf
+
+            k = min(top_k, len(self._chunk_ids))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind="stable")]
+            return [(self._chunk_ids[row], float(scores[row])) for row in top]
+
+
+_index: Optional[DenseVectorIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_vector_index(build: bool = True) -> Optional[DenseVectorIndex]:
+    """プロセス共有のベクトルインデックスを取得（初回のみDBから構築）"""
+    global _index
+    if _index is not None and _index.is_stale:
+        reset_vector_index()
+    if _index is not None or not build:
+        return _index
+
+    with _index_lock:
+        if _index is None:
+            from .models import CorpusChange, DocumentChunk
+            from .quantization import QuantizedVectorIndex, new_vector_index
+
+            index = new_vector_index(get_embedding_store())
+            index.synced_version = CorpusChange.current_version()
+            rows = (
+                DocumentChunk.objects.searchable()
+                .filter(embedding_row__isnull=False)
+                .values_list("id", "document_id", "embedding_row")
+                .iterator()
+            )
+            for chunk_id, document_id, row in rows:
+                # 量子化する場合も登録中は学習せず、最後に一度だけ学習する
+                DenseVectorIndex.add_chunk(index, chunk_id, document_id, row)
+            if isinstance(index, QuantizedVectorIndex):
+                # 学習が済むまでは総当たりで検索する
+                index.train_in_background()
+            _index = index
+    return _index
+
+
+def reset_vector_index():
+    """インデックスを破棄（次回アクセス時に再構築）"""
+    global _index
+    with _index_lock:
+        _index = None
@@ -3,8 +3,15 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny  # AllowAnyを追加
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, IntegerField, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+import json
+import logging
 import uuid
 import time
 
@@ -15,9 +22,11 @@ from .models import (
     Question,
     Answer,
     UserFeedback,
+    IngestionJob,
 )
 from .serializers import (
     DocumentSerializer,
+    DocumentListSerializer,
     DocumentChunkSerializer,
     ConversationSerializer,
     QuestionSerializer,
@@ -25,16 +34,124 @@ from .serializers import (
     UserFeedbackSerializer,
     QuestionCreateSerializer,
     ConversationDetailSerializer,
+    IngestionJobSerializer,
 )
+from .ingestion import enqueue_document, run_job
+from .pagination import ChunkCursorPagination, DocumentCursorPagination
 from .services import RAGService
 
+logger = logging.getLogger(__name__)
+
+
+def _run_job_now(job: IngestionJob):
+    """同期モードでジョブを実行する
+
+    失敗はジョブ（と読み取りエラーならドキュメントの本文）に記録されるので、
+    例外は送出せずにジョブの状態を応答で返す。
+    """
+    try:
+        run_job(job)
+    except Exception:
+        logger.exception("取り込みジョブ %s が失敗しました", job.id)
+    job.refresh_from_db()
+
+
+def _wants_stream(request, serializer) -> bool:
+    """SSEでのストリーミング応答が要求されているか"""
+    if serializer.validated_data.get("stream"):
+        return True
+    return request.query_params.get("stream", "").lower() in ("1", "true", "yes")
+
+
+def _sse_event(event: str, data) -> str:
+    """Server-Sent Events の1イベント分の文字列"""
+    payload = json.dumps(data, ensure_ascii=False, cls=DjangoJSONEncoder)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+def _streaming_answer_response(question, user, extra=None) -> StreamingHttpResponse:
+    """回答をトークンごとに SSE で送り、完了時に Answer を保存する
+
+    イベントは question → sources → token（複数）→ done の順に送る。
+    done には通常のレスポンスと同じ形式の質問データが入る。
+    """
+
+    def events():
+        yield _sse_event(
+            "question",
+            {"question_id": str(question.id), **(extra or {})},
+        )
+        try:
+            for event, data in RAGService().stream_answer(question.text, user):
+                if event != "done":
+                    yield _sse_event(event, data)
+                    continue
+                Answer.objects.create(
+                    question=question,
+                    text=data["answer"],
+                    sources=data["sources"],
+                    model_used=data["model_used"],
+                    processing_time=data["processing_time"],
+                )
+                yield _sse_event(
+                    "done",
+                    {"question": QuestionSerializer(question).data, **(extra or {})},
+                )
+        except Exception:
+            logger.exception("回答のストリーミング中にエラーが発生しました")
+            yield _sse_event("error", {"error": "回答の生成中にエラーが発生しました。"})
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # nginx 等のプロキシでバッファさせない
+    return response
+
 
 class DocumentViewSet(viewsets.ModelViewSet):
     serializer_class = DocumentSerializer
     permission_classes = [AllowAny]  # 開発時は認証なし
+    pagination_class = DocumentCursorPagination
 
     def get_queryset(self):
-        return Document.objects.all()  # 全ユーザーの文書を表示
+        # 全ユーザーの文書を表示
+        # チャンク数は返す行ごとの相関サブクエリで求める（全件の集計をしない）
+        chunks_count = (
+            DocumentChunk.objects.filter(document=OuterRef("pk"))
+            .order_by()
+            .values("document")
+            .annotate(count=Count("*"))
+            .values("count")
+        )
+        queryset = Document.objects.select_related("uploaded_by").annotate(
+            chunks_count=Coalesce(
+                Subquery(chunks_count, output_field=IntegerField()), 0
+            )
+        )
+        if self.action == "list":
+            queryset = queryset.defer("content")
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action == "list":
+            return DocumentListSerializer
+        return DocumentSerializer
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        job = self.perform_create(serializer)
+
+        # 取り込みはワーカーで行うので、ジョブIDを付けて即座に返す
+        data = dict(serializer.data)
+        data["job_id"] = str(job.id)
+        data["job_status"] = job.status
+        # 同期モードで処理を終えていれば（失敗も job_status で返す）201
+        response_status = (
+            status.HTTP_201_CREATED
+            if job.status in IngestionJob.FINISHED_STATUSES
+            else status.HTTP_202_ACCEPTED
+        )
+        return Response(data, status=response_status)
 
     def perform_create(self, serializer):
         # デフォルトユーザーを取得または作成（開発用）
@@ -43,45 +160,75 @@ class DocumentViewSet(viewsets.ModelViewSet):
         )
         document = serializer.save(uploaded_by=user)
 
-        # ファイルからテキストを抽出（簡単な実装）
-        if document.file:
-            try:
-                content = self._extract_text_from_file(document.file)
-                document.content = content
-                document.save()
-            except Exception as e:
-                document.content = f"ファイルの読み取りに失敗しました: {str(e)}"
-                document.save()
-
-        # RAGサービスでドキュメントを処理
-        rag_service = RAGService()
-        rag_service.process_document(document)
-
-    def _extract_text_from_file(self, file):
-        """ファイルからテキストを抽出（簡単な実装）"""
-        content = ""
-        try:
-            if file.name.endswith((".txt", ".md")):
-                content = file.read().decode("utf-8")
-            elif file.name.endswith(".pdf"):
-                # 実際のPDF処理は後で実装
-                content = (
-                    "PDFファイルが正常にアップロードされました。（PDF処理機能は開発中）"
-                )
-            else:
-                content = "サポートされていないファイル形式です。"
-        except Exception as e:
-            content = f"ファイル読み取りエラー: {str(e)}"
+        # テキスト抽出・チャンク分割・埋め込み生成は取り込みジョブで行う
+        job = enqueue_document(document)
+        if settings.RAG_INGESTION_MODE == "sync":
+            _run_job_now(job)
+            serializer.instance.refresh_from_db()
+        return job
+
+    def update(self, request, *args, **kwargs):
+        partial = kwargs.pop("partial", False)
+        serializer = self.get_serializer(
+            self.get_object(), data=request.data, partial=partial
+        )
+        serializer.is_valid(raise_exception=True)
+        job = self.perform_update(serializer)
+
+        data = dict(serializer.data)
+        if job is None:
+            return Response(data)
+        # 本文が変わった場合は再取り込みのジョブIDを付けて返す
+        data["job_id"] = str(job.id)
+        data["job_status"] = job.status
+        response_status = (
+            status.HTTP_200_OK
+            if job.status in IngestionJob.FINISHED_STATUSES
+            else status.HTTP_202_ACCEPTED
+        )
+        return Response(data, status=response_status)
+
+    def perform_update(self, serializer):
+        document = serializer.instance
+        file_changed = "file" in serializer.validated_data
+        content_changed = (
+            "content" in serializer.validated_data
+            and serializer.validated_data["content"] != document.content
+        )
+        if content_changed and not file_changed and document.file:
+            # 本文を直接編集したら、ファイルから抽出し直さないよう対応を外す
+            document = serializer.save(file=None)
+        else:
+            document = serializer.save()
+        if not (file_changed or content_changed):
+            return None
+
+        # 再取り込みでは変わったチャンクだけ埋め込みを作り直す
+        job = enqueue_document(document)
+        if settings.RAG_INGESTION_MODE == "sync":
+            _run_job_now(job)
+            document.refresh_from_db()
+            # 再取り込み前に annotate したチャンク数は使わない
+            document.__dict__.pop("chunks_count", None)
+        return job
 
-        return content
+    @action(detail=True, methods=["get"])
+    def jobs(self, request, pk=None):
+        """ドキュメントの取り込みジョブ一覧を取得"""
+        document = self.get_object()
+        serializer = IngestionJobSerializer(document.ingestion_jobs.all(), many=True)
+        return Response(serializer.data)
 
     @action(detail=True, methods=["get"])
     def chunks(self, request, pk=None):
         """ドキュメントのチャンク一覧を取得"""
         document = self.get_object()
-        chunks = document.chunks.all()
-        serializer = DocumentChunkSerializer(chunks, many=True)
-        return Response(serializer.data)
+        paginator = ChunkCursorPagination()
+        chunks = paginator.paginate_queryset(document.chunks.all(), request, view=self)
+        serializer = DocumentChunkSerializer(
+            chunks, many=True, context=self.get_serializer_context()
+        )
+        return paginator.get_paginated_response(serializer.data)
 
 
 class ConversationViewSet(viewsets.ModelViewSet):
@@ -89,7 +236,29 @@ class ConversationViewSet(viewsets.ModelViewSet):
     permission_classes = [AllowAny]  # 開発時は認証なし
 
     def get_queryset(self):
-        return Conversation.objects.all()  # 全ユーザーの会話を表示
+        # 全ユーザーの会話を表示
+        queryset = Conversation.objects.select_related("user")
+        if self.action == "retrieve":
+            # 質問・回答・質問者をまとめて取得する
+            return queryset.prefetch_related(
+                Prefetch(
+                    "questions",
+                    queryset=Question.objects.select_related("user", "answer"),
+                )
+            )
+        # 質問数は相関サブクエリで求める（GROUP BY にすると Meta.ordering が外れる）
+        questions_count = (
+            Question.objects.filter(conversation=OuterRef("pk"))
+            .order_by()
+            .values("conversation")
+            .annotate(count=Count("*"))
+            .values("count")
+        )
+        return queryset.annotate(
+            questions_count=Coalesce(
+                Subquery(questions_count, output_field=IntegerField()), 0
+            )
+        )
 
     def get_serializer_class(self):
         if self.action == "retrieve":
@@ -122,6 +291,18 @@ class ConversationViewSet(viewsets.ModelViewSet):
                 conversation=conversation, text=question_text, user=user
             )
 
+            # 会話のタイトルを自動生成（最初の質問の場合）
+            if not conversation.title and conversation.questions.count() == 1:
+                conversation.title = question_text[:50] + (
+                    "..." if len(question_text) > 50 else ""
+                )
+                conversation.save()
+
+            if _wants_stream(request, serializer):
+                return _streaming_answer_response(
+                    question, user, {"conversation_id": str(conversation.id)}
+                )
+
             # RAGサービスで回答を生成
             rag_service = RAGService()
             start_time = time.time()
@@ -136,13 +317,6 @@ class ConversationViewSet(viewsets.ModelViewSet):
                 processing_time=result["processing_time"],
             )
 
-            # 会話のタイトルを自動生成（最初の質問の場合）
-            if not conversation.title and conversation.questions.count() == 1:
-                conversation.title = question_text[:50] + (
-                    "..." if len(question_text) > 50 else ""
-                )
-                conversation.save()
-
             # 質問と回答をシリアライズして返す
             question_serializer = QuestionSerializer(question)
             return Response(question_serializer.data, status=status.HTTP_201_CREATED)
@@ -155,7 +329,8 @@ class QuestionViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = [AllowAny]  # 開発時は認証なし
 
     def get_queryset(self):
-        return Question.objects.all()  # 全ユーザーの質問を表示
+        # 全ユーザーの質問を表示
+        return Question.objects.select_related("user", "answer")
 
 
 class QuestionCreateView(viewsets.GenericViewSet):
@@ -192,6 +367,11 @@ class QuestionCreateView(viewsets.GenericViewSet):
                 conversation=conversation, text=question_text, user=user
             )
 
+            if _wants_stream(request, serializer):
+                return _streaming_answer_response(
+                    question, user, {"conversation_id": str(conversation.id)}
+                )
+
             # RAGサービスで回答を生成
             rag_service = RAGService()
             result = rag_service.answer_question(question_text, user)
@@ -221,7 +401,10 @@ class UserFeedbackViewSet(viewsets.ModelViewSet):
     permission_classes = [AllowAny]  # 開発時は認証なし
 
     def get_queryset(self):
-        return UserFeedback.objects.all()  # 全ユーザーのフィードバックを表示
+        # 全ユーザーのフィードバックを表示（モデルに並び順がないので新しい順を指定）
+        return UserFeedback.objects.select_related("user").order_by(
+            "-created_at", "-id"
+        )
 
     def perform_create(self, serializer):
         # デフォルトユーザーを取得または作成（開発用）
@@ -229,3 +412,17 @@ class UserFeedbackViewSet(viewsets.ModelViewSet):
             username="testuser", defaults={"email": "test@example.com"}
         )
         serializer.save(user=user)
+
+
+class IngestionJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """ドキュメント取り込みジョブの状態・進捗"""
+
+    serializer_class = IngestionJobSerializer
+    permission_classes = [AllowAny]  # 開発時は認証なし
+
+    def get_queryset(self):
+        queryset = IngestionJob.objects.select_related("document")
+        status_filter = self.request.query_params.get("status")
+        if status_filter:
+            queryset = queryset.filter(status=status_filter)
+        return queryset
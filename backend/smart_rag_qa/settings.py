@@ -64,12 +64,44 @@ TEMPLATES = [
 WSGI_APPLICATION = "smart_rag_qa.wsgi.application"
 
 # Database
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+# POSTGRES_DB が設定されていれば PostgreSQL を使う（本番向け）。
+# 未設定なら開発用の SQLite（テストも同じ設定で実行される）
+if os.getenv("POSTGRES_DB"):
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.getenv("POSTGRES_DB"),
+            "USER": os.getenv("POSTGRES_USER", "postgres"),
+            "PASSWORD": os.getenv("POSTGRES_PASSWORD", ""),
+            "HOST": os.getenv("POSTGRES_HOST", "localhost"),
+            "PORT": os.getenv("POSTGRES_PORT", "5432"),
+            # 接続を使い回す秒数（リクエストごとの接続確立を避ける）
+            "CONN_MAX_AGE": int(os.getenv("POSTGRES_CONN_MAX_AGE", "60")),
+            "CONN_HEALTH_CHECKS": True,
+        }
+    }
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": BASE_DIR / "db.sqlite3",
+            "OPTIONS": {
+                # WAL では読み取りが書き込み（取り込みワーカー）を待たない。
+                # 書き込みのロック待ちは busy_timeout まで待ってから失敗する
+                "init_command": (
+                    "PRAGMA journal_mode=WAL;"
+                    "PRAGMA synchronous=NORMAL;"
+                    "PRAGMA busy_timeout=5000;"
+                    "PRAGMA temp_store=MEMORY;"
+                    "PRAGMA cache_size=-20000;"
+                    "PRAGMA mmap_size=268435456;"
+                ),
+                # 書き込むトランザクションは開始時にロックを取り、途中での
+                # ロック昇格の失敗（database is locked）を避ける
+                "transaction_mode": "IMMEDIATE",
+            },
+        }
     }
-}
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
@@ -126,3 +158,79 @@ CORS_ALLOW_CREDENTIALS = True
 
 # OpenAI API Key (環境変数から取得)
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+
+# 検索モード（"lexical": BM25による語彙検索 / "dense": 埋め込みベクトル検索 /
+# "ann": IVF近似最近傍検索 / "hybrid": 語彙検索とベクトル検索の統合 /
+# "pg_lexical", "pg_vector": PostgreSQL の全文検索・pgvector でDB側検索 /
+# "fts": SQLite の FTS5 索引の bm25() でDB側検索）。
+# rag_system.retrievers.Retriever を実装したクラスのドットパスも指定できる
+RAG_RETRIEVAL_MODE = os.getenv("RAG_RETRIEVAL_MODE", "lexical")
+
+# 検索用トークン分割（"bigram" / "trigram": 日本語を文字 n-gram、英数字を語で分割 /
+# "whitespace": 空白区切り / クラスのドットパス）。変えたら tokenize_chunks --all
+RAG_TOKENIZER = os.getenv("RAG_TOKENIZER", "bigram")
+
+# 埋め込みストア（mmap で共有する float32 バイナリファイル）の保存先
+RAG_VECTOR_STORE_DIR = os.getenv("RAG_VECTOR_STORE_DIR", BASE_DIR / "vector_store")
+
+# ベクトル検索の埋め込みの量子化（"": 量子化しない / "int8": 次元ごとのスケールで
+# int8 に量子化 / "pq": 直積量子化、RAG_PQ_SUBSPACES 個の部分空間に分割）。
+# 符号で候補を絞り、上位 top_k × RAG_QUANTIZATION_RERANK 件を元の float32 の
+# 埋め込みで並べ直す（0なら並べ直さない）
+RAG_VECTOR_QUANTIZATION = os.getenv("RAG_VECTOR_QUANTIZATION", "")
+RAG_PQ_SUBSPACES = int(os.getenv("RAG_PQ_SUBSPACES", "16"))
+RAG_QUANTIZATION_RERANK = int(os.getenv("RAG_QUANTIZATION_RERANK", "10"))
+
+# IVF近似最近傍インデックス（nlist未指定時はベクトル数から、nprobe未指定時は
+# nlist の 1/8 に自動決定）
+RAG_ANN_NLIST = int(os.getenv("RAG_ANN_NLIST", "0")) or None
+RAG_ANN_NPROBE = int(os.getenv("RAG_ANN_NPROBE", "0")) or None
+
+# ハイブリッド検索（各検索から取る候補数、ベクトル側のインデックス、RRFの重み）
+RAG_HYBRID_CANDIDATES = int(os.getenv("RAG_HYBRID_CANDIDATES", "50"))
+RAG_HYBRID_VECTOR_INDEX = os.getenv("RAG_HYBRID_VECTOR_INDEX", "dense")
+RAG_HYBRID_WEIGHTS = [
+    float(weight) for weight in os.getenv("RAG_HYBRID_WEIGHTS", "1.0,1.0").split(",")
+]
+
+# 取り込み時の近似重複チャンクの検出（MinHash LSH で推定した Jaccard 類似度が
+# 閾値以上のチャンクは既存の代表チャンクを参照し、埋め込みと検索インデックスの
+# 項目を共有する。0で無効）。既存チャンクは dedup_chunks で判定できる
+RAG_DEDUP_THRESHOLD = float(os.getenv("RAG_DEDUP_THRESHOLD", "0.9"))
+
+# 埋め込み生成APIへ1回に送るテキスト数
+RAG_EMBEDDING_BATCH_SIZE = int(os.getenv("RAG_EMBEDDING_BATCH_SIZE", "64"))
+
+# ドキュメント取り込み（"async": ジョブ登録のみで即座に返し、
+# run_ingestion_worker が処理 / "sync": アップロードのリクエスト内で処理）
+RAG_INGESTION_MODE = os.getenv("RAG_INGESTION_MODE", "async")
+
+# ファイルから抽出したテキストを Document.content に保存する上限文字数
+# （チャンク化はファイル全体に対して行う）
+RAG_DOCUMENT_CONTENT_LIMIT = int(os.getenv("RAG_DOCUMENT_CONTENT_LIMIT", "1000000"))
+
+# 回答キャッシュ（正規化した質問文＋コーパスのバージョンがキー。0で無効）
+# BACKEND に CACHES のエイリアスを指定するとプロセス間で共有する。
+# SIMILARITY を指定すると質問の埋め込みの類似度が閾値以上の回答も再利用する
+RAG_ANSWER_CACHE_SIZE = int(os.getenv("RAG_ANSWER_CACHE_SIZE", "1024"))
+RAG_ANSWER_CACHE_BACKEND = os.getenv("RAG_ANSWER_CACHE_BACKEND") or None
+RAG_ANSWER_CACHE_SIMILARITY = (
+    float(os.getenv("RAG_ANSWER_CACHE_SIMILARITY"))
+    if os.getenv("RAG_ANSWER_CACHE_SIMILARITY")
+    else None
+)
+RAG_ANSWER_CACHE_TIMEOUT = int(os.getenv("RAG_ANSWER_CACHE_TIMEOUT", "3600"))
+
+# 検索結果キャッシュ（プロセス内 LRU。0で無効。TTLは秒、0で無期限）
+RAG_RETRIEVAL_CACHE_SIZE = int(os.getenv("RAG_RETRIEVAL_CACHE_SIZE", "4096"))
+RAG_RETRIEVAL_CACHE_TTL = int(os.getenv("RAG_RETRIEVAL_CACHE_TTL", "300"))
+
+# 埋め込みキャッシュ（テキスト内容の SHA-256 がキー。プロセス内 LRU の件数と、
+# EmbeddingCacheEntry テーブルへ保存して再起動後も使うかどうか）
+RAG_EMBEDDING_CACHE = os.getenv("RAG_EMBEDDING_CACHE", "true").lower() == "true"
+RAG_EMBEDDING_CACHE_SIZE = int(os.getenv("RAG_EMBEDDING_CACHE_SIZE", "10000"))
+RAG_EMBEDDING_CACHE_PERSIST = (
+    os.getenv("RAG_EMBEDDING_CACHE_PERSIST", "true").lower() == "true"
+)
+# EmbeddingCacheEntry テーブルの最大行数（超えたら古いものから削除、0で無制限）
+RAG_EMBEDDING_CACHE_MAX_ROWS = int(os.getenv("RAG_EMBEDDING_CACHE_MAX_ROWS", "1000000"))